@@ -1,15 +1,70 @@
+import json
 import os
+import time
 from dotenv import load_dotenv
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, TypeHandler, filters
+from src.managers.chains import warm_up
+from src.managers.executor import run_blocking
+from src.managers.metrics import start_metrics_exporter
+from src.offer_search.title_index import get_title_index
 from src.telegram_handler import start, handle_message, generate_cv_command, clear_embeddings_command, insert_job_command, \
     find_job_command, write_cv_command
 
 load_dotenv()
 
 BOT_TOKEN = os.environ.get("TELEGRAM_TOKEN")
+# Every incoming update is appended here (JSON lines) for replay by benchmarks/loadtest.py;
+# the file holds users' messages and CVs, keep it private
+RECORD_UPDATES_PATH = os.environ.get("RECORD_UPDATES_PATH")
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+
+def build_application(token: str = BOT_TOKEN, request=None, get_updates_request=None) -> Application:
+    """The bot with all its handlers; `request` objects replace the HTTP client (e.g. a mock Bot API)."""
+    # Handlers serialize per user themselves, so updates of different users may run side by side
+    builder = ApplicationBuilder().token(token).concurrent_updates(True)
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    app = builder.build()
+    register_handlers(app)
+    return app
+
+
+def _append_lines(path: str, lines: list):
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def update_recorder(path: str):
+    started = time.monotonic()
+    buffer = []
+    writing = False
+
+    async def record(update: Update, context):
+        nonlocal buffer, writing
+        buffer.append(json.dumps({"at": round(time.monotonic() - started, 3), "update": update.to_dict()},
+                                 ensure_ascii=False) + "\n")
+        if writing:
+            # The update already writing picks this line up, in arrival order
+            return
+        # A single writer at a time appends everything buffered, off the event loop
+        writing = True
+        try:
+            while buffer:
+                lines, buffer = buffer, []
+                await run_blocking(_append_lines, path, lines)
+        finally:
+            writing = False
+
+    return record
+
+
+def register_handlers(app: Application, record_updates_path: str = RECORD_UPDATES_PATH):
+    if record_updates_path:
+        # Group -1 runs before the bot's own handlers and does not stop them
+        app.add_handler(TypeHandler(Update, update_recorder(record_updates_path)), group=-1)
 
     app.add_handler(CommandHandler("start", start))
     # CV generating commands
@@ -26,9 +81,21 @@ def main():
     # General message handler (CV, job offer, etc.)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+
+def main():
+    # Build the LLM chains before the first update arrives
+    print(f"🔥 Warmed up chains: {', '.join(warm_up())}")
+    print(f"📇 Indexed {len(get_title_index())} job offers")
+    exporters = start_metrics_exporter()
+    if exporters:
+        print(f"📊 Metrics: {', '.join(exporters)}")
+    app = build_application()
+    if RECORD_UPDATES_PATH:
+        print(f"⏺️ Recording updates to {RECORD_UPDATES_PATH}")
+
     print("🤖 Bot is running...")
     app.run_polling()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
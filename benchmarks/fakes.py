@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import math
+import random
+import time
+from types import SimpleNamespace
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+TITLES = (
+    "Python Developer", "Senior Backend Developer", "Data Engineer", "Machine Learning Engineer",
+    "Frontend Developer", "DevOps Engineer", "Java Developer", "QA Automation Engineer",
+    "Data Analyst", "Full Stack Developer", "Android Developer", "Cloud Architect",
+)
+SENIORITIES = ("Junior", "Mid", "Senior", "Lead")
+COMPANIES = ("Acme", "Globex", "Initech", "Umbrella", "Hooli", "Vandelay", "Stark Industries", "Wayne Tech")
+LOCATIONS = ("Warszawa", "Kraków", "Wrocław", "Gdańsk", "Remote")
+SKILLS = (
+    "Python", "Django", "FastAPI", "PostgreSQL", "Docker", "Kubernetes", "AWS", "Terraform", "React",
+    "TypeScript", "Java", "Spring", "Kafka", "Airflow", "Spark", "SQL", "Pandas", "PyTorch", "Git", "Linux",
+)
+
+EVALUATION = (
+    "Score: 9/10\n"
+    "The resume is well structured, every required section is present and the experience matches "
+    "the offer. Consider quantifying two more achievements."
+)
+
+
+def synthetic_offers(count: int, seed: int = 0, prefix: str = "bench") -> list:
+    """Deterministic scraped-offer dicts with realistic field sizes."""
+    rng = random.Random(seed)
+    offers = []
+    for i in range(count):
+        title = f"{rng.choice(SENIORITIES)} {rng.choice(TITLES)}"
+        skills = rng.sample(SKILLS, 6)
+        paragraphs = [
+            f"We are looking for a {title} to join our product team building data-heavy web services.",
+            "Requirements: " + ", ".join(skills[:4]) + ". At least three years of commercial experience.",
+            "Nice to have: " + ", ".join(skills[4:]) + ". Experience with code reviews and mentoring.",
+            "Responsibilities: designing APIs, optimizing database queries, writing tests and "
+            "owning features from design to production.",
+            "What we offer: B2B or employment contract, private healthcare, hybrid work and a training budget.",
+        ]
+        offers.append({
+            "title": title,
+            "company": rng.choice(COMPANIES),
+            "location": rng.choice(LOCATIONS),
+            "url": f"https://jobs.example.com/{prefix}/{seed}/{i}",
+            "source": "benchmark",
+            "description": " ".join(paragraphs * rng.randint(1, 3)),
+        })
+    return offers
+
+
+def sample_cv(seed: int = 0) -> str:
+    """A markdown resume that passes the local pre-check, so it is evaluated by the (fake) LLM."""
+    rng = random.Random(seed)
+    skills = rng.sample(SKILLS, 10)
+    jobs = "\n".join(
+        f"- {rng.choice(TITLES)} at {rng.choice(COMPANIES)} ({2015 + i}-{2017 + i}): built and operated "
+        f"services in {skills[i]} and {skills[i + 1]}, optimized database queries and reviewed code."
+        for i in range(4)
+    )
+    return (
+        f"# Jan Kowalski {seed}\n"
+        f"jan.kowalski{seed}@example.com | +48 600 100 {seed % 1000:03d}\n\n"
+        "## About Me\n"
+        "Backend developer with eight years of commercial experience designing APIs, data pipelines and "
+        "cloud infrastructure. I care about readable code, automated tests and measurable results.\n\n"
+        f"## Experience\n{jobs}\n\n"
+        "## Education\n- MSc in Computer Science, Polish-Japanese Academy of Information Technology\n\n"
+        "## Skills\n" + "\n".join(f"- {skill}" for skill in skills) + "\n\n"
+        "## Languages\n- Polish (native)\n- English (C1)\n"
+    )
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering locally after `latency` seconds (plus `token_latency` per streamed
+    token). Evaluation prompts get a fixed passing score, everything else a sample resume.
+    Token usage is reported like OpenAI does, so metrics see the calls.
+    """
+
+    latency: float = 0.5
+    token_latency: float = 0.0
+    model_name: str = "fake-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages: list) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if "recruiter" in prompt.lower():
+            return EVALUATION
+        return sample_cv(len(prompt))
+
+    def _usage(self, messages: list, text: str) -> dict:
+        input_tokens = sum(len(str(message.content).split()) for message in messages)
+        output_tokens = len(text.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _result(self, messages: list, text: str) -> ChatResult:
+        usage = self._usage(messages, text)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))],
+            llm_output={"model_name": self.model_name, "token_usage": {
+                "prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"]}},
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._respond(messages)
+        time.sleep(self.latency + self.token_latency * len(text.split()))
+        return self._result(messages, text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._respond(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(text.split()))
+        return self._result(messages, text)
+
+    def _chunks(self, messages: list, text: str) -> list:
+        words = text.split(" ")
+        chunks = [AIMessageChunk(content=word + (" " if i < len(words) - 1 else "")) for i, word in enumerate(words)]
+        chunks[-1].usage_metadata = self._usage(messages, text)
+        return chunks
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        time.sleep(self.latency)
+        for chunk in self._chunks(messages, text):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(messages, text):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic hashed bag-of-words vectors: texts sharing words are close, so retrieval
+    returns meaningful neighbours. Each request costs `latency` plus `per_text_latency` per text.
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0, per_text_latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text: str) -> list:
+        vector = [0.0] * self.size
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.size] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def _delay(self, texts: list) -> float:
+        return self.latency + self.per_text_latency * len(texts)
+
+    def embed_documents(self, texts: list) -> list:
+        time.sleep(self._delay(texts))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_documents(self, texts: list) -> list:
+        await asyncio.sleep(self._delay(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeMessage:
+    """The part of telegram.Message the handlers use; every API call costs `api_latency`."""
+
+    def __init__(self, user_id: int, text: str = "", api_latency: float = 0.0, calls: dict = None):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.text = text
+        self.api_latency = api_latency
+        self.calls = calls if calls is not None else {}
+
+    async def _api(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.api_latency)
+
+    async def reply_text(self, text, **kwargs):
+        await self._api("sendMessage")
+        return FakeMessage(self.from_user.id, text, self.api_latency, self.calls)
+
+    async def edit_text(self, text, **kwargs):
+        await self._api("editMessageText")
+        self.text = text
+        return self
+
+    async def delete(self):
+        await self._api("deleteMessage")
+        return True
+
+    async def reply_document(self, document, filename=None, **kwargs):
+        document.read()
+        await self._api("sendDocument")
+        return FakeMessage(self.from_user.id, "", self.api_latency, self.calls)
+
+
+def make_update(user_id: int, text: str, api_latency: float = 0.0, calls: dict = None):
+    """A stand-in for telegram.Update carrying one text message from `user_id`."""
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        message=FakeMessage(user_id, text, api_latency, calls),
+    )
+
+
+def install_fakes(chat: BaseChatModel, embedder: Embeddings):
+    """Route every LLM and embedding call of the bot to the given stand-ins."""
+    from src import advisor, cv_evaluator, writing_cv
+    from src.managers import chains, knowledge
+
+    writing_cv.chat = chat
+    cv_evaluator.chat = chat
+    knowledge.ChatOpenAI = lambda **kwargs: chat
+    advisor.ChatOpenAI = lambda **kwargs: chat
+    # The cache stays in front, as in production; only misses reach the fake
+    knowledge.embeddings.underlying = embedder
+    # Chains built before this point captured the real models
+    chains._chains.clear()
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from benchmarks.run import configure_environment
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "CV Advisor", "username": "cv_advisor_loadtest_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+# Seconds of think time between two messages of a synthesized user
+THINK_TIME = (1.0, 5.0)
+# User ids of every repetition are shifted by this much, so repetitions never share state
+USER_ID_STRIDE = 10_000_000
+# Event loop lag from which on a wake-up counts as a stall
+LOOP_STALL_THRESHOLD = 0.05
+
+
+class MockBotRequest(BaseRequest):
+    """
+    Answers Bot API calls locally after `latency` seconds, with just enough of a Message for the
+    handlers to continue. `flood_rate` of the calls fail with 429 like a throttled real bot.
+    """
+
+    def __init__(self, latency: float = 0.05, flood_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params: dict) -> dict:
+        message_id = params.get("message_id") or next(self._message_ids)
+        return {"message_id": int(message_id), "date": int(time.time()), "from": BOT_USER,
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}, "text": params.get("text", "")}
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        await asyncio.sleep(self.latency)
+        if api_method != "getMe" and self._random.random() < self.flood_rate:
+            self.calls["429"] += 1
+            return 429, json.dumps({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                    "parameters": {"retry_after": 1}}).encode()
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+               "from": user, "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def synthesize(users: int, ramp: float = 0.0, seed: int = 0, think_time: tuple = THINK_TIME) -> list:
+    """
+    (seconds from the start, update dict) for `users` users walking through the whole
+    conversation, their first message spread uniformly over `ramp` seconds (0: all at once).
+    """
+    from benchmarks.fakes import sample_cv, synthetic_offers
+
+    rng = random.Random(seed)
+    offers = synthetic_offers(users, seed=seed, prefix="loadtest")
+    queries = ("python developer", "data engineer", "devops engineer", "frontend developer")
+    stream = []
+    update_ids = itertools.count(1)
+    for i in range(users):
+        user_id = 1000 + i
+        offer = offers[i]
+        steps = ["/start", sample_cv(user_id), "/find_job", rng.choice(queries), "/insert_job",
+                 f"{offer['title']}\n{offer['description']}", "/write_cv"]
+        at = rng.uniform(0, ramp)
+        for text in steps:
+            stream.append((at, message_update(next(update_ids), user_id, text)))
+            at += rng.uniform(*think_time)
+    return sorted(stream, key=lambda item: item[0])
+
+
+def load_stream(path: str) -> list:
+    """Read updates recorded by the bot (RECORD_UPDATES_PATH) or saved by --save."""
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [(record["at"], record["update"]) for record in records]
+
+
+def save_stream(stream: list, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for at, update in stream:
+            f.write(json.dumps({"at": at, "update": update}, ensure_ascii=False) + "\n")
+
+
+def shift_users(update: dict, offset: int) -> dict:
+    update = json.loads(json.dumps(update))
+    message = update.get("message") or {}
+    for key in ("from", "chat"):
+        if key in message:
+            message[key]["id"] += offset
+    return update
+
+
+class LoopMonitor:
+    """Measures how late an `interval`-second sleep wakes up; the lateness is time the loop was blocked."""
+
+    def __init__(self, interval: float = 0.01, threshold: float = 0.05):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(time.perf_counter() - started - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    def summary(self) -> dict:
+        stalls = [lag for lag in self.lags if lag >= self.threshold]
+        return {"max": max(self.lags, default=0.0), "stalls": len(stalls), "stalled_seconds": sum(stalls),
+                "p95": percentile(self.lags, 0.95)}
+
+
+def percentile(samples: list, q: float) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(sorted(samples), n=100, method="inclusive")[int(q * 100) - 1]
+
+
+class Replay:
+    """Feeds a timed update stream to an Application and records the outcome of every update."""
+
+    def __init__(self, app, concurrency: int = 64):
+        self.app = app
+        self.concurrency = concurrency
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.error_types = Counter()
+        self._labels = {}
+        # The last command of every user, so plain messages are reported by what they answer
+        self._last_command = {}
+        app.add_error_handler(self._on_error)
+
+    def _label(self, update: Update) -> str:
+        text = (update.message.text or "") if update.message else ""
+        if text.startswith("/"):
+            command = text.split()[0][1:]
+            self._last_command[update.effective_user.id] = command
+            return command
+        return f"message after /{self._last_command.get(update.effective_user.id, 'start')}"
+
+    async def _on_error(self, update, context):
+        label = self._labels.get(id(update), "unknown")
+        self.errors[label] += 1
+        self.error_types[f"{label}: {type(context.error).__name__}"] += 1
+
+    def close(self):
+        self.app.remove_error_handler(self._on_error)
+
+    async def run(self, stream: list, speed: float = 1.0, user_offset: int = 0) -> float:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        async def feed(at, data):
+            await asyncio.sleep(max(started + at / speed - loop.time(), 0))
+            update = Update.de_json(shift_users(data, user_offset), self.app.bot)
+            label = self._label(update)
+            self._labels[id(update)] = label
+            queued = time.perf_counter()
+            async with semaphore:
+                await self.app.process_update(update)
+            self.latencies[label].append(time.perf_counter() - queued)
+            self._labels.pop(id(update), None)
+
+        # Updates of one user are fed in order, like Telegram delivers them
+        by_user = defaultdict(list)
+        for at, data in stream:
+            by_user[(data.get("message") or {}).get("from", {}).get("id")].append((at, data))
+
+        async def user(updates):
+            for at, data in updates:
+                await feed(at, data)
+
+        await asyncio.gather(*(user(updates) for updates in by_user.values()))
+        return loop.time() - started
+
+
+def report(replay: Replay, elapsed: float, loop: dict, calls: Counter):
+    total = sum(len(values) for values in replay.latencies.values())
+    errors = sum(replay.errors.values())
+    print(f"{'update':<32} {'n':>5} {'errors':>7} {'p50':>9} {'p95':>9} {'max':>9}")
+    for label, values in sorted(replay.latencies.items()):
+        print(f"{label:<32} {len(values):>5} {replay.errors.get(label, 0):>7} {statistics.median(values):>8.2f}s "
+              f"{percentile(values, 0.95):>8.2f}s {max(values):>8.2f}s")
+    print(f"⏱️ {total} updates in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f}/s), "
+          f"error rate {errors / max(total, 1):.1%}")
+    print(f"🧊 Event loop: {loop['stalls']} stalls >= {LOOP_STALL_THRESHOLD * 1000:.0f}ms, "
+          f"{loop['stalled_seconds']:.2f}s stalled, max lag {loop['max'] * 1000:.0f}ms, p95 lag {loop['p95'] * 1000:.1f}ms")
+    print(f"📨 Bot API calls: {dict(calls)}")
+    if replay.error_types:
+        print("❌ Errors: " + ", ".join(f"{label} x{count}" for label, count in replay.error_types.most_common()))
+
+
+async def run(args, workdir: str):
+    if not args.live:
+        from benchmarks import fakes, suites
+        fakes.install_fakes(
+            fakes.FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency),
+            fakes.FakeEmbeddings(latency=args.embed_latency, per_text_latency=args.embed_latency / 100),
+        )
+        suites.prepare_catalog(args.offers)
+    from app import build_application
+    from src.managers.metrics import summary
+
+    stream = load_stream(args.replay) if args.replay else synthesize(args.users, args.ramp, args.seed)
+    if args.save:
+        save_stream(stream, args.save)
+        print(f"💾 Saved {len(stream)} updates to {args.save}")
+
+    request = MockBotRequest(args.telegram_latency, args.flood_rate, args.seed)
+    app = build_application("123456:LOADTEST", request=request, get_updates_request=MockBotRequest())
+    await app.initialize()
+    try:
+        for repetition, speed in enumerate(args.speed):
+            print(f"\n🚀 {len(stream)} updates at {speed:g}x speed, concurrency {args.concurrency}")
+            replay = Replay(app, args.concurrency)
+            request.calls.clear()
+            monitor = LoopMonitor(threshold=LOOP_STALL_THRESHOLD)
+            monitor.start()
+            elapsed = await replay.run(stream, speed, user_offset=repetition * USER_ID_STRIDE)
+            await monitor.stop()
+            report(replay, elapsed, monitor.summary(), request.calls)
+            replay.close()
+    finally:
+        await app.shutdown()
+    if args.stages:
+        print(f"\n📊 Stages\n{summary()}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded or synthesized Telegram updates against the bot with a mock Bot API")
+    parser.add_argument("--replay", help="JSON lines of {at, update}, e.g. recorded with RECORD_UPDATES_PATH")
+    parser.add_argument("--users", type=int, default=50, help="Synthesized users (without --replay)")
+    parser.add_argument("--ramp", type=float, default=0.0,
+                        help="Seconds over which synthesized users arrive; 0 sends everyone at once")
+    parser.add_argument("--save", help="Write the update stream to this file")
+    parser.add_argument("--speed", type=lambda value: [float(v) for v in value.split(",")], default=[1.0],
+                        help="Replay speed multiplier(s), comma separated to find where the bot saturates")
+    parser.add_argument("--concurrency", type=int, default=256, help="Updates processed at the same time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--offers", type=int, default=2000, help="Synthetic offers in the catalog")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per fake chat model call")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Seconds per streamed fake token")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per fake embedding request")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Seconds per mock Bot API call")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Share of Bot API calls answered with 429")
+    parser.add_argument("--stages", action="store_true", help="Print the per-stage metrics afterwards")
+    parser.add_argument("--live", action="store_true",
+                        help="Use the configured OpenAI/vector store instead of the local stand-ins")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="teg-loadtest-")
+    if not args.live:
+        configure_environment(workdir)
+    else:
+        # Live models and vector store, but the synthetic offers users insert stay out of the real dedup index
+        os.environ["OFFER_DEDUP_PATH"] = os.path.join(workdir, "offer_dedup.sqlite3")
+    try:
+        asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
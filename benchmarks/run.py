@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+SUITES = ("handlers", "ingestion", "pdf", "retrieval")
+# Latency changes smaller than this are noise, whatever the relative difference
+MIN_LATENCY_DELTA = 0.01
+
+
+def configure_environment(workdir: str):
+    """Point every store of the bot at `workdir`; must run before `src` is imported."""
+    os.environ.update({
+        "VECTOR_BACKEND": "local",
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vector_store"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "STATE_DB_PATH": os.path.join(workdir, "user_states.sqlite3"),
+        "OFFER_CATALOG_PATH": os.path.join(workdir, "offers.sqlite3"),
+        "OFFER_DEDUP_PATH": os.path.join(workdir, "offer_dedup.sqlite3"),
+        "MATCHES_PATH": os.path.join(workdir, "matches.sqlite3"),
+        "RESPONSE_CACHE_PATH": os.path.join(workdir, "response_cache.sqlite3"),
+        "PDF_CACHE_DIR": os.path.join(workdir, "pdf_cache"),
+        # Nothing may leave the machine: no tokenizer download, no traces; the approximate
+        # tokenizer also makes chunk sizes, and so results, the same on every host
+        "CHUNK_TOKENIZER": "approximate",
+        "LANGSMITH_TRACING": "false",
+        "LANGCHAIN_TRACING_V2": "false",
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for stat in ("p50", "p95"):
+            if stat in current and stat in previous:
+                if current[stat] > previous[stat] * (1 + tolerance) and \
+                        current[stat] - previous[stat] > MIN_LATENCY_DELTA:
+                    regressions.append(f"{name} {stat}: {previous[stat] * 1000:.1f}ms -> {current[stat] * 1000:.1f}ms")
+        if "rate" in current and "rate" in previous and current["rate"] < previous["rate"] * (1 - tolerance):
+            regressions.append(f"{name}: {previous['rate']:.1f} -> {current['rate']:.1f} {current['unit']}")
+    return regressions
+
+
+def report(results: dict, baseline: dict):
+    for name, result in results.items():
+        previous = baseline.get(name, {})
+        if "p50" in result:
+            line = f"{name:<34} n={result['n']:<5} p50={result['p50'] * 1000:9.1f}ms p95={result['p95'] * 1000:9.1f}ms"
+            if "p95" in previous:
+                line += f"  (baseline p95 {previous['p95'] * 1000:.1f}ms)"
+        elif "rate" in result:
+            line = f"{name:<34} n={result['n']:<5} {result['rate']:.1f} {result['unit']}"
+            if "rate" in previous:
+                line += f"  (baseline {previous['rate']:.1f})"
+        else:
+            line = f"{name:<34} n={result['n']:<5} {result.get('calls', '')}"
+        print(line)
+
+
+async def run(args, workdir: str) -> dict:
+    from benchmarks import fakes
+    from benchmarks import suites
+
+    fakes.install_fakes(
+        fakes.FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency),
+        fakes.FakeEmbeddings(latency=args.embed_latency, per_text_latency=args.embed_latency / 100),
+    )
+    results = {}
+    if "handlers" in args.suites:
+        suites.prepare_catalog(args.offers)
+        results.update(await suites.bench_handlers(args.users, args.telegram_latency))
+    if "ingestion" in args.suites or "retrieval" in args.suites:
+        results.update(suites.bench_ingestion(workdir, args.offers))
+        results.update(await suites.bench_pipeline(workdir, args.offers))
+    if "pdf" in args.suites:
+        results.update(suites.bench_render_pdf(args.renders))
+    if "retrieval" in args.suites:
+        if "handlers" not in args.suites:
+            suites.prepare_catalog(args.offers)
+        results.update(await suites.bench_retrieval(args.queries))
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of the bot with a fake LLM, a fake embedder and the local vector store")
+    parser.add_argument("suites", nargs="*", metavar="suite",
+                        help=f"Benchmarks to run ({', '.join(SUITES)}); all by default")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent simulated Telegram users")
+    parser.add_argument("--offers", type=int, default=2000, help="Synthetic offers to ingest and search")
+    parser.add_argument("--queries", type=int, default=200, help="Retrieval queries per measured path")
+    parser.add_argument("--renders", type=int, default=10, help="PDFs rendered")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per fake chat model call")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Seconds per streamed fake token")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per fake embedding request")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Seconds per fake Telegram API call")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown before a result counts as a regression")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    args.suites = args.suites or list(SUITES)
+
+    workdir = tempfile.mkdtemp(prefix="teg-benchmark-")
+    configure_environment(workdir)
+    try:
+        results = asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"❌ Regression: {regression}")
+    if baseline and not regressions:
+        print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
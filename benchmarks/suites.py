@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import time
+from collections import defaultdict
+
+from benchmarks.fakes import make_update, sample_cv, synthetic_offers
+from src.advisor import afind_job_offers
+from src.managers.knowledge import OFFERS_NAMESPACE, ingest_to_knowledge_base, user_retriever, vectorstore
+from src.offer_search.catalog import OfferCatalog, get_catalog
+from src.offer_search.dedup import NearDuplicateIndex
+from src.offer_search.offer_ingestion import ingest_offers_bulk
+from src.offer_search.pipeline import OfferPipeline
+from src.telegram_handler import start, handle_message, write_cv_command, clear_embeddings_command, \
+    insert_job_command, find_job_command
+from src.writing_cv import CV_CONTEXT_CANDIDATES, CV_CONTEXT_TOKENS, create_pdf_from_text
+
+base_dir = os.path.dirname(os.path.dirname(__file__))
+QUERIES = ("python developer", "senior backend django postgresql", "data engineer airflow spark",
+           "machine learning pytorch", "devops kubernetes terraform aws", "frontend react typescript")
+
+
+def latency(samples: list) -> dict:
+    samples = sorted(samples)
+    if len(samples) < 2:
+        p50 = p95 = samples[0] if samples else 0.0
+    else:
+        cuts = statistics.quantiles(samples, n=20, method="inclusive")
+        p50, p95 = statistics.median(samples), cuts[18]
+    return {"n": len(samples), "p50": p50, "p95": p95}
+
+
+def rate(count: int, elapsed: float, unit: str) -> dict:
+    return {"n": count, "rate": count / max(elapsed, 1e-9), "unit": unit}
+
+
+@contextlib.contextmanager
+def quiet():
+    # Ingestion prints progress per batch, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def prepare_catalog(offers: int = 2000):
+    """Fill the bot's offer catalog, which /find_job searches through the title index."""
+    get_catalog().upsert_many(synthetic_offers(offers, seed=3, prefix="catalog"))
+
+
+async def bench_handlers(users: int = 20, api_latency: float = 0.05) -> dict:
+    """Every simulated user walks the whole conversation; all users run concurrently."""
+    samples, calls = defaultdict(list), {}
+    offers = synthetic_offers(users, seed=7, prefix="handlers")
+
+    async def call(name, handler, user_id, text):
+        started = time.perf_counter()
+        await handler(make_update(user_id, text, api_latency, calls), None)
+        samples[name].append(time.perf_counter() - started)
+
+    async def conversation(user_id):
+        await call("start", start, user_id, "/start")
+        await call("upload_cv", handle_message, user_id, sample_cv(user_id))
+        await call("find_job_command", find_job_command, user_id, "/find_job")
+        await call("find_job", handle_message, user_id, QUERIES[user_id % len(QUERIES)])
+        await call("insert_job_command", insert_job_command, user_id, "/insert_job")
+        offer = offers[user_id % len(offers)]
+        await call("insert_job", handle_message, user_id, f"{offer['title']}\n{offer['description']}")
+        await call("write_cv", write_cv_command, user_id, "/write_cv")
+        await call("clear_embeddings", clear_embeddings_command, user_id, "/clear_embeddings")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(conversation(1_000_000 + user_id) for user_id in range(users)))
+    elapsed = time.perf_counter() - started
+
+    results = {f"handler.{name}": latency(values) for name, values in samples.items()}
+    results["handler.throughput"] = rate(sum(len(values) for values in samples.values()), elapsed, "updates/s")
+    results["handler.telegram_calls"] = {"n": sum(calls.values()), "calls": dict(calls)}
+    return results
+
+
+def bench_ingestion(workdir: str, offers: int = 2000, batch_size: int = 500, workers: int = 4) -> dict:
+    catalog = OfferCatalog(os.path.join(workdir, "ingestion.sqlite3"), legacy_path=None)
+    jobs = synthetic_offers(offers, seed=1, prefix="ingestion")
+    catalog.upsert_many(jobs)
+    dedup_index = NearDuplicateIndex(os.path.join(workdir, "ingestion_dedup.sqlite3"))
+    started = time.perf_counter()
+    with quiet():
+        ingested = ingest_offers_bulk(jobs, batch_size=batch_size, workers=workers, checkpoint_path=None,
+                                      dedup_index=dedup_index, catalog=catalog)
+    return {"ingestion.offer_ingestion": rate(ingested, time.perf_counter() - started, "offers/s")}
+
+
+async def bench_pipeline(workdir: str, offers: int = 2000) -> dict:
+    catalog = OfferCatalog(os.path.join(workdir, "pipeline.sqlite3"), legacy_path=None)
+    pipeline = OfferPipeline(NearDuplicateIndex(os.path.join(workdir, "pipeline_dedup.sqlite3")), catalog,
+                             report_interval=3600)
+
+    async def stream():
+        for offer in synthetic_offers(offers, seed=2, prefix="pipeline"):
+            yield offer
+
+    started = time.perf_counter()
+    with quiet():
+        counts = await pipeline.run(stream())
+    return {"ingestion.pipeline": rate(counts["upsert"], time.perf_counter() - started, "offers/s")}
+
+
+def _wkhtmltopdf_path():
+    path = os.environ.get("WKHTMLTOPDF_PATH") or os.path.join(base_dir, "wkhtmltopdf", "bin", "wkhtmltopdf.exe")
+    return path if os.path.exists(path) else None
+
+
+def bench_render_pdf(renders: int = 10) -> dict:
+    wkhtmltopdf_path = _wkhtmltopdf_path()
+    if not (wkhtmltopdf_path or shutil.which("wkhtmltopdf")):
+        print("⚠️ wkhtmltopdf not found, skipping the PDF benchmark")
+        return {}
+    cold, cached = [], []
+    for i in range(renders):
+        # A different text every time, so nothing is served from the PDF cache
+        text = sample_cv(i) + f"\n## Interests\n- Benchmark run {time.time_ns()}\n"
+        started = time.perf_counter()
+        create_pdf_from_text(text, wkhtmltopdf_path=wkhtmltopdf_path)
+        cold.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        create_pdf_from_text(text, wkhtmltopdf_path=wkhtmltopdf_path)
+        cached.append(time.perf_counter() - started)
+    return {"render_pdf.cold": latency(cold), "render_pdf.cached": latency(cached)}
+
+
+async def bench_retrieval(queries: int = 200) -> dict:
+    """Needs the offers namespace filled, run it after the ingestion benchmarks."""
+    user_id = 2_000_000
+    ingest_to_knowledge_base(sample_cv(user_id), user_id)
+    retriever = user_retriever(k=CV_CONTEXT_CANDIDATES, token_budget=CV_CONTEXT_TOKENS)
+    samples = defaultdict(list)
+
+    async def measure(name, coroutine):
+        started = time.perf_counter()
+        await coroutine
+        samples[name].append(time.perf_counter() - started)
+
+    for i in range(queries):
+        # A unique suffix per query, so query embeddings are not served from the embedding cache
+        query = f"{QUERIES[i % len(QUERIES)]} {i}"
+        await measure("retrieval.user_context", retriever.ainvoke({"input": query, "user_id": user_id}))
+        await measure("retrieval.offers_vector",
+                      vectorstore.asimilarity_search_with_score(query, k=20, namespace=OFFERS_NAMESPACE))
+        await measure("retrieval.offers_title_index", afind_job_offers(query))
+    return {name: latency(values) for name, values in samples.items()}
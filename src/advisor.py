@@ -1,17 +1,34 @@
-from langsmith import traceable
+import os
 
-from src.managers.knowledge import retrieve_from_knowledge_base, ingest_to_knowledge_base
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
 from langsmith import traceable
 
-from src.managers.knowledge import retrieve_from_knowledge_base, ingest_to_knowledge_base
+from src.managers.chains import register_chain, get_chain
+from src.managers.executor import run_blocking
+from src.managers.knowledge import retrieve_from_knowledge_base, ingest_to_knowledge_base, \
+    aretrieve_from_knowledge_base, aingest_to_knowledge_base, vectorstore, embeddings, OFFERS_NAMESPACE, \
+    OFFERS_USER_ID
+from src.managers.metrics import timed
+from src.managers.response_cache import CachedAnswer
+from src.managers.scheduler import llm_scheduler
+from src.offer_search.catalog import get_catalog
+from src.offer_search.matcher import get_matcher
+from src.offer_search.title_index import search_offers, format_offers
+from src.prompts.prompts import offer_summary_prompt
+
+OFFER_SEARCH_K = 5
+# Fusing with vector similarity costs an embedding and a query round-trip per search
+FUSE_VECTOR_SCORES = os.environ.get("OFFER_SEARCH_FUSE_VECTORS") == "1"
+# The LLM is only used for an optional short summary below the ranked offers
+SUMMARIZE_OFFERS = os.environ.get("OFFER_SEARCH_SUMMARY") == "1"
 
 
 # load_dotenv()
 
 
-@traceable(name="Analyze Job Offer")
-def analyze_job_offer_against_cv(job_offer: str, user_id: str) -> str:
-    advisor_query = f"""
+def _analyze_query(job_offer: str) -> str:
+    return f"""
     You are a career advisor helping a user evaluate a job offer against their CV.
     Here is the job offer:
 
@@ -25,29 +42,147 @@ def analyze_job_offer_against_cv(job_offer: str, user_id: str) -> str:
     Return your advice in structured bullet points.
     """
 
+
+def _format_match(match: dict) -> str:
+    lines = [f"📊 {match['title'] or 'This offer'} matches your CV at {match['score']:.0%} "
+             f"(CV similarity {match['similarity']:.2f})."]
+    if match["matched"]:
+        lines.append(f"✅ Skills that match: {', '.join(match['matched'])}")
+    if match["missing"]:
+        lines.append(f"📚 Skills to improve: {', '.join(match['missing'])}")
+    return "\n".join(lines)
+
+
+@traceable(name="Analyze Job Offer")
+def analyze_job_offer_against_cv(job_offer: str, user_id: str) -> str:
+    # Offers the background matcher already scored against the CV are answered without the LLM
+    match = get_matcher().find(user_id, job_offer)
+    if match:
+        return _format_match(match)
     # Reuse retrieval pipeline
-    return retrieve_from_knowledge_base(advisor_query, user_id)
+    return retrieve_from_knowledge_base(_analyze_query(job_offer), user_id)
+
+
+@traceable(name="Analyze Job Offer")
+async def aanalyze_job_offer_against_cv(job_offer: str, user_id: str) -> str:
+    match = await run_blocking(get_matcher().find, user_id, job_offer)
+    if match:
+        return _format_match(match)
+    return await aretrieve_from_knowledge_base(_analyze_query(job_offer), user_id)
+
+
+# Offers are stored as several chunks; docs come best-first, so iterating them in reverse lets the
+# best chunk of every offer set its score
+def _offer_vector_scores(job_title: str) -> dict:
+    docs = vectorstore.similarity_search_with_score(job_title, k=20, namespace=OFFERS_NAMESPACE)
+    return {doc.metadata["url"]: score for doc, score in reversed(docs) if doc.metadata.get("url")}
+
+
+async def _aoffer_vector_scores(job_title: str) -> dict:
+    docs = await vectorstore.asimilarity_search_with_score(job_title, k=20, namespace=OFFERS_NAMESPACE)
+    return {doc.metadata["url"]: score for doc, score in reversed(docs) if doc.metadata.get("url")}
+
+
+def _build_offer_summary_chain():
+    chat = ChatOpenAI(temperature=0)
+    # Summaries depend only on the title and the offers found, so they are shared between users
+    return CachedAnswer(offer_summary_prompt | chat | StrOutputParser(), "offer_summary", embeddings,
+                        query=lambda inputs: inputs["job_title"],
+                        namespace=lambda inputs: OFFERS_NAMESPACE,
+                        doc_ids=lambda inputs: inputs["urls"])
+
+
+register_chain("offer_summary", _build_offer_summary_chain)
+
+
+@traceable(name="Find Job Offers")
+@timed("find_offers")
+def find_job_offers(job_title: str, k: int = OFFER_SEARCH_K, fuse_vectors: bool = FUSE_VECTOR_SCORES) -> list:
+    """Top-k structured offers from the local title index, optionally fused with vector similarity."""
+    vector_scores = _offer_vector_scores(job_title) if fuse_vectors else None
+    return search_offers(job_title, k=k, vector_scores=vector_scores)
+
+
+@traceable(name="Find Job Offers")
+@timed("find_offers")
+async def afind_job_offers(job_title: str, k: int = OFFER_SEARCH_K, fuse_vectors: bool = FUSE_VECTOR_SCORES) -> list:
+    vector_scores = await _aoffer_vector_scores(job_title) if fuse_vectors else None
+    # Building or catching the index up with the catalog reads SQLite, keep it off the event loop
+    return await run_blocking(search_offers, job_title, k, vector_scores)
+
+
+def _matched_offers(user_id: str, k: int) -> list:
+    catalog = get_catalog()
+    offers = []
+    for match in get_matcher().top(user_id, k):
+        offer = catalog.get(match["url"]) or {"title": match["title"], "company": match["company"],
+                                              "url": match["url"]}
+        offers.append({**offer, "match_score": match["score"]})
+    return offers
+
+
+@traceable(name="Matched Job Offers")
+def matched_job_offers(user_id: str, k: int = OFFER_SEARCH_K) -> list:
+    """The best offers for the user's CV, ranked in the background since the CV was stored."""
+    return _matched_offers(user_id, k)
+
+
+@traceable(name="Matched Job Offers")
+async def amatched_job_offers(user_id: str, k: int = OFFER_SEARCH_K) -> list:
+    return await run_blocking(_matched_offers, user_id, k)
 
 
 @traceable(name="Get Job Offer")
-def get_job_offers_cv(job_title: str) -> str:
-    query = f"""
-       Find the top 5 most relevant job offers (compare only job titles) based on the following job query:
+def get_job_offers_cv(job_title: str, summarize: bool = SUMMARIZE_OFFERS) -> str:
+    offers = find_job_offers(job_title)
+    if not offers:
+        return ""
+    text = format_offers(offers)
+    if summarize:
+        urls = [offer.get("url") for offer in offers]
+        # Admitted like every other model call; the user comes from the handler's context
+        summary = llm_scheduler.run_sync(get_chain("offer_summary").invoke,
+                                         {"job_title": job_title, "offers": text, "urls": urls},
+                                         key=("offer_summary", job_title, tuple(urls)))
+        text += "\n\n" + summary
+    return text
 
-       "{job_title}"
 
-       Provide:
-       - Job title
-       - One-sentence summary or key skills
-       - Location (if available)
-       - Small description of this job offer
-       - This Job url
+@traceable(name="Get Job Offer")
+async def aget_job_offers_cv(job_title: str, summarize: bool = SUMMARIZE_OFFERS) -> str:
+    offers = await afind_job_offers(job_title)
+    if not offers:
+        return ""
+    text = format_offers(offers)
+    if summarize:
+        urls = [offer.get("url") for offer in offers]
+        summary = await llm_scheduler.run(get_chain("offer_summary").ainvoke,
+                                          {"job_title": job_title, "offers": text, "urls": urls},
+                                          key=("offer_summary", job_title, tuple(urls)))
+        text += "\n\n" + summary
+    return text
+
 
-       Format the result as a numbered list.
-       """
-    return retrieve_from_knowledge_base(query=query, user_id="offers")
+@traceable(name="Get Job Offer")
+async def astream_job_offers_cv(job_title: str, summarize: bool = SUMMARIZE_OFFERS):
+    # The ranked list is ready immediately, only the optional summary is streamed from the LLM
+    offers = await afind_job_offers(job_title)
+    if not offers:
+        return
+    text = format_offers(offers)
+    yield text
+    if summarize:
+        yield "\n\n"
+        inputs = {"job_title": job_title, "offers": text, "urls": [offer.get("url") for offer in offers]}
+        async for token in llm_scheduler.stream(get_chain("offer_summary").astream(inputs)):
+            yield token
 
 
 @traceable(name="Insert Job Offer")
 def insert_job_offer(job_offer: str) -> str:
-    return ingest_to_knowledge_base(job_offer, 'offers')
+    return ingest_to_knowledge_base(job_offer, OFFERS_USER_ID)
+
+
+@traceable(name="Insert Job Offer")
+async def ainsert_job_offer(job_offer: str) -> str:
+    return await aingest_to_knowledge_base(job_offer, OFFERS_USER_ID)
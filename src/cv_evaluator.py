@@ -1,27 +1,149 @@
+import os
 import re
+from collections import Counter
+
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from langsmith import traceable
 
+from src.managers.metrics import metrics, timed
+from src.managers.scheduler import llm_scheduler
+from src.prompts.prompts import load_prompt
+
 chat = ChatOpenAI(temperature=0.3, model="gpt-4o")
 
+# Loaded once, the template does not change while the bot runs
+evaluate_cv_prompt = load_prompt("evaluate_cv.txt")
 
-@traceable(name="Evaluate CV Quality")
-def evaluate_cv_quality(cv_text: str) -> dict:
-    with open("prompts/evaluate_cv_prompt.txt", "r", encoding="utf-8") as f:
-        prompt_template = f.read()
-    prompt = prompt_template.format(cv_text=cv_text)
+# Drafts scoring below this locally are sent back for a rewrite without asking gpt-4o
+PRE_SCORE_THRESHOLD = int(os.environ.get("PRE_SCORE_THRESHOLD", 6))
+
+SCORE_RE = re.compile(r"\b(?:score|rating)\b[^0-9]*(\d{1,2})\b", re.IGNORECASE)
+WORD_RE = re.compile(r"[^\W\d_][\w+#.-]*", re.UNICODE)
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+PHONE_RE = re.compile(r"\+?\d[\d \-()]{7,}\d")
+HEADING_RE = re.compile(r"^##\s+(.+?)\s*$", re.MULTILINE)
+PLACEHOLDER_RE = re.compile(r"<[^<>\n]{1,30}>|…|\[(?:your|insert)[^\]]*\]", re.IGNORECASE)
+
+# Sections the generate_cv prompt asks for, with accepted heading variants
+REQUIRED_SECTIONS = {
+    "About Me": ("about me", "summary", "profile", "o mnie"),
+    "Skills": ("skills", "umiejętności", "technical skills"),
+    "Languages": ("languages", "języki"),
+}
+RECOMMENDED_SECTIONS = {
+    "Experience": ("experience", "work experience", "employment", "doświadczenie"),
+    "Education": ("education", "wykształcenie"),
+}
+MIN_WORDS = 120
+MAX_WORDS = 900
+
+STOPWORDS = {
+    "the", "and", "for", "with", "you", "your", "our", "are", "will", "have", "has", "from", "that",
+    "this", "who", "can", "work", "team", "job", "offer", "all", "any", "not", "but", "about", "their",
+    "what", "into", "they", "them", "more", "other", "also", "well", "good", "new", "per", "etc",
+    "oraz", "dla", "jest", "się", "nie", "lub", "jak", "które", "który", "która", "przez", "pracy",
+    "będzie", "twoje", "naszego", "nasz", "oferujemy", "wymagania", "mile", "widziane",
+}
+
+
+def _keywords(text: str) -> Counter:
+    words = (word.lower().strip(".-") for word in WORD_RE.findall(text or ""))
+    return Counter(word for word in words if len(word) >= 3 and word not in STOPWORDS)
+
+
+def _has_section(headings: list, variants: tuple) -> bool:
+    return any(heading.startswith(variant) for heading in headings for variant in variants)
+
+
+def pre_score_cv(cv_text: str, job_offer: str = None) -> dict:
+    """
+    Deterministic, millisecond-cheap CV check: structure, contact data, length, formatting and
+    keyword overlap with the job offer. Returns a 0-10 score and the list of issues found.
+    """
+    score = 10
+    issues = []
+    text = (cv_text or "").strip()
+    headings = [heading.lower() for heading in HEADING_RE.findall(text)]
+
+    if not text.startswith("# "):
+        score -= 1
+        issues.append("Start the resume with the candidate's full name as a '# ' heading.")
+    if not EMAIL_RE.search(text) and not PHONE_RE.search(text):
+        score -= 1
+        issues.append("Add contact details (email and phone).")
+
+    for name, variants in REQUIRED_SECTIONS.items():
+        if not _has_section(headings, variants):
+            score -= 2
+            issues.append(f"Add the missing '## {name}' section.")
+    for name, variants in RECOMMENDED_SECTIONS.items():
+        if not _has_section(headings, variants):
+            score -= 1
+            issues.append(f"Consider adding a '## {name}' section.")
+
+    word_count = len(text.split())
+    if word_count < MIN_WORDS:
+        score -= 2
+        issues.append(f"The resume is too short ({word_count} words), expand the relevant experience.")
+    elif word_count > MAX_WORDS:
+        score -= 2
+        issues.append(f"The resume is too long ({word_count} words), keep it short and to the point.")
+
+    if PLACEHOLDER_RE.search(text):
+        score -= 2
+        issues.append("Replace template placeholders (e.g. '<numer>', '…') with real data or remove them.")
+    if "```" in text:
+        score -= 1
+        issues.append("Do not wrap the resume in code fences.")
+    if re.search(r"\bCV\b|curriculum vitae", text, re.IGNORECASE):
+        score -= 1
+        issues.append("Do not use the word 'CV' or the title 'Curriculum Vitae'.")
 
+    coverage = None
+    if job_offer:
+        job_keywords = [word for word, _ in _keywords(job_offer).most_common(30)]
+        if job_keywords:
+            cv_keywords = _keywords(text)
+            matched = [word for word in job_keywords if word in cv_keywords]
+            coverage = len(matched) / len(job_keywords)
+            if coverage < 0.15:
+                score -= 2
+            elif coverage < 0.3:
+                score -= 1
+            if coverage < 0.3:
+                missing = [word for word in job_keywords if word not in cv_keywords][:10]
+                issues.append("Reflect more of the job offer's key terms where truthful: " + ", ".join(missing) + ".")
 
-    messages = [
+    return {
+        "score": max(score, 0),
+        "issues": issues,
+        "keyword_coverage": coverage,
+    }
+
+
+def _local_evaluation(pre_score: dict) -> dict:
+    details = "Automatic pre-check rejected the draft. Score: {}/10\n".format(pre_score["score"])
+    details += "\n".join(f"- {issue}" for issue in pre_score["issues"])
+    return {
+        "score": pre_score["score"],
+        "details": details,
+        "source": "local",
+        "pre_score": pre_score,
+    }
+
+
+def _build_messages(cv_text: str) -> list:
+    prompt = evaluate_cv_prompt.format(cv_text=cv_text)
+
+    return [
         SystemMessage(content="You are a professional recruiter and language expert."),
         HumanMessage(content=prompt)
     ]
 
-    response = chat.invoke(messages)
-    response_text = response.content
 
-    match = re.search(r"\b(?:score|rating)\b[^0-9]*(\d{1,2})\b", response_text, re.IGNORECASE)
+def _parse_evaluation(response_text: str) -> dict:
+    match = SCORE_RE.search(response_text)
     if match:
         score = int(match.group(1))
         score = min(score, 10)
@@ -30,5 +152,31 @@ def evaluate_cv_quality(cv_text: str) -> dict:
 
     return {
         "score": score,
-        "details": response_text
+        "details": response_text,
+        "source": "llm",
     }
+
+
+@traceable(name="Evaluate CV Quality")
+@timed("evaluate_cv")
+def evaluate_cv_quality(cv_text: str, job_offer: str = None) -> dict:
+    pre_score = pre_score_cv(cv_text, job_offer)
+    if pre_score["score"] < PRE_SCORE_THRESHOLD:
+        metrics.inc("cv_evaluations_total", source="local")
+        return _local_evaluation(pre_score)
+    metrics.inc("cv_evaluations_total", source="llm")
+    response = llm_scheduler.run_sync(chat.invoke, _build_messages(cv_text), key=("evaluate_cv", cv_text))
+    return {**_parse_evaluation(response.content), "pre_score": pre_score}
+
+
+@traceable(name="Evaluate CV Quality")
+@timed("evaluate_cv")
+async def aevaluate_cv_quality(cv_text: str, job_offer: str = None) -> dict:
+    pre_score = pre_score_cv(cv_text, job_offer)
+    if pre_score["score"] < PRE_SCORE_THRESHOLD:
+        metrics.inc("cv_evaluations_total", source="local")
+        return _local_evaluation(pre_score)
+    metrics.inc("cv_evaluations_total", source="llm")
+    # The judge only sees the CV, so evaluations of the same text in flight are merged
+    response = await llm_scheduler.run(chat.ainvoke, _build_messages(cv_text), key=("evaluate_cv", cv_text))
+    return {**_parse_evaluation(response.content), "pre_score": pre_score}
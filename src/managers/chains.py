@@ -0,0 +1,29 @@
+import threading
+
+# name -> factory building the runnable; name -> built runnable
+_factories = {}
+_chains = {}
+_lock = threading.Lock()
+
+
+def register_chain(name: str, factory):
+    """Register a chain factory. The chain is built on first use (or by warm_up) and then reused."""
+    _factories[name] = factory
+
+
+def get_chain(name: str):
+    chain = _chains.get(name)
+    if chain is None:
+        with _lock:
+            chain = _chains.get(name)
+            if chain is None:
+                chain = _factories[name]()
+                _chains[name] = chain
+    return chain
+
+
+def warm_up():
+    """Build every registered chain, so the first request does not pay for construction."""
+    for name in list(_factories):
+        get_chain(name)
+    return list(_chains)
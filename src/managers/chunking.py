@@ -0,0 +1,190 @@
+import os
+import re
+from functools import lru_cache
+
+import tiktoken
+
+# Token sizes of stored chunks and of the context handed to the LLM
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 300))
+CHUNK_MIN_TOKENS = int(os.environ.get("CHUNK_MIN_TOKENS", 60))
+# "tiktoken" (default) or "approximate", which never needs the BPE file
+CHUNK_TOKENIZER = os.environ.get("CHUNK_TOKENIZER", "tiktoken")
+
+# Markers written by format_job_for_ingestion
+OFFER_FIELD_RE = re.compile(r"---(Title|Description|Job url|Company):\s?")
+MARKDOWN_HEADING_RE = re.compile(r"^#{1,6}\s+\S")
+# Common CV and offer section titles, alone on a line with an optional colon
+SECTION_TITLES = (
+    "about me", "summary", "profile", "objective", "experience", "work experience", "employment",
+    "professional experience", "education", "skills", "technical skills", "soft skills", "languages",
+    "projects", "certifications", "certificates", "courses", "achievements", "publications",
+    "interests", "hobbies", "contact", "references", "requirements", "must have", "nice to have",
+    "responsibilities", "what we offer", "benefits", "o mnie", "doświadczenie", "wykształcenie",
+    "umiejętności", "języki", "projekty", "certyfikaty", "zainteresowania", "wymagania",
+    "obowiązki", "oferujemy", "mile widziane",
+)
+SECTION_TITLE_RE = re.compile(
+    r"^\s*(?:\*\*)?(?:" + "|".join(re.escape(title) for title in SECTION_TITLES) + r")(?:\*\*)?\s*:?\s*(?:\*\*)?\s*$",
+    re.IGNORECASE
+)
+# "Must have: Python, SQL" style lines inside flattened offer descriptions also start a section
+INLINE_SECTION_RE = re.compile(r"(?=\b(?:Requirements|Must have|Nice to have|Responsibilities|Wymagania|Obowiązki|"
+                               r"Oferujemy|What we offer|Benefits):)")
+# Approximates cl100k_base pieces: up to four word characters or one symbol, with the leading space
+APPROX_TOKEN_RE = re.compile(r"\s?\w{1,4}|\s?[^\w\s]|\s+")
+BULLET_RE = re.compile(r"^\s*(?:[-*•▪◦]|\d+[.)])\s+")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+class _ApproximateEncoding:
+    """Stand-in for the tiktoken encoding when its BPE file cannot be loaded; decode inverts encode."""
+
+    def encode(self, text: str, disallowed_special=()) -> list:
+        return APPROX_TOKEN_RE.findall(text)
+
+    def decode(self, tokens: list) -> str:
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if CHUNK_TOKENIZER == "approximate":
+        return _ApproximateEncoding()
+    # tiktoken downloads the BPE file on first use unless TIKTOKEN_CACHE_DIR already holds it
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"⚠️ Tokenizer unavailable ({e.__class__.__name__}), approximating token counts")
+        return _ApproximateEncoding()
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text or "", disallowed_special=()))
+
+
+def _is_heading(line: str) -> bool:
+    return bool(MARKDOWN_HEADING_RE.match(line) or SECTION_TITLE_RE.match(line))
+
+
+def split_sections(text: str) -> list:
+    """(heading, body) pairs; text before the first heading gets an empty heading."""
+    sections = []
+    heading, lines = "", []
+    for line in (text or "").splitlines():
+        if _is_heading(line):
+            if any(existing.strip() for existing in lines):
+                sections.append((heading, "\n".join(lines).strip()))
+            heading, lines = line.strip(), []
+        else:
+            lines.append(line)
+    if any(line.strip() for line in lines) or heading:
+        sections.append((heading, "\n".join(lines).strip()))
+    return sections
+
+
+def _blocks(body: str) -> list:
+    """Paragraphs and single bullet items: the units a section is never cut inside of."""
+    blocks, current = [], []
+    for line in body.splitlines():
+        if not line.strip():
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+        elif BULLET_RE.match(line) and current:
+            blocks.append("\n".join(current))
+            current = [line]
+        else:
+            current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _hard_split(block: str, max_tokens: int) -> list:
+    # A paragraph longer than a chunk: cut at sentence ends, and at token boundaries as a last resort
+    pieces = []
+    for sentence in SENTENCE_RE.split(block):
+        tokens = _encoding().encode(sentence, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            pieces.append(sentence)
+        else:
+            pieces.extend(_encoding().decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens))
+    return _pack(pieces, max_tokens, " ")
+
+
+def _pack(pieces: list, max_tokens: int, separator: str = "\n") -> list:
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        # Plus one for the separator
+        piece_tokens = count_tokens(piece) + 1
+        if current and size + piece_tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += piece_tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def _split_section(heading: str, body: str, max_tokens: int) -> list:
+    budget = max_tokens - count_tokens(heading)
+    pieces = []
+    for block in _blocks(body):
+        pieces.extend([block] if count_tokens(block) <= budget else _hard_split(block, budget))
+    # Every chunk repeats its section heading, so a retrieved chunk says what it is about
+    return [f"{heading}\n{chunk}" if heading else chunk for chunk in _pack(pieces, budget)] or [heading]
+
+
+def _split_offer(text: str, max_tokens: int) -> list:
+    fields = {}
+    parts = OFFER_FIELD_RE.split(text)
+    for name, value in zip(parts[1::2], parts[2::2]):
+        fields[name] = value.strip()
+    header = "".join(f"---{name}: {fields[name]}" for name in ("Title", "Company", "Job url") if fields.get(name))
+    # Descriptions are flattened to one line, their inline sub-sections become separate blocks
+    description = "\n\n".join(part.strip() for part in INLINE_SECTION_RE.split(fields.get("Description", "")) if part.strip())
+    chunks = _split_section("", description, max_tokens - count_tokens(header + "---Description: "))
+    return [f"{header}---Description: {chunk}" for chunk in chunks if chunk] or [header]
+
+
+def split_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS) -> list:
+    """
+    Structure-aware splitting of CVs and offers. Sections (markdown headings, common CV/offer
+    section titles, the `---Title:`/`---Description:` offer markers) are cut at paragraph and
+    bullet boundaries into chunks of at most `max_tokens`, and sections shorter than
+    `min_tokens` are merged with their neighbours instead of becoming chunks of their own.
+    """
+    if OFFER_FIELD_RE.match(text or ""):
+        return _split_offer(text, max_tokens)
+
+    chunks, sizes = [], []
+    for heading, body in split_sections(text):
+        for chunk in _split_section(heading, body, max_tokens):
+            size = count_tokens(chunk)
+            if chunks and min(sizes[-1], size) < min_tokens and sizes[-1] + size <= max_tokens:
+                chunks[-1] = f"{chunks[-1]}\n\n{chunk}"
+                sizes[-1] += size
+            else:
+                chunks.append(chunk)
+                sizes.append(size)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def pack_context(docs: list, token_budget: int) -> list:
+    """
+    Documents (best first) that fit into `token_budget` tokens, taken by relevance. A document
+    too large for the remaining budget is skipped so smaller, less relevant ones can still fill it.
+    """
+    packed, used, seen = [], 0, set()
+    for doc in docs:
+        content = doc.page_content.strip()
+        if not content or content in seen:
+            continue
+        tokens = count_tokens(content)
+        if used + tokens > token_budget:
+            continue
+        packed.append(doc)
+        used += tokens
+        seen.add(content)
+    return packed
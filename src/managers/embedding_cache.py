@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from src.managers.executor import run_blocking
+from src.managers.metrics import metrics, record_tokens
+from src.managers.scheduler import embedding_scheduler
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(base_dir, "data", "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_MB = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", 512))
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+def _estimate_tokens(texts) -> int:
+    # The embeddings API reports no usage through LangChain; ~4 characters per token is close enough for cost
+    return sum(len(text) // 4 + 1 for text in texts)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an embedding model.
+
+    Vectors are stored as float32 blobs in SQLite, keyed by sha256(model, text). Only texts the
+    cache has never seen are sent to the wrapped model. When the cache grows past `max_bytes`
+    the least recently used vectors are evicted.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, path: str = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                if rows:
+                    hit_marks = ",".join("?" * len(rows))
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({hit_marks})",
+                        [now] + [key for key, _ in rows]
+                    )
+        return found
+
+    def _store(self, pairs: list):
+        now = time.time()
+        rows = []
+        for key, vector in pairs:
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            # Keys embedded concurrently by another caller are replaced, their old size must not count twice
+            replaced = 0
+            for i in range(0, len(rows), _SQL_BATCH):
+                batch = [row[0] for row in rows[i:i + _SQL_BATCH]]
+                marks = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self._total_bytes += sum(row[2] for row in rows) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used rows until we are 10% below the limit, so eviction is not
+        # triggered again by the very next insert
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT ?", (_SQL_BATCH,)
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            dropped = []
+            for key, size in rows:
+                dropped.append(key)
+                self._total_bytes -= size
+                if self._total_bytes <= target:
+                    break
+            marks = ",".join("?" * len(dropped))
+            self._conn.execute(f"DELETE FROM embeddings WHERE key IN ({marks})", dropped)
+
+    def _split(self, texts: list) -> tuple:
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+        # Deduplicate misses so a text repeated inside one batch is embedded only once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        metrics.inc("embedding_cache_hits_total", len(keys) - len(missing))
+        metrics.inc("embedding_cache_misses_total", len(missing))
+        return keys, cached, missing
+
+    def embed_documents(self, texts: list) -> list:
+        keys, cached, missing = self._split(texts)
+        if missing:
+            vectors = embedding_scheduler.run_sync(self.underlying.embed_documents, list(missing.values()),
+                                                   key=(self.model_name, *missing))
+            record_tokens(self.model_name, _estimate_tokens(missing.values()))
+            new = list(zip(missing.keys(), vectors))
+            self._store(new)
+            cached.update(new)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts: list) -> list:
+        # SQLite reads and writes run in the blocking pool, off the event loop
+        keys, cached, missing = await run_blocking(self._split, texts)
+        if missing:
+            # Identical batches in flight (e.g. the same offer pasted by two users) are embedded once
+            vectors = await embedding_scheduler.run(self.underlying.aembed_documents, list(missing.values()),
+                                                    key=(self.model_name, *missing))
+            record_tokens(self.model_name, _estimate_tokens(missing.values()))
+            new = list(zip(missing.keys(), vectors))
+            await run_blocking(self._store, new)
+            cached.update(new)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,48 @@
+import asyncio
+import contextvars
+import functools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from src.managers.scheduler import current_user
+
+# Bounded pool for work that has no native async path (pdfkit, file I/O, sync SDK calls)
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", 8))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+_user_locks = weakref.WeakValueDictionary()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a synchronous callable in the bounded pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Copy the context so LangSmith tracing parents survive the thread hop
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await loop.run_in_executor(_executor, call)
+
+
+def user_lock(user_id) -> asyncio.Lock:
+    """One lock per user; dropped automatically once nobody holds or awaits it."""
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _user_locks[user_id] = lock
+    return lock
+
+
+def serialized_per_user(handler):
+    """Telegram handler decorator: updates of one user run in order, different users run concurrently."""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        async with user_lock(update.effective_user.id):
+            # Lets the schedulers apply per-user limits to whatever the handler calls
+            token = current_user.set(update.effective_user.id)
+            try:
+                return await handler(update, context)
+            finally:
+                current_user.reset(token)
+
+    return wrapper
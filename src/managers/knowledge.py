@@ -1,60 +1,231 @@
 import os
 
 from dotenv import load_dotenv
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain import hub
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_pinecone import PineconeVectorStore
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_text_splitters import CharacterTextSplitter
 from langsmith import traceable
 
+from src.managers.chains import register_chain, get_chain
+from src.managers.chunking import split_text, pack_context
+from src.managers.embedding_cache import CachedEmbeddings
+from src.managers.executor import run_blocking
+from src.managers.metrics import timed
+from src.managers.response_cache import response_cache, CachedAnswer, document_ids
+from src.managers import retrieval_cache
+from src.managers.retrieval_cache import cached_retrieve, acached_retrieve
+from src.managers.scheduler import llm_scheduler
+from src.managers.vector_store import create_vectorstore
+from src.prompts.prompts import retrieval_qa_chat_prompt
+
 load_dotenv()
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Repeated CVs and re-scraped offers are served from the local cache instead of the API
+embeddings = CachedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
 INDEX_NAME = os.environ.get("INDEX_NAME")
 
-vectorstore = PineconeVectorStore(
-    index_name=INDEX_NAME,
-    embedding=embeddings
-)
+# Pinecone by default, VECTOR_BACKEND=local keeps everything in data/vector_store
+vectorstore = create_vectorstore(embeddings, index_name=INDEX_NAME)
+
+# Every user's CV lives in its own namespace, scraped and inserted offers share one
+OFFERS_USER_ID = "offers"
+OFFERS_NAMESPACE = "offers"
+
+
+def user_namespace(user_id) -> str:
+    if str(user_id) == OFFERS_USER_ID:
+        return OFFERS_NAMESPACE
+    return f"user-{user_id}"
+
+
+def _split_text(query: str) -> list:
+    # Chunks follow CV sections and offer fields instead of a fixed character count
+    return split_text(query)
 
 
 @traceable(name="Ingest CV to Knowledge Base")
+@timed("ingest")
 def ingest_to_knowledge_base(query: str, user_id: str) -> str:
-    text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    texts = text_splitter.split_text(query)
+    texts = _split_text(query)
     vectorstore.add_texts(
         texts,
-        metadatas=[{"user_id": user_id}] * len(texts)
+        metadatas=[{"user_id": user_id}] * len(texts),
+        namespace=user_namespace(user_id)
     )
+    retrieval_cache.invalidate_user(user_id)
+    response_cache.bump(user_namespace(user_id))
+    return "Data inserted successfully."
+
+
+@traceable(name="Ingest CV to Knowledge Base")
+@timed("ingest")
+async def aingest_to_knowledge_base(query: str, user_id: str) -> str:
+    texts = _split_text(query)
+    await vectorstore.aadd_texts(
+        texts,
+        metadatas=[{"user_id": user_id} for _ in texts],
+        namespace=user_namespace(user_id)
+    )
+    retrieval_cache.invalidate_user(user_id)
+    await run_blocking(response_cache.bump, user_namespace(user_id))
     return "Data inserted successfully."
 
 
 @traceable(name="Delete User Embeddings")
+@timed("delete_embeddings")
 def delete_user_embeddings(user_id: str) -> str:
     try:
-        vectorstore._index.delete(
-            filter={"user_id": user_id}
-        )
+        # Dropping the namespace costs the same however many vectors the index holds
+        vectorstore.delete(delete_all=True, namespace=user_namespace(user_id))
+        retrieval_cache.invalidate_user(user_id)
+        response_cache.bump(user_namespace(user_id))
         return f"Embeddingi deleted."
     except Exception as e:
         return f"Error: {str(e)}"
 
 
+@traceable(name="Delete User Embeddings")
+@timed("delete_embeddings")
+async def adelete_user_embeddings(user_id: str) -> str:
+    try:
+        await vectorstore.adelete(delete_all=True, namespace=user_namespace(user_id))
+        retrieval_cache.invalidate_user(user_id)
+        await run_blocking(response_cache.bump, user_namespace(user_id))
+        return f"Embeddingi deleted."
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def user_retriever(k: int = 4, token_budget: int = None):
+    """
+    Retriever step shared by the registered chains: reads `input` and `user_id` from the chain
+    input, so one chain instance serves every user. Queries only scan the user's namespace.
+    With a `token_budget`, the `k` best chunks are packed into at most that many tokens.
+    """
+    def pack(docs: list) -> list:
+        return pack_context(docs, token_budget) if token_budget else docs
+
+    def retrieve(inputs: dict) -> list:
+        key = (str(inputs["user_id"]), k, inputs["input"])
+
+        def search():
+            with timed("vector_search"):
+                return vectorstore.similarity_search(inputs["input"], k=k, namespace=user_namespace(inputs["user_id"]))
+
+        return pack(cached_retrieve(key, search))
+
+    async def aretrieve(inputs: dict) -> list:
+        key = (str(inputs["user_id"]), k, inputs["input"])
+
+        async def asearch():
+            async with timed("vector_search"):
+                return await vectorstore.asimilarity_search(
+                    inputs["input"], k=k, namespace=user_namespace(inputs["user_id"]))
+
+        return pack(await acached_retrieve(key, asearch))
+
+    return RunnableLambda(retrieve, afunc=aretrieve)
+
+
+def _build_retrieval_chain():
+    chat = ChatOpenAI(verbose=True, temperature=0)
+    stuff_docs_chain = create_stuff_documents_chain(chat, retrieval_qa_chat_prompt)
+    # Small CVs are retrieved whole, so the documents say nothing about the question (e.g. two
+    # offers put through the analysis template): only the exact same question reuses an answer
+    answer = CachedAnswer(stuff_docs_chain, "knowledge_qa", embeddings,
+                          query=lambda inputs: inputs["input"],
+                          namespace=lambda inputs: user_namespace(inputs["user_id"]),
+                          doc_ids=lambda inputs: document_ids(inputs["context"]),
+                          exact=True)
+    return (
+        RunnablePassthrough.assign(context=user_retriever())
+        .assign(answer=answer)
+    )
+
+
+register_chain("knowledge_qa", _build_retrieval_chain)
+
+
 @traceable(name="Retrieve from Knowledge Base")
 def retrieve_from_knowledge_base(query: str, user_id: str) -> str:
-    docsearch = PineconeVectorStore(index_name=INDEX_NAME, embedding=embeddings)
-    chat = ChatOpenAI(verbose=True, temperature=0)
+    result = llm_scheduler.run_sync(get_chain("knowledge_qa").invoke, {"input": query, "user_id": user_id},
+                                    key=("knowledge_qa", str(user_id), query), user_id=user_id)
+    return result["answer"]
 
-    retrieval_qa_chat_prompt = hub.pull("langchain-ai/retrieval-qa-chat")
-    stuff_docs_chain = create_stuff_documents_chain(chat, retrieval_qa_chat_prompt)
 
-    retrival_chain = create_retrieval_chain(
-        retriever=docsearch.as_retriever(
-            search_kwargs={"filter": {"user_id": user_id}}
-        ),
-        combine_docs_chain=stuff_docs_chain
-    )
-    result = retrival_chain.invoke(input={"input": query})
+@traceable(name="Retrieve from Knowledge Base")
+async def aretrieve_from_knowledge_base(query: str, user_id: str) -> str:
+    result = await llm_scheduler.run(get_chain("knowledge_qa").ainvoke, {"input": query, "user_id": user_id},
+                                     key=("knowledge_qa", str(user_id), query), user_id=user_id)
     return result["answer"]
+
+
+async def astream_answer(chain, inputs: dict):
+    """Yield the `answer` tokens of a registered retrieval chain as the LLM produces them."""
+    async for chunk in chain.astream(inputs):
+        if "answer" in chunk:
+            yield chunk["answer"]
+
+
+@traceable(name="Retrieve from Knowledge Base")
+async def astream_from_knowledge_base(query: str, user_id: str):
+    answer = astream_answer(get_chain("knowledge_qa"), {"input": query, "user_id": user_id})
+    async for token in llm_scheduler.stream(answer, user_id):
+        yield token
+
+
+def split_documents(texts: list, metadatas: list) -> tuple:
+    """Split many documents at once, returning flat chunk and metadata lists."""
+    chunks, chunk_metadatas = [], []
+    for text, metadata in zip(texts, metadatas):
+        for chunk in _split_text(text):
+            chunks.append(chunk)
+            chunk_metadatas.append(dict(metadata))
+    return chunks, chunk_metadatas
+
+
+@timed("embed")
+def embed_texts(texts: list) -> list:
+    # OpenAIEmbeddings packs up to `chunk_size` (1000) inputs into a single request
+    return embeddings.embed_documents(texts)
+
+
+def upsert_embeddings(texts: list, vectors: list, metadatas: list, ids: list = None,
+                      namespace: str = OFFERS_NAMESPACE) -> list:
+    """Upsert already embedded chunks, storing the text the same way add_texts does."""
+    ids = vectorstore.upsert_embeddings(texts, vectors, metadatas, ids=ids, namespace=namespace)
+    response_cache.bump(namespace)
+    return ids
+
+
+def delete_vectors(ids: list, namespace: str = OFFERS_NAMESPACE):
+    if ids:
+        vectorstore.delete(ids=ids, namespace=namespace)
+        response_cache.bump(namespace)
+
+
+def migrate_to_namespaces(batch_size: int = 100) -> int:
+    """
+    One-off move of vectors stored before namespaces were used (the default namespace,
+    separated by `user_id` metadata) into their user or offers namespace.
+    """
+    moved = 0
+    for ids in vectorstore.index.list(namespace=""):
+        for i in range(0, len(ids), batch_size):
+            fetched = vectorstore.index.fetch(ids=ids[i:i + batch_size], namespace="").vectors
+            by_namespace = {}
+            for vector_id, vector in fetched.items():
+                metadata = vector.metadata or {}
+                namespace = user_namespace(metadata.get("user_id", OFFERS_USER_ID))
+                by_namespace.setdefault(namespace, []).append((vector_id, vector.values, metadata))
+            for namespace, records in by_namespace.items():
+                vectorstore.index.upsert(vectors=records, namespace=namespace)
+            vectorstore.index.delete(ids=list(fetched), namespace="")
+            moved += len(fetched)
+    print(f"Moved {moved} vectors into per-user namespaces")
+    return moved
+
+
+if __name__ == "__main__":
+    migrate_to_namespaces()
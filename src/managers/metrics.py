@@ -0,0 +1,306 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+# METRICS_PORT serves Prometheus text on http://<host>:<port>/metrics, METRICS_LOG_INTERVAL
+# (seconds) prints a summary to the log; both are off when unset
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_LOG_INTERVAL = float(os.environ.get("METRICS_LOG_INTERVAL", 0))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf"))
+
+# USD per 1M tokens (input, output); model names are matched by their longest known prefix
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+# The bot command (or background job) the current code runs for
+current_command: ContextVar[str] = ContextVar("current_command", default="background")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms keyed by name and sorted label pairs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            histograms = {key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self._histograms.items()}
+            return histograms, dict(self._counters)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        with self._lock:
+            return self._histograms.get(self._key(name, labels))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry()
+
+
+class timed:
+    """
+    Records the duration of a stage into the `stage_seconds` histogram, labelled with the stage
+    and the current command. Usable as a (sync or async) context manager and as a decorator of
+    functions, coroutine functions and async generators.
+    """
+
+    def __init__(self, stage: str, **labels):
+        self.stage = stage
+        self.labels = labels
+        self._started = None
+
+    def _record(self, failed: bool):
+        elapsed = time.perf_counter() - self._started
+        metrics.observe("stage_seconds", elapsed, stage=self.stage, command=current_command.get(), **self.labels)
+        if failed:
+            metrics.inc("stage_errors_total", stage=self.stage, command=current_command.get(), **self.labels)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._record(exc_type is not None)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__exit__(exc_type, exc, tb)
+
+    def __call__(self, func):
+        stage, labels = self.stage, self.labels
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def agen_wrapper(*args, **kwargs):
+                with timed(stage, **labels):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return agen_wrapper
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+@contextmanager
+def command_context(command: str):
+    token = current_command.set(command)
+    try:
+        yield
+    finally:
+        current_command.reset(token)
+
+
+def track_command(handler):
+    """Telegram handler decorator: end-to-end latency and outcome per command."""
+    command = handler.__name__.removesuffix("_command")
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        status = "ok"
+        with command_context(command):
+            try:
+                return await handler(update, context)
+            except BaseException:
+                status = "error"
+                raise
+            finally:
+                metrics.observe("command_seconds", time.perf_counter() - started, command=command)
+                metrics.inc("commands_total", command=command, status=status)
+
+    return wrapper
+
+
+def _price(model: str) -> tuple:
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_PRICES[name]
+    return 0.0, 0.0
+
+
+def record_tokens(model: str, input_tokens: int, output_tokens: int = 0):
+    command = current_command.get()
+    input_price, output_price = _price(model or "")
+    metrics.inc("llm_tokens_total", input_tokens, command=command, model=model, kind="input")
+    if output_tokens:
+        metrics.inc("llm_tokens_total", output_tokens, command=command, model=model, kind="output")
+    metrics.inc("llm_cost_usd_total", (input_tokens * input_price + output_tokens * output_price) / 1e6,
+                command=command)
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Counts prompt/completion tokens and their estimated cost of every chat model call."""
+
+    def on_llm_end(self, response, **kwargs):
+        llm_output = response.llm_output or {}
+        usage = llm_output.get("token_usage") or {}
+        model = llm_output.get("model_name") or ""
+        input_tokens, output_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        if not usage:
+            # Streamed responses report usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    metadata = getattr(message, "usage_metadata", None) or {}
+                    input_tokens += metadata.get("input_tokens", 0)
+                    output_tokens += metadata.get("output_tokens", 0)
+                    model = model or (getattr(message, "response_metadata", None) or {}).get("model_name", "")
+        if input_tokens or output_tokens:
+            record_tokens(model, input_tokens, output_tokens)
+
+
+# Registered as a configure hook, the handler is attached to every LangChain run without passing
+# callbacks around; it works whether or not LangSmith tracing is on
+_usage_callback_var: ContextVar = ContextVar("metrics_usage_callback", default=None)
+register_configure_hook(_usage_callback_var, inheritable=True)
+_usage_callback_var.set(UsageCallbackHandler())
+
+
+def _label_text(labels: tuple, extra: str = "") -> str:
+    pairs = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_prometheus() -> str:
+    histograms, counters = metrics.snapshot()
+    lines = []
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"{name}{_label_text(labels)} {value}")
+    for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            bucket_labels = _label_text(labels, 'le="%s"' % le)
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{name}_sum{_label_text(labels)} {total}")
+        lines.append(f"{name}_count{_label_text(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> str:
+    """Readable dump: count, p50 and p95 of every histogram, then the counters."""
+    histograms, counters = metrics.snapshot()
+    lines = []
+    for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+        histogram = Histogram(buckets)
+        histogram.counts, histogram.sum, histogram.count = counts, total, count
+        label = ",".join(f"{key}={value}" for key, value in labels)
+        lines.append(f"{name}[{label}] n={count} avg={total / max(count, 1):.3f}s "
+                     f"p50<={histogram.quantile(0.5):g}s p95<={histogram.quantile(0.95):g}s")
+    for (name, labels), value in sorted(counters.items()):
+        label = ",".join(f"{key}={value}" for key, value in labels)
+        lines.append(f"{name}[{label}] {value:g}")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _log_periodically(interval: float):
+    while True:
+        time.sleep(interval)
+        print(f"📊 Metrics\n{summary()}")
+
+
+def start_metrics_exporter(port: int = METRICS_PORT, log_interval: float = METRICS_LOG_INTERVAL) -> list:
+    """Start the configured exporters on daemon threads; returns what was started."""
+    started = []
+    if port:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        started.append(f"http://0.0.0.0:{port}/metrics")
+    if log_interval:
+        threading.Thread(target=_log_periodically, args=(log_interval,), name="metrics-log", daemon=True).start()
+        started.append(f"log every {log_interval:g}s")
+    return started
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pdfkit
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", os.path.join(base_dir, "data", "pdf_cache"))
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", 2))
+PDF_CACHE_MAX_FILES = int(os.environ.get("PDF_CACHE_MAX_FILES", 500))
+
+PDF_OPTIONS = {"encoding": "UTF-8"}
+
+
+class PdfRenderer:
+    """
+    Bounded wkhtmltopdf rendering with a content-addressed cache.
+
+    At most `workers` wkhtmltopdf processes run at a time, the rest queue in the pool. Output is
+    stored as `<sha256 of the HTML>.pdf`, so re-requesting an unchanged CV is served from disk
+    and concurrent requests for the same HTML share one render. Files are written under a
+    unique temporary name and atomically moved into place, so readers never see a partial PDF.
+    """
+
+    def __init__(self, cache_dir: str = PDF_CACHE_DIR, workers: int = PDF_RENDER_WORKERS,
+                 max_files: int = PDF_CACHE_MAX_FILES):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        os.makedirs(cache_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-render")
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._configurations = {}
+
+    def _configuration(self, wkhtmltopdf_path: str = None):
+        # pdfkit resolves the binary (spawning `which`) on every call without a configuration,
+        # resolve it once per path instead
+        if wkhtmltopdf_path and not os.path.exists(wkhtmltopdf_path):
+            wkhtmltopdf_path = None
+        key = wkhtmltopdf_path or ""
+        configuration = self._configurations.get(key)
+        if configuration is None:
+            configuration = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path or "")
+            self._configurations[key] = configuration
+        return configuration
+
+    def cache_path(self, html: str) -> str:
+        digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pdf")
+
+    def _render(self, html: str, output_path: str, wkhtmltopdf_path: str = None) -> str:
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            pdfkit.from_string(html, tmp_path, configuration=self._configuration(wkhtmltopdf_path),
+                               options=PDF_OPTIONS)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._prune()
+        return output_path
+
+    def _prune(self):
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".pdf")]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def submit(self, html: str, wkhtmltopdf_path: str = None):
+        """Return a concurrent Future resolving to the cached PDF path."""
+        output_path = self.cache_path(html)
+        with self._lock:
+            future = self._in_flight.get(output_path)
+            if future is not None:
+                return future
+            if os.path.exists(output_path):
+                # Touch so pruning evicts the least recently requested PDFs first
+                os.utime(output_path)
+                future = Future()
+                future.set_result(output_path)
+                return future
+            future = self._pool.submit(self._render, html, output_path, wkhtmltopdf_path)
+            self._in_flight[output_path] = future
+        future.add_done_callback(lambda _: self._forget(output_path))
+        return future
+
+    def _forget(self, output_path: str):
+        with self._lock:
+            self._in_flight.pop(output_path, None)
+
+    def render(self, html: str, wkhtmltopdf_path: str = None) -> str:
+        return self.submit(html, wkhtmltopdf_path).result()
+
+    async def arender(self, html: str, wkhtmltopdf_path: str = None) -> str:
+        return await asyncio.wrap_future(self.submit(html, wkhtmltopdf_path))
+
+
+pdf_renderer = PdfRenderer()
@@ -0,0 +1,249 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.runnables import Runnable
+
+from src.managers.executor import run_blocking
+from src.managers.metrics import metrics
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(base_dir, "data", "response_cache.sqlite3"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 3600))
+# Cosine similarity of two questions above which they get the same answer (0 disables the cache)
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", 0.95))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 20000))
+
+# Expired and surplus entries are purged every this many stores
+_PURGE_EVERY = 100
+
+
+def normalize_query(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def documents_key(ids) -> str:
+    """Order-independent fingerprint of the documents an answer was generated from."""
+    return hashlib.sha256("\0".join(sorted(str(doc_id) for doc_id in ids)).encode("utf-8")).hexdigest()
+
+
+def document_ids(docs: list) -> list:
+    # Both vector stores return ids; hash the text of documents that come without one
+    return [doc.id or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest() for doc in docs]
+
+
+class _Lookup:
+    __slots__ = ("kind", "namespace", "docs", "version", "vector", "answer")
+
+    def __init__(self, kind, namespace, docs, version, vector, answer=None):
+        self.kind = kind
+        self.namespace = namespace
+        self.docs = docs
+        self.version = version
+        self.vector = vector
+        self.answer = answer
+
+
+class ResponseCache:
+    """
+    LLM answers reused for questions that mean the same thing.
+
+    An answer is stored with the unit embedding of its (normalized) question, a fingerprint of
+    the documents it was generated from and the version of the vector store namespace those
+    came from. A later question hits when it retrieved exactly the same documents, the namespace
+    has not changed since, the entry is younger than `ttl` and the two questions' embeddings are
+    at least `threshold` similar. Every write to a namespace (`bump`) bumps its version, so
+    answers follow index updates; the version lives in SQLite and is shared with ingestion
+    processes.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "kind TEXT NOT NULL, namespace TEXT NOT NULL, docs TEXT NOT NULL, version INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, answer TEXT NOT NULL, expires_at REAL NOT NULL);"
+            # Led by the namespace, so `bump` does not scan the whole table
+            "DROP INDEX IF EXISTS responses_lookup;"
+            "CREATE INDEX IF NOT EXISTS responses_by_namespace ON responses(namespace, kind, docs);"
+            "CREATE INDEX IF NOT EXISTS responses_expiry ON responses(expires_at);"
+            "CREATE TABLE IF NOT EXISTS namespace_versions (namespace TEXT PRIMARY KEY, version INTEGER NOT NULL);"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.ttl > 0
+
+    def _version(self, namespace: str) -> int:
+        row = self._conn.execute("SELECT version FROM namespace_versions WHERE namespace = ?", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def lookup(self, kind: str, namespace: str, doc_ids, vector=None) -> _Lookup:
+        """
+        The cached answer (in `.answer`, None on a miss) and what `store` needs to record a new one.
+        Without a `vector` only entries stored for exactly the same `doc_ids` match.
+        """
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1)
+        docs = documents_key(doc_ids)
+        with self._lock:
+            version = self._version(namespace)
+            rows = self._conn.execute(
+                "SELECT vector, answer FROM responses WHERE kind = ? AND namespace = ? AND docs = ? "
+                "AND version = ? AND expires_at > ?",
+                (kind, namespace, docs, version, time.time())
+            ).fetchall()
+        entry = _Lookup(kind, namespace, docs, version, vector)
+        if rows and vector is None:
+            entry.answer = rows[0][1]
+        elif rows:
+            similarities = np.vstack([np.frombuffer(blob, dtype=np.float32) for blob, _ in rows]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                entry.answer = rows[best][1]
+        metrics.inc("response_cache_hits_total" if entry.answer is not None else "response_cache_misses_total",
+                    kind=kind)
+        return entry
+
+    def store(self, entry: _Lookup, answer: str):
+        if not answer:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO responses (kind, namespace, docs, version, vector, answer, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.kind, entry.namespace, entry.docs, entry.version,
+                 b"" if entry.vector is None else entry.vector.tobytes(), answer,
+                 time.time() + self.ttl)
+            )
+            self._stores += 1
+            if self._stores % _PURGE_EVERY == 0:
+                self._purge()
+
+    def _purge(self):
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self._conn.execute(
+            "DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY expires_at DESC "
+            "LIMIT -1 OFFSET ?)", (self.max_entries,)
+        )
+
+    def bump(self, namespace: str):
+        """Record a change of `namespace`; answers built on its previous contents stop matching."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO namespace_versions (namespace, version) VALUES (?, 1) "
+                "ON CONFLICT(namespace) DO UPDATE SET version = version + 1", (namespace,)
+            )
+            self._conn.execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+            self._conn.execute("COMMIT")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+
+response_cache = ResponseCache()
+
+
+class CachedAnswer(Runnable):
+    """
+    Chain step in front of an answer-producing `chain` (string output): equivalent questions over
+    the same retrieved documents are answered from `response_cache`, everything else runs the
+    chain (streamed token by token when the caller streams) and stores its answer.
+
+    `query(inputs)` is the question, `namespace(inputs)` the vector store namespace the
+    documents came from and `doc_ids(inputs)` their ids. With `exact`, only the same normalized
+    question is answered from the cache: for chains whose documents do not pin down the answer.
+    """
+
+    def __init__(self, chain, kind: str, embeddings, query, namespace, doc_ids, exact: bool = False,
+                 cache: ResponseCache = None):
+        self.chain = chain
+        self.kind = kind
+        self.embeddings = embeddings
+        self.query = query
+        self.namespace = namespace
+        self.doc_ids = doc_ids
+        self.exact = exact
+        self.cache = cache or response_cache
+
+    def _exact_lookup(self, inputs: dict) -> _Lookup:
+        question = hashlib.sha256(normalize_query(self.query(inputs)).encode("utf-8")).hexdigest()
+        return self.cache.lookup(self.kind, self.namespace(inputs), [*self.doc_ids(inputs), f"question:{question}"])
+
+    def _lookup(self, inputs: dict) -> _Lookup:
+        if self.exact:
+            return self._exact_lookup(inputs)
+        vector = self.embeddings.embed_query(normalize_query(self.query(inputs)))
+        return self.cache.lookup(self.kind, self.namespace(inputs), self.doc_ids(inputs), vector)
+
+    async def _alookup(self, inputs: dict) -> _Lookup:
+        # SQLite reads and writes of the cache stay off the event loop
+        if self.exact:
+            return await run_blocking(self._exact_lookup, inputs)
+        vector = await self.embeddings.aembed_query(normalize_query(self.query(inputs)))
+        return await run_blocking(self.cache.lookup, self.kind, self.namespace(inputs), self.doc_ids(inputs), vector)
+
+    def invoke(self, input: dict, config=None, **kwargs) -> str:
+        if not self.cache.enabled:
+            return self.chain.invoke(input, config, **kwargs)
+        entry = self._lookup(input)
+        if entry.answer is not None:
+            return entry.answer
+        answer = self.chain.invoke(input, config, **kwargs)
+        self.cache.store(entry, answer)
+        return answer
+
+    async def ainvoke(self, input: dict, config=None, **kwargs) -> str:
+        if not self.cache.enabled:
+            return await self.chain.ainvoke(input, config, **kwargs)
+        entry = await self._alookup(input)
+        if entry.answer is not None:
+            return entry.answer
+        answer = await self.chain.ainvoke(input, config, **kwargs)
+        await run_blocking(self.cache.store, entry, answer)
+        return answer
+
+    def stream(self, input: dict, config=None, **kwargs):
+        if not self.cache.enabled:
+            yield from self.chain.stream(input, config, **kwargs)
+            return
+        entry = self._lookup(input)
+        if entry.answer is not None:
+            yield entry.answer
+            return
+        tokens = []
+        for token in self.chain.stream(input, config, **kwargs):
+            tokens.append(token)
+            yield token
+        self.cache.store(entry, "".join(tokens))
+
+    async def astream(self, input: dict, config=None, **kwargs):
+        if not self.cache.enabled:
+            async for token in self.chain.astream(input, config, **kwargs):
+                yield token
+            return
+        entry = await self._alookup(input)
+        if entry.answer is not None:
+            yield entry.answer
+            return
+        tokens = []
+        async for token in self.chain.astream(input, config, **kwargs):
+            tokens.append(token)
+            yield token
+        # Only complete answers are stored; a stream abandoned halfway never gets here
+        await run_blocking(self.cache.store, entry, "".join(tokens))
@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import weakref
+
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", 600))
+
+# The cache of the retrieval session the current code runs in
+_session = contextvars.ContextVar("retrieval_session", default=None)
+# Caches of the sessions still running, for invalidation
+_live_sessions = weakref.WeakSet()
+
+
+class RetrievalCache:
+    """
+    Short-lived cache of retrieved documents keyed by (user_id, k, query).
+
+    Every `retrieval_session()` gets its own instance, e.g. the generate → evaluate → rewrite
+    loop of /write_cv, where the query and the user's CV do not change between passes. Entries
+    expire after `ttl` seconds and are dropped as soon as the user's embeddings change.
+    """
+
+    def __init__(self, ttl: float = RETRIEVAL_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def discard(self, key, value):
+        with self._lock:
+            if self._entries.get(key, (None,))[0] is value:
+                del self._entries[key]
+
+    def invalidate_user(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@contextlib.contextmanager
+def retrieval_session():
+    """
+    Reuse retrieval results for the duration of the block (and of tasks spawned inside it).
+    The cache belongs to the session and is dropped with it.
+    """
+    retrieval_cache = RetrievalCache()
+    _live_sessions.add(retrieval_cache)
+    token = _session.set(retrieval_cache)
+    try:
+        yield retrieval_cache
+    finally:
+        _session.reset(token)
+        _live_sessions.discard(retrieval_cache)
+
+
+def in_retrieval_session() -> bool:
+    return _session.get() is not None
+
+
+def invalidate_user(user_id):
+    """Drop the user's results from every running session, e.g. after their embeddings changed."""
+    for retrieval_cache in list(_live_sessions):
+        retrieval_cache.invalidate_user(user_id)
+
+
+def cached_retrieve(key, retrieve):
+    retrieval_cache = _session.get()
+    if retrieval_cache is None:
+        return retrieve()
+    docs = retrieval_cache.get(key)
+    if isinstance(docs, list):
+        return list(docs)
+    docs = retrieve()
+    retrieval_cache.put(key, docs)
+    return list(docs)
+
+
+async def acached_retrieve(key, aretrieve):
+    retrieval_cache = _session.get()
+    if retrieval_cache is None:
+        return await aretrieve()
+    cached = retrieval_cache.get(key)
+    if isinstance(cached, list):
+        return list(cached)
+    if isinstance(cached, asyncio.Future):
+        # Another coroutine of the same session is already fetching this key
+        return list(await asyncio.shield(cached))
+
+    future = asyncio.get_running_loop().create_future()
+    retrieval_cache.put(key, future)
+    try:
+        docs = await aretrieve()
+    except BaseException as e:
+        retrieval_cache.discard(key, future)
+        if isinstance(e, Exception):
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting for it
+            future.exception()
+        else:
+            future.cancel()
+        raise
+    retrieval_cache.put(key, docs)
+    future.set_result(docs)
+    return list(docs)
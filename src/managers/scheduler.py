@@ -0,0 +1,306 @@
+import asyncio
+import contextlib
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from contextvars import ContextVar
+
+from src.managers.metrics import current_command, metrics
+
+# Chat model calls (generation, evaluation, QA) in flight at once, overall and per user
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_PER_USER = int(os.environ.get("LLM_MAX_PER_USER", 3))
+# Embedding requests in flight at once; they have their own OpenAI rate limit
+EMBED_MAX_CONCURRENCY = int(os.environ.get("EMBED_MAX_CONCURRENCY", 4))
+
+# Lower runs first
+INTERACTIVE = 0
+BULK = 1
+
+# The Telegram user the current code runs for, set by serialized_per_user
+current_user: ContextVar = ContextVar("scheduler_user", default=None)
+
+
+def current_priority() -> int:
+    # Bot commands are interactive; ingestion jobs and plain worker threads run in the background
+    return BULK if current_command.get() == "background" else INTERACTIVE
+
+
+class _Waiter:
+    __slots__ = ("user_id", "wake", "granted", "cancelled")
+
+    def __init__(self, user_id, wake):
+        self.user_id = user_id
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    """
+    Admission in front of a rate-limited API.
+
+    At most `max_concurrency` calls run at once and at most `max_per_user` of them for one user
+    (0: no per-user limit). Waiting calls are admitted by priority (INTERACTIVE before BULK), then
+    in arrival order, skipping users already at their limit. Calls given the same `key` while one
+    of them is in flight share its result instead of being sent again.
+
+    Usable from the event loop (`run`, `slot`) and from worker threads (`run_sync`, `sync_slot`),
+    both drawing from the same slots.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_per_user: int = 0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._active = 0
+        self._per_user = {}
+        # (priority, sequence, waiter)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._in_flight = {}
+
+    def _eligible(self, user_id) -> bool:
+        return not (self.max_per_user and user_id is not None and self._per_user.get(user_id, 0) >= self.max_per_user)
+
+    def _dispatch(self) -> list:
+        # Called with the lock held; returns the waiters that were just admitted
+        admitted, skipped = [], []
+        while self._queue and self._active < self.max_concurrency:
+            item = heapq.heappop(self._queue)
+            waiter = item[2]
+            if waiter.cancelled:
+                continue
+            if not self._eligible(waiter.user_id):
+                skipped.append(item)
+                continue
+            self._active += 1
+            if waiter.user_id is not None:
+                self._per_user[waiter.user_id] = self._per_user.get(waiter.user_id, 0) + 1
+            waiter.granted = True
+            admitted.append(waiter)
+        for item in skipped:
+            heapq.heappush(self._queue, item)
+        return admitted
+
+    def _enqueue(self, user_id, priority: int, wake) -> _Waiter:
+        waiter = _Waiter(user_id, wake)
+        with self._lock:
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            admitted = self._dispatch()
+        for other in admitted:
+            if other is not waiter:
+                other.wake()
+        return waiter
+
+    def _cancel(self, waiter: _Waiter):
+        with self._lock:
+            waiter.cancelled = not waiter.granted
+        if waiter.granted:
+            self.release(waiter.user_id)
+
+    def release(self, user_id=None):
+        with self._lock:
+            self._active -= 1
+            if user_id is not None:
+                remaining = self._per_user.get(user_id, 0) - 1
+                if remaining > 0:
+                    self._per_user[user_id] = remaining
+                else:
+                    self._per_user.pop(user_id, None)
+            admitted = self._dispatch()
+        for waiter in admitted:
+            waiter.wake()
+
+    def _observe_wait(self, started: float, priority: int):
+        metrics.observe("scheduler_wait_seconds", time.perf_counter() - started, scheduler=self.name,
+                        priority="interactive" if priority == INTERACTIVE else "bulk")
+
+    async def acquire(self, user_id=None, priority: int = INTERACTIVE):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        started = time.perf_counter()
+        waiter = self._enqueue(user_id, priority, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if not waiter.granted:
+            try:
+                await future
+            except asyncio.CancelledError:
+                self._cancel(waiter)
+                raise
+        self._observe_wait(started, priority)
+
+    def acquire_sync(self, user_id=None, priority: int = INTERACTIVE):
+        event = threading.Event()
+        started = time.perf_counter()
+        waiter = self._enqueue(user_id, priority, event.set)
+        if not waiter.granted:
+            event.wait()
+        self._observe_wait(started, priority)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id=None, priority: int = None):
+        user_id = current_user.get() if user_id is None else user_id
+        await self.acquire(user_id, current_priority() if priority is None else priority)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    @contextlib.contextmanager
+    def sync_slot(self, user_id=None, priority: int = None):
+        user_id = current_user.get() if user_id is None else user_id
+        self.acquire_sync(user_id, current_priority() if priority is None else priority)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def _join(self, key):
+        # (shared future, True when this caller has to produce the result)
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                metrics.inc("scheduler_coalesced_total", scheduler=self.name)
+                return shared, False
+            shared = self._in_flight[key] = Future()
+            return shared, True
+
+    def _finish(self, key, shared: Future, result=None, error: BaseException = None):
+        # A cancelled owner cancels `shared`; its followers then retry the call themselves
+        with self._lock:
+            if self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+        if error is None:
+            shared.set_result(result)
+        elif isinstance(error, Exception):
+            shared.set_exception(error)
+        else:
+            shared.cancel()
+
+    async def run(self, func, *args, key=None, user_id=None, priority: int = None, **kwargs):
+        """Await `func(*args, **kwargs)` in a slot; callers with an equal `key` in flight share one call."""
+        if key is None:
+            async with self.slot(user_id, priority):
+                return await func(*args, **kwargs)
+        while True:
+            shared, owner = self._join(key)
+            if owner:
+                break
+            try:
+                return await asyncio.shield(asyncio.wrap_future(shared))
+            except asyncio.CancelledError:
+                # Only the owner was cancelled, not this caller
+                if not shared.cancelled():
+                    raise
+        try:
+            async with self.slot(user_id, priority):
+                result = await func(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, shared, error=e)
+            raise
+        self._finish(key, shared, result)
+        return result
+
+    def run_sync(self, func, *args, key=None, user_id=None, priority: int = None, **kwargs):
+        """Blocking counterpart of `run`, for worker threads and scripts (never the event loop)."""
+        if key is None:
+            with self.sync_slot(user_id, priority):
+                return func(*args, **kwargs)
+        while True:
+            shared, owner = self._join(key)
+            if owner:
+                break
+            try:
+                return shared.result()
+            except CancelledError:
+                pass
+        try:
+            with self.sync_slot(user_id, priority):
+                result = func(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, shared, error=e)
+            raise
+        self._finish(key, shared, result)
+        return result
+
+    async def stream(self, items, user_id=None, priority: int = None):
+        """
+        Yield from the async iterable `items` (e.g. a model's token stream) holding a slot only
+        while it produces: items are buffered, so a slow consumer (Telegram edits, flood waits)
+        does not keep the slot once the model is done.
+        """
+        user_id = current_user.get() if user_id is None else user_id
+        buffer = asyncio.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                async with self.slot(user_id, priority):
+                    async for item in items:
+                        buffer.put_nowait(item)
+            except Exception as e:
+                buffer.put_nowait(_Failure(e))
+            else:
+                buffer.put_nowait(done)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await buffer.get()
+                if item is done:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            # The consumer stopped early: stop the model stream and free the slot
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+
+llm_scheduler = Scheduler("llm", LLM_MAX_CONCURRENCY, LLM_MAX_PER_USER)
+embedding_scheduler = Scheduler("embeddings", EMBED_MAX_CONCURRENCY)
+
+
+def reject_while_running(busy_message: str):
+    """
+    Telegram handler decorator (above serialized_per_user): while a user's command is running
+    or queued, repeated taps of it are answered with `busy_message` instead of starting it again.
+    """
+    def decorator(handler):
+        command = handler.__name__.removesuffix("_command")
+        running = set()
+
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            user_id = update.effective_user.id
+            if user_id in running:
+                metrics.inc("commands_rejected_total", command=command)
+                await update.message.reply_text(busy_message)
+                return None
+            running.add(user_id)
+            try:
+                return await handler(update, context)
+            finally:
+                running.discard(user_id)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from src.managers.executor import run_blocking
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", os.path.join(base_dir, "data", "user_states.sqlite3"))
+LEGACY_STATES_PATH = os.path.join(base_dir, "data", "user_states.json")
+STATE_CACHE_SIZE = int(os.environ.get("STATE_CACHE_SIZE", 2048))
+
+# Large per-user values live in their own table and are never kept in the in-memory cache
+BLOB_FIELDS = ("cv", "active_job")
+
+
+class UserStateStore:
+    """
+    Per-user conversation state in SQLite (WAL mode) with a bounded LRU cache in front.
+
+    Every update touches only the user's own row, so a state transition costs the same no
+    matter how many users exist. Small fields (e.g. `state`) are stored as one JSON row per
+    user; BLOB_FIELDS such as generated CVs and active job offers are stored separately and
+    read on demand.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH, cache_size: int = STATE_CACHE_SIZE,
+                 legacy_path: str = LEGACY_STATES_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS user_blob (
+                user_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (user_id, name)
+            );
+        """)
+        if legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path: str):
+        # One-off migration from the old whole-file user_states.json
+        if self._conn.execute("SELECT 1 FROM user_state LIMIT 1").fetchone():
+            return
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        for user_id, fields in legacy.items():
+            self.update(user_id, **fields)
+        print(f"Imported {len(legacy)} user states from {legacy_path}")
+
+    def _remember(self, key: str, data: dict):
+        self._cache[key] = data
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load(self, key: str):
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.move_to_end(key)
+            return data
+        row = self._conn.execute("SELECT data FROM user_state WHERE user_id = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        self._remember(key, data)
+        return data
+
+    def exists(self, user_id) -> bool:
+        with self._lock:
+            return self._load(str(user_id)) is not None
+
+    def get(self, user_id) -> dict:
+        """Small state fields of a user (a copy), empty when the user is unknown."""
+        with self._lock:
+            return dict(self._load(str(user_id)) or {})
+
+    def get_field(self, user_id, name: str, default=None):
+        key = str(user_id)
+        if name not in BLOB_FIELDS:
+            return self.get(key).get(name, default)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM user_blob WHERE user_id = ? AND name = ?", (key, name)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def update(self, user_id, **fields):
+        """Merge `fields` into the user's state, writing only this user's rows."""
+        key = str(user_id)
+        blobs = {name: fields.pop(name) for name in list(fields) if name in BLOB_FIELDS}
+        with self._lock:
+            data = dict(self._load(key) or {})
+            data.update(fields)
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    (key, json.dumps(data, ensure_ascii=False), time.time())
+                )
+                for name, value in blobs.items():
+                    if value is None:
+                        self._conn.execute("DELETE FROM user_blob WHERE user_id = ? AND name = ?", (key, name))
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO user_blob (user_id, name, value) VALUES (?, ?, ?)",
+                            (key, name, json.dumps(value, ensure_ascii=False))
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._remember(key, data)
+
+    def reset(self, user_id, **fields):
+        """Forget everything stored for the user, then store `fields`."""
+        key = str(user_id)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM user_state WHERE user_id = ?", (key,))
+            self._conn.execute("DELETE FROM user_blob WHERE user_id = ?", (key,))
+            self._conn.execute("COMMIT")
+            self._cache.pop(key, None)
+        self.update(key, **fields)
+
+    # Writes and blob reads always reach SQLite; handlers use these to keep them off the event loop
+
+    async def aget_field(self, user_id, name: str, default=None):
+        return await run_blocking(self.get_field, user_id, name, default)
+
+    async def aupdate(self, user_id, **fields):
+        await run_blocking(self.update, user_id, **fields)
+
+    async def areset(self, user_id, **fields):
+        await run_blocking(self.reset, user_id, **fields)
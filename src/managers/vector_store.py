@@ -0,0 +1,387 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_pinecone import PineconeVectorStore
+from pinecone.exceptions import NotFoundException
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+LOCAL_VECTOR_DIR = os.environ.get("LOCAL_VECTOR_DIR", os.path.join(base_dir, "data", "vector_store"))
+# "pinecone" (default) or "local"
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pinecone")
+
+_INITIAL_CAPACITY = 1024
+_DEFAULT_NAMESPACE = "__default__"
+
+
+def _matches(metadata: dict, filter: dict) -> bool:
+    # The subset of Pinecone's filter language the bot uses: equality, $eq, $ne and $in
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _indexable(value) -> bool:
+    return isinstance(value, (str, int, float, bool))
+
+
+class _Namespace:
+    """
+    One namespace on disk: `vectors.npy` is a memory-mapped float32 matrix of unit vectors
+    (grown by doubling), `log.jsonl` an append-only log of added and deleted records that is
+    replayed on load and compacted once deleted rows pile up.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._vectors_path = os.path.join(path, "vectors.npy")
+        self._log_path = os.path.join(path, "log.jsonl")
+        # Compaction writes these next to the live files and swaps them in once the marker exists
+        self._compact_vectors_path = os.path.join(path, "vectors.compact.npy")
+        self._compact_log_path = os.path.join(path, "log.compact.jsonl")
+        self._compact_marker_path = os.path.join(path, "compact.done")
+        self.vectors = None
+        self.count = 0
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.rows = {}
+        # (metadata key, value) -> set of live rows, for constant-time equality filters
+        self.meta_index = {}
+        self._load()
+
+    def _finish_compaction(self):
+        if os.path.exists(self._compact_marker_path):
+            # The compacted files are complete, finish swapping them in
+            for compacted, live in ((self._compact_vectors_path, self._vectors_path),
+                                    (self._compact_log_path, self._log_path)):
+                if os.path.exists(compacted):
+                    os.replace(compacted, live)
+            os.remove(self._compact_marker_path)
+        else:
+            # Interrupted before the marker: the live files are untouched
+            for compacted in (self._compact_vectors_path, self._compact_log_path):
+                if os.path.exists(compacted):
+                    os.remove(compacted)
+
+    def _load(self):
+        self._finish_compaction()
+        if os.path.exists(self._vectors_path):
+            self.vectors = np.load(self._vectors_path, mmap_mode="r+")
+            self.alive = np.zeros(self.vectors.shape[0], dtype=bool)
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["op"] == "add":
+                    self._apply_add(record["row"], record["id"], record["text"], record["metadata"])
+                else:
+                    self._apply_delete(record["id"])
+
+    def _apply_add(self, row: int, vector_id: str, text: str, metadata: dict):
+        self._apply_delete(vector_id)
+        while len(self.ids) <= row:
+            self.ids.append(None)
+            self.texts.append(None)
+            self.metadatas.append(None)
+        self.ids[row], self.texts[row], self.metadatas[row] = vector_id, text, metadata
+        self.alive[row] = True
+        self.rows[vector_id] = row
+        self.count = max(self.count, row + 1)
+        for key, value in metadata.items():
+            if _indexable(value):
+                self.meta_index.setdefault((key, value), set()).add(row)
+
+    def _apply_delete(self, vector_id: str):
+        row = self.rows.pop(vector_id, None)
+        if row is None:
+            return
+        self.alive[row] = False
+        for key, value in self.metadatas[row].items():
+            if _indexable(value):
+                self.meta_index.get((key, value), set()).discard(row)
+
+    def _ensure_capacity(self, needed: int, dim: int):
+        if self.vectors is not None and self.vectors.shape[0] >= needed:
+            return
+        capacity = max(_INITIAL_CAPACITY, self.vectors.shape[0] if self.vectors is not None else 0)
+        while capacity < needed:
+            capacity *= 2
+        tmp_path = self._vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if self.vectors is not None:
+            grown[:self.count] = self.vectors[:self.count]
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self._vectors_path)
+        self.vectors = np.load(self._vectors_path, mmap_mode="r+")
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self.alive)] = self.alive
+        self.alive = alive
+
+    def add(self, ids: list, texts: list, vectors: list, metadatas: list):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        os.makedirs(self.path, exist_ok=True)
+        self._ensure_capacity(self.count + len(ids), matrix.shape[1])
+        start = self.count
+        self.vectors[start:start + len(ids)] = matrix
+        self.vectors.flush()
+        with open(self._log_path, "a", encoding="utf-8") as f:
+            for offset, (vector_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                row = start + offset
+                self._apply_add(row, vector_id, text, metadata)
+                f.write(json.dumps({"op": "add", "id": vector_id, "row": row, "text": text,
+                                    "metadata": metadata}, ensure_ascii=False) + "\n")
+        self._maybe_compact()
+
+    def delete(self, ids: list):
+        ids = [vector_id for vector_id in ids if vector_id in self.rows]
+        if not ids:
+            return
+        with open(self._log_path, "a", encoding="utf-8") as f:
+            for vector_id in ids:
+                if vector_id in self.rows:
+                    self._apply_delete(vector_id)
+                    f.write(json.dumps({"op": "delete", "id": vector_id}) + "\n")
+        self._maybe_compact()
+
+    def ids_matching(self, filter: dict) -> list:
+        return [self.ids[row] for row in self.filter_rows(filter)]
+
+    def filter_rows(self, filter: dict = None) -> np.ndarray:
+        if not filter:
+            return np.flatnonzero(self.alive[:self.count])
+        rows = None
+        for key, condition in filter.items():
+            if _indexable(condition):
+                matched = self.meta_index.get((key, condition), set())
+                rows = matched if rows is None else rows & matched
+        if rows is None:
+            rows = self.rows.values()
+        # The index narrows the candidates, the full check handles operators
+        return np.fromiter(sorted(row for row in rows if _matches(self.metadatas[row], filter)), dtype=np.int64)
+
+    def search(self, vector, k: int, filter: dict = None) -> list:
+        if self.count == 0 or self.vectors is None:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        if filter:
+            rows = self.filter_rows(filter)
+            if not len(rows):
+                return []
+            scores = self.vectors[rows] @ query
+        else:
+            # Scan the contiguous block instead of gathering live rows, deleted rows never win
+            rows = np.arange(self.count)
+            scores = self.vectors[:self.count] @ query
+            scores[~self.alive[:self.count]] = -np.inf
+            if not len(self.rows):
+                return []
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top if scores[i] != -np.inf]
+
+    def _maybe_compact(self):
+        dead = self.count - len(self.rows)
+        if dead < 1000 or dead < self.count // 4:
+            return
+        live_rows = sorted(self.rows.values())
+        capacity = _INITIAL_CAPACITY
+        while capacity < len(live_rows):
+            capacity *= 2
+        # Build the compacted namespace beside the live one; a crash before the marker is
+        # written leaves the live files as they were, after it `_load` completes the swap
+        compacted = np.lib.format.open_memmap(self._compact_vectors_path, mode="w+", dtype=np.float32,
+                                              shape=(capacity, self.vectors.shape[1]))
+        if live_rows:
+            compacted[:len(live_rows)] = self.vectors[live_rows]
+        compacted.flush()
+        del compacted
+        with open(self._compact_log_path, "w", encoding="utf-8") as f:
+            for new_row, row in enumerate(live_rows):
+                f.write(json.dumps({"op": "add", "id": self.ids[row], "row": new_row, "text": self.texts[row],
+                                    "metadata": self.metadatas[row]}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._compact_marker_path, "w"):
+            pass
+        self.vectors = None
+        self._finish_compaction()
+        self.count, self.ids, self.texts, self.metadatas = 0, [], [], []
+        self.alive, self.rows, self.meta_index = np.zeros(0, dtype=bool), {}, {}
+        self._load()
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store persisted as memory-mapped files, a drop-in for the parts of
+    PineconeVectorStore the bot uses: namespaces, metadata filters, add, delete by ids/filter,
+    scored similarity search and `upsert_embeddings` for pre-computed vectors.
+    """
+
+    def __init__(self, embedding, path: str = LOCAL_VECTOR_DIR, text_key: str = "text"):
+        self._embedding = embedding
+        self._path = path
+        self._text_key = text_key
+        self._namespaces = {}
+        self._lock = threading.RLock()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _namespace(self, namespace: str = None) -> _Namespace:
+        name = namespace or _DEFAULT_NAMESPACE
+        with self._lock:
+            if name not in self._namespaces:
+                self._namespaces[name] = _Namespace(os.path.join(self._path, name))
+            return self._namespaces[name]
+
+    def upsert_embeddings(self, texts: list, vectors: list, metadatas: list, ids: list = None,
+                          namespace: str = None) -> list:
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = [dict(metadata or {}) for metadata in (metadatas or [{} for _ in texts])]
+        with self._lock:
+            self._namespace(namespace).add(list(ids), list(texts), vectors, metadatas)
+        return ids
+
+    def add_texts(self, texts, metadatas: list = None, ids: list = None, namespace: str = None,
+                  **kwargs) -> list:
+        texts = list(texts)
+        return self.upsert_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids, namespace)
+
+    async def aadd_texts(self, texts, metadatas: list = None, ids: list = None, namespace: str = None,
+                         **kwargs) -> list:
+        texts = list(texts)
+        vectors = await self._embedding.aembed_documents(texts)
+        return self.upsert_embeddings(texts, vectors, metadatas, ids, namespace)
+
+    def delete(self, ids: list = None, delete_all: bool = None, namespace: str = None, filter: dict = None,
+               **kwargs) -> None:
+        with self._lock:
+            if delete_all:
+                # Dropping a namespace removes its files, whatever their size
+                self._namespaces.pop(namespace or _DEFAULT_NAMESPACE, None)
+                shutil.rmtree(os.path.join(self._path, namespace or _DEFAULT_NAMESPACE), ignore_errors=True)
+                return
+            space = self._namespace(namespace)
+            if ids is not None:
+                space.delete(ids)
+            elif filter is not None:
+                space.delete(space.ids_matching(filter))
+            else:
+                raise ValueError("Either ids, delete_all, or filter must be provided.")
+
+    async def adelete(self, ids: list = None, delete_all: bool = None, namespace: str = None,
+                      filter: dict = None, **kwargs) -> None:
+        self.delete(ids=ids, delete_all=delete_all, namespace=namespace, filter=filter)
+
+    def similarity_search_by_vector_with_score(self, embedding: list, *, k: int = 4, filter: dict = None,
+                                               namespace: str = None) -> list:
+        with self._lock:
+            space = self._namespace(namespace)
+            return [
+                (Document(id=space.ids[row], page_content=space.texts[row], metadata=dict(space.metadatas[row])),
+                 score)
+                for row, score in space.search(embedding, k, filter)
+            ]
+
+    async def asimilarity_search_by_vector_with_score(self, embedding: list, *, k: int = 4, filter: dict = None,
+                                                      namespace: str = None) -> list:
+        return self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter, namespace=namespace)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict = None,
+                                     namespace: str = None) -> list:
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k=k, filter=filter, namespace=namespace
+        )
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, filter: dict = None,
+                                            namespace: str = None) -> list:
+        return self.similarity_search_by_vector_with_score(
+            await self._embedding.aembed_query(query), k=k, filter=filter, namespace=namespace
+        )
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict = None, namespace: str = None,
+                          **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, namespace=namespace)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: dict = None, namespace: str = None,
+                                 **kwargs) -> list:
+        docs = await self.asimilarity_search_with_score(query, k=k, filter=filter, namespace=namespace)
+        return [doc for doc, _ in docs]
+
+    def similarity_search_by_vector(self, embedding: list, k: int = 4, filter: dict = None,
+                                    namespace: str = None, **kwargs) -> list:
+        docs = self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter, namespace=namespace)
+        return [doc for doc, _ in docs]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas: list = None, ids: list = None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+class PineconeBackend(PineconeVectorStore):
+    """PineconeVectorStore with the `upsert_embeddings` method shared with LocalVectorStore."""
+
+    def delete(self, ids: list = None, delete_all: bool = None, namespace: str = None, filter: dict = None,
+               **kwargs) -> None:
+        try:
+            super().delete(ids=ids, delete_all=delete_all, namespace=namespace, filter=filter, **kwargs)
+        except NotFoundException:
+            # Dropping a namespace that was never written to is a no-op
+            if not delete_all:
+                raise
+
+    async def adelete(self, ids: list = None, delete_all: bool = None, namespace: str = None,
+                      filter: dict = None, **kwargs) -> None:
+        try:
+            await super().adelete(ids=ids, delete_all=delete_all, namespace=namespace, filter=filter, **kwargs)
+        except NotFoundException:
+            if not delete_all:
+                raise
+
+    def upsert_embeddings(self, texts: list, vectors: list, metadatas: list, ids: list = None,
+                          namespace: str = None) -> list:
+        # Store the text the same way PineconeVectorStore.add_texts does
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        records = []
+        for vector_id, text, vector, metadata in zip(ids, texts, vectors, metadatas):
+            records.append((vector_id, vector, {**metadata, self._text_key: text}))
+        self.index.upsert(vectors=records, namespace=namespace if namespace is not None else self._namespace)
+        return ids
+
+
+def create_vectorstore(embedding, backend: str = VECTOR_BACKEND, index_name: str = None):
+    if backend == "local":
+        return LocalVectorStore(embedding)
+    if backend == "pinecone":
+        return PineconeBackend(index_name=index_name, embedding=embedding)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
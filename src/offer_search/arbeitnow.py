@@ -1,4 +1,5 @@
-import requests
+from src.offer_search.sources import http
+
 
 class ArbeitNowAPI:
     def __init__(self):
@@ -7,7 +8,7 @@ class ArbeitNowAPI:
     def search_jobs(self, query, limit=5):
         try:
             params = {"search": query}
-            response = requests.get(self.base_url, params=params, timeout=10)
+            response = http.get(self.base_url, params=params, timeout=10)
 
             if response.status_code == 200:
                 data = response.json()
@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.offer_search.dedup import content_hash
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+CATALOG_PATH = os.environ.get('OFFER_CATALOG_PATH', os.path.join(base_dir, 'data', 'offers.sqlite3'))
+LEGACY_JOBS_PATH = os.path.join(base_dir, 'data', 'jobs.json')
+
+COLUMNS = ('url', 'source', 'title', 'company', 'location', 'description')
+# A pending offer has never been embedded or changed since it was
+PENDING = 'embedded_hash IS NOT content_hash'
+INSERT_OFFER = ('INSERT INTO offers (url, source, title, company, location, description, extra, content_hash, '
+                'scraped_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ')
+
+
+class OfferCatalog:
+    '''
+    Scraped offers in SQLite (WAL mode), indexed by URL, source, title, company and embedding
+    status.
+
+    Upserts touch one row, lookups go through an index and `pending` reads only the offers whose
+    current content has not been embedded yet (a partial index), so none of them depends on the
+    catalog size. Fields outside COLUMNS are kept as JSON in `extra`.
+    '''
+
+    def __init__(self, path=CATALOG_PATH, legacy_path=LEGACY_JOBS_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(f'''
+            CREATE TABLE IF NOT EXISTS offers (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                source TEXT,
+                title TEXT,
+                company TEXT,
+                location TEXT,
+                description TEXT,
+                extra TEXT,
+                content_hash TEXT NOT NULL,
+                embedded_hash TEXT,
+                scraped_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS offers_source ON offers(source);
+            CREATE INDEX IF NOT EXISTS offers_title ON offers(title COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS offers_company ON offers(company COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS offers_pending ON offers(id) WHERE {PENDING};
+            CREATE INDEX IF NOT EXISTS offers_scraped_at ON offers(scraped_at);
+        ''')
+        if legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, legacy_path):
+        # One-off migration from the old whole-file jobs.json
+        if self._conn.execute('SELECT 1 FROM offers LIMIT 1').fetchone():
+            return
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            jobs = json.load(f)
+        self.upsert_many(jobs)
+        print(f'Imported {len(jobs)} offers from {legacy_path}')
+
+    @staticmethod
+    def _row(offer, scraped_at):
+        extra = {key: value for key, value in offer.items() if key not in COLUMNS}
+        return (*(offer.get(column) for column in COLUMNS), json.dumps(extra, ensure_ascii=False) if extra else None,
+                content_hash(offer), scraped_at)
+
+    @staticmethod
+    def _offer(row):
+        offer = {column: row[column] for column in COLUMNS if row[column] is not None}
+        if row['extra']:
+            offer.update(json.loads(row['extra']))
+        return offer
+
+    def upsert_many(self, offers):
+        '''Insert new offers and update changed ones (by URL). Returns how many rows changed.'''
+        offers = [offer for offer in offers if offer.get('url')]
+        with self._lock:
+            before = self._conn.total_changes
+            # Stamped once the write lock is held, so scraped_at grows in commit order (see `changed_since`)
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                scraped_at = time.time()
+                rows = [self._row(offer, scraped_at) for offer in offers]
+                self._conn.executemany(
+                    INSERT_OFFER + 'ON CONFLICT(url) DO UPDATE SET source = excluded.source, title = excluded.title, '
+                    'company = excluded.company, location = excluded.location, description = excluded.description, '
+                    'extra = excluded.extra, content_hash = excluded.content_hash, scraped_at = excluded.scraped_at '
+                    'WHERE offers.content_hash != excluded.content_hash',
+                    rows
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            return self._conn.total_changes - before
+
+    def upsert(self, offer):
+        return self.upsert_many([offer])
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM offers WHERE url = ?', (url,)).fetchone()
+        return self._offer(row) if row else None
+
+    def find(self, title=None, company=None, source=None, limit=100):
+        '''Offers matching every given field exactly (title and company case-insensitively).'''
+        conditions, params = [], []
+        for column, value in (('title', title), ('company', company)):
+            if value is not None:
+                conditions.append(f'{column} = ? COLLATE NOCASE')
+                params.append(value)
+        if source is not None:
+            conditions.append('source = ?')
+            params.append(source)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self._lock:
+            rows = self._conn.execute(f'SELECT * FROM offers{where} ORDER BY id LIMIT ?', (*params, limit)).fetchall()
+        return [self._offer(row) for row in rows]
+
+    def _iter(self, where='', batch_size=1000, params=()):
+        # Keyset pagination: constant memory, and no OFFSET scans on large catalogs
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT * FROM offers WHERE id > ? {where} ORDER BY id LIMIT ?', (last_id, *params, batch_size)
+                ).fetchall()
+            for row in rows:
+                yield self._offer(row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    def iter_offers(self, batch_size=1000):
+        return self._iter(batch_size=batch_size)
+
+    def last_change(self):
+        '''`scraped_at` of the most recently inserted or updated offer (0 for an empty catalog).'''
+        with self._lock:
+            return self._conn.execute('SELECT MAX(scraped_at) FROM offers').fetchone()[0] or 0.0
+
+    def changed_since(self, since, batch_size=1000):
+        '''Offers inserted or updated after `since`, a `last_change()` value; also sees other processes' writes.'''
+        return self._iter('AND scraped_at > ?', batch_size, (since,))
+
+    def pending(self, batch_size=1000):
+        '''Offers whose current version is not embedded yet.'''
+        return self._iter(f'AND {PENDING}', batch_size)
+
+    def mark_embedded(self, offers):
+        '''
+        Record that exactly these versions of the offers are in the vector index. An offer the
+        catalog does not hold yet (e.g. its scrape batch is not written) is inserted first, so the
+        mark is never lost and the later upsert of the same version changes nothing.
+        '''
+        offers = [offer for offer in offers if offer.get('url')]
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                scraped_at = time.time()
+                self._conn.executemany(INSERT_OFFER + 'ON CONFLICT(url) DO NOTHING',
+                                       [self._row(offer, scraped_at) for offer in offers])
+                self._conn.executemany('UPDATE offers SET embedded_hash = ? WHERE url = ?',
+                                       [(content_hash(offer), offer['url']) for offer in offers])
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def count(self, pending=False):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM offers{' WHERE ' + PENDING if pending else ''}").fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    '''Process-wide offer catalog, opened on first use.'''
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = OfferCatalog()
+    return _catalog
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+import sqlite3
+from urllib.parse import urlsplit, urlunsplit
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+DEDUP_PATH = os.environ.get('OFFER_DEDUP_PATH', os.path.join(base_dir, 'data', 'offer_dedup.sqlite3'))
+
+SIMHASH_BITS = 64
+# 4 bands of 16 bits: two fingerprints within Hamming distance 3 always share at least one band
+BANDS = 4
+BAND_BITS = SIMHASH_BITS // BANDS
+MAX_DISTANCE = 3
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _normalize(text):
+    return ' '.join(_WORD_RE.findall((text or '').lower()))
+
+
+def canonical_offer_key(job):
+    '''Stable identity of an offer: its normalized URL, or title + company when there is no URL.'''
+    url = (job.get('url') or '').strip()
+    if url:
+        parts = urlsplit(url)
+        path = parts.path.rstrip('/')
+        return urlunsplit((parts.scheme.lower() or 'https', parts.netloc.lower(), path, '', ''))
+    return 'title:' + _normalize(job.get('title')) + '|' + _normalize(job.get('company'))
+
+
+def offer_vector_ids(offer_key, chunk_count):
+    # Deterministic IDs make re-ingesting an offer overwrite its vectors instead of adding clones
+    digest = hashlib.sha1(offer_key.encode('utf-8')).hexdigest()[:24]
+    return [f'offer-{digest}-{i}' for i in range(chunk_count)]
+
+
+def content_hash(job):
+    text = '\0'.join([job.get('title') or '', job.get('company') or '', job.get('description') or ''])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def simhash(text, shingle_size=3):
+    words = _normalize(text).split()
+    if len(words) < shingle_size:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def offer_fingerprint(job):
+    return simhash(f"{job.get('title', '')} {job.get('company', '')} {job.get('description', '')}")
+
+
+def _bands(fingerprint):
+    mask = (1 << BAND_BITS) - 1
+    return [(band, fingerprint >> (band * BAND_BITS) & mask) for band in range(BANDS)]
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    '''
+    Persistent SimHash index over title, company and description of every ingested offer.
+
+    `check` classifies an offer as:
+    - "new": never seen,
+    - "unchanged": same canonical key and content, already stored,
+    - "changed": same canonical key, different content (or never fully stored),
+    - "duplicate": a near-identical offer exists under another key (e.g. the same job
+      scraped from NoFluffJobs and JustJoin.it).
+    '''
+
+    def __init__(self, path=DEDUP_PATH, max_distance=MAX_DISTANCE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_distance = max_distance
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS offers (
+                offer_key TEXT PRIMARY KEY,
+                fingerprint INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                ingested INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                offer_key TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_lookup ON bands(band, value);
+            CREATE INDEX IF NOT EXISTS bands_key ON bands(offer_key);
+        ''')
+
+    def get(self, offer_key):
+        row = self._conn.execute(
+            'SELECT fingerprint, content_hash, chunk_count, ingested FROM offers WHERE offer_key = ?',
+            (offer_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'fingerprint': _to_unsigned(row[0]), 'content_hash': row[1], 'chunk_count': row[2],
+                'ingested': bool(row[3])}
+
+    def find_near_duplicate(self, fingerprint, exclude_key=None):
+        for band, value in _bands(fingerprint):
+            rows = self._conn.execute(
+                'SELECT b.offer_key, o.fingerprint FROM bands b JOIN offers o ON o.offer_key = b.offer_key '
+                'WHERE b.band = ? AND b.value = ?', (band, value)
+            ).fetchall()
+            for offer_key, other in rows:
+                if offer_key == exclude_key:
+                    continue
+                if bin(fingerprint ^ _to_unsigned(other)).count('1') <= self.max_distance:
+                    return offer_key
+        return None
+
+    def check(self, job):
+        offer_key = canonical_offer_key(job)
+        existing = self.get(offer_key)
+        if existing is not None:
+            if existing['ingested'] and existing['content_hash'] == content_hash(job):
+                return 'unchanged', offer_key
+            return 'changed', offer_key
+        if self.find_near_duplicate(offer_fingerprint(job), exclude_key=offer_key):
+            return 'duplicate', offer_key
+        return 'new', offer_key
+
+    def record(self, offer_key, job, chunk_count):
+        '''Register an offer before its vectors are upserted; `mark_ingested` confirms the upsert.'''
+        fingerprint = offer_fingerprint(job)
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO offers (offer_key, fingerprint, content_hash, chunk_count, ingested) '
+                'VALUES (?, ?, ?, ?, 0)',
+                (offer_key, _to_signed(fingerprint), content_hash(job), chunk_count)
+            )
+            self._conn.execute('DELETE FROM bands WHERE offer_key = ?', (offer_key,))
+            self._conn.executemany(
+                'INSERT INTO bands (band, value, offer_key) VALUES (?, ?, ?)',
+                [(band, value, offer_key) for band, value in _bands(fingerprint)]
+            )
+
+    def mark_ingested(self, offer_keys):
+        with self._conn:
+            self._conn.executemany('UPDATE offers SET ingested = 1 WHERE offer_key = ?',
+                                   [(key,) for key in offer_keys])
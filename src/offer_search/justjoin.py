@@ -1,8 +1,9 @@
 import os
 
-import requests
 from dotenv import load_dotenv
 
+from src.offer_search.sources import http, wait_for_apify_run
+
 load_dotenv()
 TOKEN = os.environ.get('APIFY_TOKEN')
 
@@ -33,7 +34,7 @@ class JustJoinItAPI:
                 run_input.update(filters)
 
             # Start the actor run
-            response = requests.post(
+            response = http.post(
                 f"{self.base_url}/runs?token={self.api_token}",
                 json=run_input,
                 headers={"Content-Type": "application/json"}
@@ -52,34 +53,13 @@ class JustJoinItAPI:
             return f"❌ Search failed: {str(e)}"
 
     def _wait_for_results(self, run_id):
-        import time
-
-        # Poll for completion (simplified version)
-        for _ in range(30):  # Wait up to 5 minutes
-            status_response = requests.get(
-                f"https://api.apify.com/v2/actor-runs/{run_id}?token={self.api_token}"
-            )
-
-            if status_response.status_code == 200:
-                status = status_response.json()["data"]["status"]
-
-                if status == "SUCCEEDED":
-                    # Get dataset results
-                    dataset_id = status_response.json()["data"]["defaultDatasetId"]
-                    results_response = requests.get(
-                        f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={self.api_token}"
-                    )
-
-                    if results_response.status_code == 200:
-                        jobs = results_response.json()
-                        return self.format_jobs(jobs)
-
-                elif status == "FAILED":
-                    return "❌ Job search failed"
-
-            time.sleep(10)
-
-        return "⏰ Search timed out"
+        # Poll with exponential backoff on the pooled session, for up to 5 minutes
+        result = wait_for_apify_run(run_id, self.api_token)
+        if result == 'FAILED':
+            return "❌ Job search failed"
+        if isinstance(result, str):
+            return "⏰ Search timed out"
+        return self.format_jobs(result)
 
     def format_jobs(self, jobs):
         if not jobs:
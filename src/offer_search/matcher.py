@@ -0,0 +1,387 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from src.managers.chunking import split_text
+from src.managers.executor import run_blocking
+from src.managers.knowledge import embeddings, vectorstore, OFFERS_NAMESPACE
+from src.offer_search.catalog import get_catalog
+from src.offer_search.title_index import tokenize
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+MATCHES_PATH = os.environ.get('MATCHES_PATH', os.path.join(base_dir, 'data', 'matches.sqlite3'))
+# Best offers kept per user, and offer chunks pulled from the index when a CV arrives
+MATCH_TOP_N = int(os.environ.get('MATCH_TOP_N', 50))
+MATCH_CANDIDATES = int(os.environ.get('MATCH_CANDIDATES', 200))
+SIMILARITY_WEIGHT = 0.7
+SKILL_WEIGHT = 0.3
+# Skill overlap credited to an offer that names no known skill: neither a full nor a zero match
+NEUTRAL_SKILL_OVERLAP = 0.5
+
+# Compared after `tokenize`, so 'node.js' is 'nodejs', 'machine learning' is 'ml' and so on
+SKILL_TERMS = {
+    'python', 'java', 'javascript', 'typescript', 'golang', 'rust', 'c++', 'c#', 'kotlin', 'swift', 'php',
+    'ruby', 'scala', 'sql', 'nosql', 'postgresql', 'postgres', 'mysql', 'mongodb', 'redis', 'elasticsearch',
+    'kafka', 'rabbitmq', 'spark', 'airflow', 'hadoop', 'dbt', 'snowflake', 'bigquery', 'pandas', 'numpy',
+    'pytorch', 'tensorflow', 'sklearn', 'ml', 'nlp', 'llm', 'langchain', 'django', 'flask', 'fastapi', 'spring',
+    'react', 'angular', 'vue', 'nodejs', 'dotnet', 'html', 'css', 'graphql', 'grpc', 'microservices', 'docker',
+    'kubernetes', 'k8s', 'terraform', 'ansible', 'aws', 'azure', 'gcp', 'linux', 'git', 'jenkins', 'selenium',
+    'cypress', 'figma', 'tableau', 'excel', 'jira',
+}
+URL_RE = re.compile(r'https?://\S+')
+
+
+def extract_skills(text):
+    return set(tokenize(text)) & SKILL_TERMS
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1)
+
+
+def score_match(similarity, cv_skills, offer_skills):
+    '''(score, matched skills, missing skills); offers naming no known skill get NEUTRAL_SKILL_OVERLAP.'''
+    if not offer_skills:
+        return SIMILARITY_WEIGHT * similarity + SKILL_WEIGHT * NEUTRAL_SKILL_OVERLAP, [], []
+    matched = sorted(cv_skills & offer_skills)
+    overlap = len(matched) / len(offer_skills)
+    return SIMILARITY_WEIGHT * similarity + SKILL_WEIGHT * overlap, matched, sorted(offer_skills - cv_skills)
+
+
+def max_score(similarity):
+    '''Upper bound of `score_match` at this similarity, reached when the CV has every skill the offer names.'''
+    return SIMILARITY_WEIGHT * similarity + SKILL_WEIGHT * max(1.0, NEUTRAL_SKILL_OVERLAP)
+
+
+class MatchStore:
+    '''CV profiles (mean chunk embedding + skills) and every user's best-scored offers, in SQLite.'''
+
+    def __init__(self, path=MATCHES_PATH, top_n=MATCH_TOP_N):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS profiles (
+                user_id TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                skills TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS matches (
+                user_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                company TEXT,
+                score REAL NOT NULL,
+                similarity REAL NOT NULL,
+                matched TEXT NOT NULL,
+                missing TEXT NOT NULL,
+                PRIMARY KEY (user_id, url)
+            );
+            CREATE INDEX IF NOT EXISTS matches_rank ON matches(user_id, score DESC);
+            CREATE INDEX IF NOT EXISTS matches_url ON matches(url);
+        ''')
+
+    def profiles(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT user_id, vector, skills FROM profiles').fetchall()
+        return [(row['user_id'], np.frombuffer(row['vector'], dtype=np.float32), set(json.loads(row['skills'])))
+                for row in rows]
+
+    def _prune(self, user_ids):
+        for user_id in user_ids:
+            self._conn.execute(
+                'DELETE FROM matches WHERE user_id = ? AND url NOT IN '
+                '(SELECT url FROM matches WHERE user_id = ? ORDER BY score DESC LIMIT ?)',
+                (user_id, user_id, self.top_n)
+            )
+
+    def _insert(self, matches):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO matches (user_id, url, title, company, score, similarity, matched, missing) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(m['user_id'], m['url'], m.get('title'), m.get('company'), m['score'], m['similarity'],
+              json.dumps(m['matched']), json.dumps(m['missing'])) for m in matches]
+        )
+
+    def replace_user(self, user_id, vector, skills, matches):
+        '''Store a new CV profile and its ranking, dropping whatever the previous CV had.'''
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute('INSERT OR REPLACE INTO profiles (user_id, vector, skills, updated_at) '
+                               'VALUES (?, ?, ?, ?)',
+                               (user_id, _unit(vector).tobytes(), json.dumps(sorted(skills)), time.time()))
+            self._conn.execute('DELETE FROM matches WHERE user_id = ?', (user_id,))
+            self._insert(matches)
+            self._prune([user_id])
+            self._conn.execute('COMMIT')
+
+    def merge(self, matches):
+        '''Add newly scored offers to the rankings, keeping each user's top N.'''
+        user_ids = {m['user_id'] for m in matches}
+        with self._lock:
+            self._conn.execute('BEGIN')
+            # Users forgotten while the batch was scored have no profile left
+            known = {row['user_id'] for row in self._conn.execute(
+                f'SELECT user_id FROM profiles WHERE user_id IN ({",".join("?" * len(user_ids))})', list(user_ids))}
+            self._insert([m for m in matches if m['user_id'] in known])
+            self._prune(known)
+            self._conn.execute('COMMIT')
+
+    def holders(self, urls):
+        '''url -> users whose ranking currently holds it.'''
+        urls = list(urls)
+        with self._lock:
+            rows = self._conn.execute(f'SELECT user_id, url FROM matches WHERE url IN ({",".join("?" * len(urls))})',
+                                      urls).fetchall()
+        holders = defaultdict(set)
+        for row in rows:
+            holders[row['url']].add(row['user_id'])
+        return holders
+
+    def delete_offers(self, urls):
+        '''Drop offers from every ranking; returns the users whose ranking changed.'''
+        urls = list(urls)
+        marks = ",".join("?" * len(urls))
+        with self._lock:
+            self._conn.execute('BEGIN')
+            user_ids = {row['user_id'] for row in self._conn.execute(
+                f'SELECT DISTINCT user_id FROM matches WHERE url IN ({marks})', urls)}
+            self._conn.execute(f'DELETE FROM matches WHERE url IN ({marks})', urls)
+            self._conn.execute('COMMIT')
+        return user_ids
+
+    def floor(self, user_id):
+        '''Score an offer has to beat to enter a full ranking (None while the ranking has room).'''
+        with self._lock:
+            row = self._conn.execute('SELECT score FROM matches WHERE user_id = ? ORDER BY score DESC '
+                                     'LIMIT 1 OFFSET ?', (user_id, self.top_n - 1)).fetchone()
+        return row['score'] if row else None
+
+    def top(self, user_id, limit=None):
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM matches WHERE user_id = ? ORDER BY score DESC LIMIT ?',
+                                      (user_id, limit or self.top_n)).fetchall()
+        return [self._match(row) for row in rows]
+
+    def get(self, user_id, url):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM matches WHERE user_id = ? AND url = ?', (user_id, url)).fetchone()
+        return self._match(row) if row else None
+
+    @staticmethod
+    def _match(row):
+        match = dict(row)
+        match['matched'], match['missing'] = json.loads(match['matched']), json.loads(match['missing'])
+        return match
+
+    def delete_user(self, user_id):
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute('DELETE FROM profiles WHERE user_id = ?', (user_id,))
+            self._conn.execute('DELETE FROM matches WHERE user_id = ?', (user_id,))
+            self._conn.execute('COMMIT')
+
+
+class OfferMatcher:
+    '''
+    Keeps a ranked list of the best offers for every stored CV.
+
+    When a CV is ingested its profile (the mean of its chunk embeddings) is matched against the
+    offer index once. Afterwards every batch of newly embedded offers is scored against all
+    profiles in one matrix product and merged into the rankings it beats, so nothing is ever
+    recomputed from scratch. The score mixes the best chunk similarity with the share of the
+    offer's skills found in the CV.
+    '''
+
+    def __init__(self, store=None, catalog=None):
+        self.store = store or MatchStore()
+        self.catalog = catalog or get_catalog()
+        self._lock = threading.Lock()
+        self._user_ids = None
+        self._vectors = None
+        self._skills = None
+        # Lowest score still in each full ranking
+        self._floors = {}
+        # Bumped by every new CV and by forget_user; a match run only stores its result while
+        # its generation is still the user's latest
+        self._generations = defaultdict(int)
+        self._tasks = {}
+
+    def _load(self):
+        # Called with the lock held
+        if self._user_ids is None:
+            profiles = self.store.profiles()
+            self._user_ids = [user_id for user_id, _, _ in profiles]
+            self._vectors = np.vstack([vector for _, vector, _ in profiles]) if profiles else None
+            self._skills = [skills for _, _, skills in profiles]
+            self._floors = {user_id: self.store.floor(user_id) for user_id in self._user_ids}
+
+    def _offer_skills(self, url, text):
+        offer = self.catalog.get(url) if url else None
+        return extract_skills(offer['description'] if offer and offer.get('description') else text)
+
+    def _next_generation(self, user_id):
+        with self._lock:
+            self._generations[user_id] += 1
+            return self._generations[user_id]
+
+    def match_user_vector(self, user_id, vector, cv_skills, docs_with_scores, generation=None):
+        '''Rank the offer chunks found for a fresh CV profile and store the result (None when superseded).'''
+        user_id = str(user_id)
+        best = {}
+        for doc, similarity in docs_with_scores:
+            url = doc.metadata.get('url')
+            if url and (url not in best or similarity > best[url][1]):
+                best[url] = (doc, similarity)
+        matches = []
+        for url, (doc, similarity) in best.items():
+            score, matched, missing = score_match(float(similarity), cv_skills,
+                                                  self._offer_skills(url, doc.page_content))
+            matches.append({'user_id': user_id, 'url': url, 'title': doc.metadata.get('title'),
+                            'company': doc.metadata.get('company'), 'score': score, 'similarity': float(similarity),
+                            'matched': matched, 'missing': missing})
+        with self._lock:
+            if generation is not None and generation != self._generations[user_id]:
+                return None
+            self.store.replace_user(user_id, vector, cv_skills, matches)
+            self._user_ids = None
+        return len(matches)
+
+    async def amatch_user(self, user_id, cv_text):
+        generation = self._next_generation(str(user_id))
+        # The CV chunks were just embedded during ingestion, so this is served from the cache
+        chunks = split_text(cv_text)
+        if not chunks:
+            return 0
+        vector = _unit(np.mean(await embeddings.aembed_documents(chunks), axis=0))
+        docs = await vectorstore.asimilarity_search_by_vector_with_score(
+            vector.tolist(), k=MATCH_CANDIDATES, namespace=OFFERS_NAMESPACE)
+        return await run_blocking(self.match_user_vector, user_id, vector, extract_skills(cv_text), docs, generation)
+
+    def schedule(self, user_id, cv_text):
+        '''Rank the offers for a just ingested CV in the background, replacing a run for an older CV.'''
+        user_id = str(user_id)
+        previous = self._tasks.get(user_id)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.create_task(_match_in_background(self, user_id, cv_text))
+        # Also keeps the task referenced; the loop only holds weak references
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda done: self._tasks.pop(user_id, None) if self._tasks.get(user_id) is done else None)
+        return task
+
+    def add_offer_vectors(self, texts, vectors, metadatas):
+        '''Score freshly embedded offer chunks against every stored CV and update the rankings.'''
+        by_url = defaultdict(list)
+        for text, vector, metadata in zip(texts, vectors, metadatas):
+            if metadata.get('url'):
+                by_url[metadata['url']].append((text, vector, metadata))
+        with self._lock:
+            self._load()
+            if not by_url or self._vectors is None:
+                return 0
+            user_ids, profiles, skills, floors = self._user_ids, self._vectors, self._skills, dict(self._floors)
+        # Offers already ranked (re-ingested after a change) are always re-scored, even downwards
+        holders = self.store.holders(by_url)
+
+        matches = []
+        for url, chunks in by_url.items():
+            # Best chunk per user, the same measure a fresh CV gets from the index
+            similarities = (profiles @ np.vstack([_unit(vector) for _, vector, _ in chunks]).T).max(axis=1)
+            offer_skills = None
+            metadata = chunks[0][2]
+            for user_index in np.argsort(-similarities):
+                similarity = float(similarities[user_index])
+                floor = floors.get(user_ids[user_index])
+                ranked = user_ids[user_index] in holders.get(url, ())
+                # Even a full skill match could not lift the offer into this ranking
+                if not ranked and floor is not None and max_score(similarity) < floor:
+                    continue
+                if offer_skills is None:
+                    offer_skills = self._offer_skills(url, ' '.join(text for text, _, _ in chunks))
+                score, matched, missing = score_match(similarity, skills[user_index], offer_skills)
+                if ranked or floor is None or score > floor:
+                    matches.append({'user_id': user_ids[user_index], 'url': url, 'title': metadata.get('title'),
+                                    'company': metadata.get('company'), 'score': score, 'similarity': similarity,
+                                    'matched': matched, 'missing': missing})
+        if matches:
+            self.store.merge(matches)
+            self._refresh_floors({match['user_id'] for match in matches})
+        return len(matches)
+
+    def _refresh_floors(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                if self._user_ids is not None and user_id in self._floors:
+                    self._floors[user_id] = self.store.floor(user_id)
+
+    def remove_offers(self, urls):
+        '''Take offers whose vectors were deleted or replaced out of every ranking.'''
+        urls = [url for url in urls if url]
+        if urls:
+            self._refresh_floors(self.store.delete_offers(urls))
+
+    def top(self, user_id, limit=None):
+        return self.store.top(str(user_id), limit)
+
+    def find(self, user_id, job_offer):
+        '''The precomputed match of an offer quoted (with its URL) in `job_offer`, if any.'''
+        for url in URL_RE.findall(job_offer or ''):
+            match = self.store.get(str(user_id), url.rstrip('.,;)'))
+            if match:
+                return match
+        return None
+
+    def forget_user(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            # A match run still in a worker thread must not store the profile again
+            self._generations[user_id] += 1
+            self.store.delete_user(user_id)
+            self._user_ids = None
+
+    async def aforget_user(self, user_id):
+        task = self._tasks.pop(str(user_id), None)
+        if task is not None:
+            task.cancel()
+        await run_blocking(self.forget_user, user_id)
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = OfferMatcher()
+    return _matcher
+
+
+async def _match_in_background(matcher, user_id, cv_text):
+    try:
+        count = await matcher.amatch_user(user_id, cv_text)
+        if count is not None:
+            print(f'🎯 Ranked {count} offers for user {user_id}')
+    except Exception as e:
+        print(f'❌ Matching offers for user {user_id} failed: {e}')
+
+
+def schedule_user_match(user_id, cv_text):
+    '''Rank the offers for a just ingested CV without making the user wait for it.'''
+    return get_matcher().schedule(user_id, cv_text)
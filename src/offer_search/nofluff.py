@@ -1,10 +1,11 @@
-import json
+import asyncio
 import os
-import time
 
-import requests
 from dotenv import load_dotenv
 
+from src.offer_search.catalog import get_catalog
+from src.offer_search.sources import http, wait_for_apify_run, NoFluffSource, scrape_all
+
 load_dotenv()
 TOKEN = os.environ.get('APIFY_TOKEN')
 
@@ -29,7 +30,7 @@ class ApifyNoFluffJobsAPI:
                 "maxItems": limit
             }
 
-            response = requests.post(
+            response = http.post(
                 f"{self.base_url}/runs?token={self.api_token}",
                 json=run_input,
                 headers={"Content-Type": "application/json"}
@@ -45,32 +46,13 @@ class ApifyNoFluffJobsAPI:
             return f"❌ Search failed: {str(e)}"
 
     def _wait_for_results(self, run_id):
-        # Poll for completion (simplified version)
-        for _ in range(30):  # Wait up to 5 minutes
-            status_response = requests.get(
-                f"https://api.apify.com/v2/actor-runs/{run_id}?token={self.api_token}"
-            )
-
-            if status_response.status_code == 200:
-                status = status_response.json()["data"]["status"]
-
-                if status == "SUCCEEDED":
-                    # Get dataset results
-                    dataset_id = status_response.json()["data"]["defaultDatasetId"]
-                    results_response = requests.get(
-                        f"https://api.apify.com/v2/datasets/{dataset_id}/items?token={self.api_token}"
-                    )
-
-                    if results_response.status_code == 200:
-                        jobs = results_response.json()
-                        return self.format_jobs(jobs)
-
-                elif status == "FAILED":
-                    return "❌ Job search failed"
-
-            time.sleep(10)
-
-        return "⏰ Search timed out"
+        # Poll with exponential backoff on the pooled session, for up to 5 minutes
+        result = wait_for_apify_run(run_id, self.api_token)
+        if result == 'FAILED':
+            return "❌ Job search failed"
+        if isinstance(result, str):
+            return "⏰ Search timed out"
+        return self.format_jobs(result)
 
     def format_jobs(self, jobs):
         if not jobs:
@@ -81,33 +63,12 @@ class ApifyNoFluffJobsAPI:
         return jobs
 
 if __name__ == "__main__":
-    with open('../../data/jobs.json', 'r', encoding='utf-8') as f:
-        jobs = json.load(f)
-    api = ApifyNoFluffJobsAPI(TOKEN)
-    results = api.search_jobs("https://nofluffjobs.com/pl/backend?criteria=fullstack")
-
-    print(results)
-    for job in results:
-        requirements_section = ""
-        if job.get('requirements', False):
-            musts = [item['value'] for item in job['requirements'].get('musts', [])]
-            nices = [item['value'] for item in job['requirements'].get('nices', [])]
-            # Build the requirements section as plain text
-            if musts:
-                requirements_section += "Must have: " + ", ".join(musts) + "\n"
-            if nices:
-                requirements_section += "Nice to have: " + ", ".join(nices) + "\n"
-        job_dict = {
-            "url": f'https://nofluffjobs.com/pl/job/{job["id"]}',
-            "description": (
-                    job["details"]["description"] + "\n\nRequirements:\n" +
-                    requirements_section
-            ),
-            "company": job["company"]["url"],
-            "title": job["title"]
-        }
-        jobs.append(job_dict)
-
-    with open('../../data/jobs.json', 'w', encoding='utf-8') as f:
-        json.dump(jobs, f, indent=2, ensure_ascii=False)
-
+    # Incremental run: only offers new or changed since the last run are written to the
+    # catalog, an offer that is already there is updated in place
+    offers, cursors = asyncio.run(scrape_all([NoFluffSource(search_url="https://nofluffjobs.com/pl/backend?criteria=fullstack",
+                                                   api_token=TOKEN)]))
+    catalog = get_catalog()
+    changed = catalog.upsert_many(offers)
+    # Only now that the offers are stored may the next run skip them
+    cursors.commit()
+    print(f"{changed} new or changed offers, {len(catalog)} in the catalog")
@@ -1,7 +1,22 @@
+import argparse
+import hashlib
 import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.managers.knowledge import split_documents, embed_texts, upsert_embeddings, delete_vectors
+from src.offer_search.catalog import get_catalog
+from src.offer_search.dedup import NearDuplicateIndex, offer_vector_ids
+from src.offer_search.matcher import get_matcher
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+CHECKPOINT_PATH = os.path.join(base_dir, 'data', 'ingestion_checkpoint.json')
+
+# Pinecone recommends upserting at most ~100 vectors per request
+UPSERT_BATCH_SIZE = 100
 
-from advisor import user_id
-from knowledge import ingest_to_knowledge_base
 
 def format_job_for_ingestion(job):
     desc = job['description'].replace('\n','')
@@ -13,32 +28,184 @@ def format_job_for_ingestion(job):
     )
 
 
-def main(start_index=0, end_index=None):
-    with open('../../data/jobs.json', 'r', encoding='utf-8') as f:
-        jobs = json.load(f)
+def offer_metadata(job, offer_key=None):
+    return {
+        "user_id": "offers",
+        "offer_key": offer_key or '',
+        "url": job.get('url', ''),
+        "title": job.get('title', ''),
+        "company": job.get('company', ''),
+    }
+
+
+def jobs_fingerprint(jobs):
+    '''Identifies an input list by its length and the URLs in it, so a checkpoint only resumes the same list.'''
+    digest = hashlib.sha256(str(len(jobs)).encode('utf-8'))
+    for job in jobs:
+        digest.update(b'\0' + str(job.get('url', '')).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path, next_index, ingested, fingerprint=None, end_index=None):
+    # Write to a temp file first so a crash never leaves a half-written checkpoint
+    os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"next_index": next_index, "ingested": ingested, "fingerprint": fingerprint,
+                   "end_index": end_index}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def remove_checkpoint(checkpoint_path):
+    try:
+        os.remove(checkpoint_path)
+    except FileNotFoundError:
+        pass
+
 
+def _embed_and_upsert(texts, metadatas, ids):
+    # One embedding request for the whole batch, then upserts in Pinecone-sized slices
+    vectors = embed_texts(texts)
+    for i in range(0, len(texts), UPSERT_BATCH_SIZE):
+        upsert_embeddings(texts[i:i + UPSERT_BATCH_SIZE], vectors[i:i + UPSERT_BATCH_SIZE],
+                          metadatas[i:i + UPSERT_BATCH_SIZE], ids=ids[i:i + UPSERT_BATCH_SIZE])
+    get_matcher().add_offer_vectors(texts, vectors, metadatas)
+
+
+def ingest_offers_bulk(jobs, start_index=0, end_index=None, batch_size=500, workers=4,
+                       checkpoint_path=CHECKPOINT_PATH, resume=True, dedup_index=None, catalog=None):
+    '''
+    Ingest many offers at once.
+
+    Chunks of consecutive offers are packed into embedding batches of roughly `batch_size`
+    chunks, batches are embedded and upserted on `workers` threads, and the index of the first
+    offer that is not yet fully stored is written to `checkpoint_path`, so a crashed run picks
+    up where it stopped. The checkpoint records a fingerprint of `jobs` and `end_index` and is
+    only resumed by a run over the same list and window; a completed run removes it.
+
+    Offers are deduplicated against a persistent near-duplicate index and stored under IDs
+    derived from their canonical key, so re-running ingestion overwrites instead of appending.
+
+    With a `catalog`, every offer handled (stored or skipped as a duplicate) is marked as
+    embedded there once its batch is stored; pass `checkpoint_path=None` to rely on that alone.
+    '''
+    dedup_index = dedup_index or NearDuplicateIndex()
     if end_index is None or end_index > len(jobs):
         end_index = len(jobs)
 
+    fingerprint = jobs_fingerprint(jobs) if checkpoint_path else None
+    checkpoint = load_checkpoint(checkpoint_path) if resume and checkpoint_path else None
+    ingested = 0
+    if checkpoint and (checkpoint.get('fingerprint') != fingerprint or checkpoint.get('end_index') != end_index):
+        print(f'Ignoring checkpoint {checkpoint_path}: it belongs to a different offer list')
+    elif checkpoint and start_index < checkpoint['next_index'] <= end_index:
+        start_index = checkpoint['next_index']
+        ingested = checkpoint.get('ingested', 0)
+        print(f'Resuming from offer {start_index}')
+
     skip_counter = 0
-    seen_prefixes = set()
+    batch_texts, batch_metadatas, batch_ids, batch_keys, batch_jobs = [], [], [], [], []
+    # (next_index, offer_keys, jobs, future) in submission order; the checkpoint only moves past
+    # a batch once it and every batch before it are stored
+    pending = deque()
+    max_in_flight = workers * 2
+    started = time.perf_counter()
+    run_ingested = 0
 
-    for i in range(start_index, end_index):
-        job = jobs[i]
-        desc = job['description'] if 'description' in job else ''
-        prefix = desc[:100]
+    def drain(wait_all):
+        nonlocal ingested, run_ingested
+        while pending:
+            next_index, offer_keys, handled_jobs, future = pending[0]
+            if not (future.done() or wait_all or len(pending) >= max_in_flight):
+                break
+            future.result()
+            pending.popleft()
+            dedup_index.mark_ingested(offer_keys)
+            if catalog is not None:
+                catalog.mark_embedded(handled_jobs)
+            ingested += len(offer_keys)
+            run_ingested += len(offer_keys)
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, next_index, ingested, fingerprint, end_index)
+            elapsed = time.perf_counter() - started
+            print(f'Ingested {ingested} offers (next index {next_index}, '
+                  f'{run_ingested / max(elapsed, 1e-9):.1f} offers/s)')
 
-        if prefix in seen_prefixes:
-            print('Skipping duplicate job')
-            skip_counter += 1
-            continue  # Skip this job
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def flush(next_index):
+            nonlocal batch_texts, batch_metadatas, batch_ids, batch_keys, batch_jobs
+            if batch_texts:
+                future = executor.submit(_embed_and_upsert, batch_texts, batch_metadatas, batch_ids)
+            else:
+                future = Future()
+                future.set_result(None)
+            pending.append((next_index, batch_keys, batch_jobs, future))
+            batch_texts, batch_metadatas, batch_ids, batch_keys, batch_jobs = [], [], [], [], []
+            # Backpressure: block once `max_in_flight` batches are queued
+            drain(wait_all=False)
 
-        formatted_text = format_job_for_ingestion(job)
-        print(formatted_text)
-        print(ingest_to_knowledge_base(formatted_text, user_id='offers'))
+        for i in range(start_index, end_index):
+            job = jobs[i]
+            status, offer_key = dedup_index.check(job)
+            batch_jobs.append(job)
+            if status in ('duplicate', 'unchanged'):
+                skip_counter += 1
+                continue  # Skip this job
 
-        seen_prefixes.add(prefix)
+            texts, metadatas = split_documents([format_job_for_ingestion(job)],
+                                               [offer_metadata(job, offer_key)])
+            ids = offer_vector_ids(offer_key, len(texts))
+            previous = dedup_index.get(offer_key)
+            if previous and previous['chunk_count'] > len(texts):
+                # The offer shrank, drop the chunks the new version no longer overwrites
+                delete_vectors(offer_vector_ids(offer_key, previous['chunk_count'])[len(texts):])
+                get_matcher().remove_offers([job.get('url')])
+            dedup_index.record(offer_key, job, len(texts))
+
+            batch_texts.extend(texts)
+            batch_metadatas.extend(metadatas)
+            batch_ids.extend(ids)
+            batch_keys.append(offer_key)
+            if len(batch_texts) >= batch_size:
+                flush(i + 1)
+
+        flush(end_index)
+        drain(wait_all=True)
+
+    if checkpoint_path:
+        # Everything is stored, a later run must not resume from this list's checkpoint
+        remove_checkpoint(checkpoint_path)
+    elapsed = time.perf_counter() - started
+    print(f'Done: {run_ingested} offers in {elapsed:.1f}s ({run_ingested / max(elapsed, 1e-9):.1f} offers/s)')
     print('Total skipped jobs: {}'.format(skip_counter))
+    return run_ingested
+
+
+def main(batch_size=500, workers=4, limit=None):
+    '''Embed the catalog offers that are new or changed since they were last embedded.'''
+    catalog = get_catalog()
+    jobs = []
+    for job in catalog.pending():
+        jobs.append(job)
+        if limit and len(jobs) >= limit:
+            break
+    print(f'{len(jobs)} offers to ingest')
+    # The catalog tracks progress itself, a re-run continues with what is still pending
+    return ingest_offers_bulk(jobs, batch_size=batch_size, workers=workers, checkpoint_path=None,
+                              catalog=catalog)
+
 
 if __name__ == '__main__':
-    main(400, 800)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Bulk ingest pending catalog offers into the knowledge base')
+    parser.add_argument('--batch-size', type=int, default=500, help='Chunks per embedding request')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent upsert threads')
+    parser.add_argument('--limit', type=int, default=None, help='Ingest at most this many pending offers')
+    args = parser.parse_args()
+    main(batch_size=args.batch_size, workers=args.workers, limit=args.limit)
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import time
+
+from src.managers.executor import run_blocking
+from src.managers.knowledge import embeddings, split_documents, upsert_embeddings, delete_vectors
+from src.offer_search.catalog import get_catalog
+from src.offer_search.dedup import NearDuplicateIndex, offer_vector_ids
+from src.offer_search.matcher import get_matcher
+from src.offer_search.offer_ingestion import format_job_for_ingestion, offer_metadata, UPSERT_BATCH_SIZE
+from src.offer_search.sources import CursorStore, stream_offers
+
+PIPELINE_QUEUE_SIZE = 256
+EMBED_BATCH_SIZE = 256
+CATALOG_BATCH_SIZE = 100
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.skipped = 0
+        self.busy = 0.0
+
+    def summary(self, elapsed):
+        line = f'{self.name}: {self.items} ({self.items / max(elapsed, 1e-9):.1f}/s'
+        if self.skipped:
+            line += f', {self.skipped} skipped'
+        return line + f', busy {self.busy:.1f}s)'
+
+
+class OfferPipeline:
+    '''
+    Streaming offer ingestion: fetch -> normalize -> dedup -> chunk -> embed -> upsert.
+
+    Every stage runs as its own task(s) connected by bounded queues, so a slow stage (usually
+    embedding) applies backpressure all the way back to the scrapers and memory stays constant
+    however large the catalog is. Throughput per stage is printed every `report_interval`
+    seconds and returned at the end.
+
+    Fetched offers are written to the offer catalog (unless `store_offers` is off, e.g. when
+    the input already comes from the catalog) and marked as embedded once they are stored or
+    skipped as duplicates.
+    '''
+
+    def __init__(self, dedup_index=None, catalog=None, store_offers=True, queue_size=PIPELINE_QUEUE_SIZE,
+                 embed_batch_size=EMBED_BATCH_SIZE, embed_workers=2, upsert_workers=2, report_interval=10.0):
+        self.dedup_index = dedup_index or NearDuplicateIndex()
+        self.catalog = catalog or get_catalog()
+        self.store_offers = store_offers
+        self.queue_size = queue_size
+        self.embed_batch_size = embed_batch_size
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.report_interval = report_interval
+        self.stats = {name: StageStats(name) for name in ('fetch', 'normalize', 'dedup', 'chunk', 'embed', 'upsert')}
+        # The dedup index is one SQLite connection, never use it from two threads at once
+        self._dedup_lock = asyncio.Lock()
+
+    async def _fetch(self, offers, out):
+        unsaved = []
+        async for offer in offers:
+            self.stats['fetch'].items += 1
+            if self.store_offers:
+                unsaved.append(offer)
+                if len(unsaved) >= CATALOG_BATCH_SIZE:
+                    await run_blocking(self.catalog.upsert_many, unsaved)
+                    unsaved = []
+            await out.put(offer)
+        if unsaved:
+            await run_blocking(self.catalog.upsert_many, unsaved)
+
+    async def _normalize(self, offer):
+        try:
+            return [(offer, format_job_for_ingestion(offer))]
+        except (KeyError, AttributeError):
+            self.stats['normalize'].skipped += 1
+            return []
+
+    def _dedup_and_record(self, offer, text):
+        status, offer_key = self.dedup_index.check(offer)
+        if status in ('duplicate', 'unchanged'):
+            self.catalog.mark_embedded([offer])
+            return None
+        # The chunk count is part of the record, so splitting happens here; registering the offer
+        # right away lets later offers of the same run be recognized as its duplicates
+        texts, metadatas = split_documents([text], [offer_metadata(offer, offer_key)])
+        previous = self.dedup_index.get(offer_key)
+        self.dedup_index.record(offer_key, offer, len(texts))
+        return offer, offer_key, texts, metadatas, previous['chunk_count'] if previous else 0
+
+    async def _dedup(self, item):
+        async with self._dedup_lock:
+            result = await run_blocking(self._dedup_and_record, *item)
+        if result is None:
+            self.stats['dedup'].skipped += 1
+            return []
+        return [result]
+
+    async def _chunk(self, item):
+        offer, offer_key, texts, metadatas, previous_count = item
+        ids = offer_vector_ids(offer_key, max(len(texts), previous_count))
+        if previous_count > len(texts):
+            # The offer shrank, drop the chunks the new version no longer overwrites
+            await run_blocking(delete_vectors, ids[len(texts):])
+            await run_blocking(get_matcher().remove_offers, [offer.get('url')])
+        return [(offer, offer_key, texts, metadatas, ids[:len(texts)])]
+
+    async def _embed_worker(self, inbox, out):
+        stats = self.stats['embed']
+        finished = False
+        while not finished:
+            # Take whatever is queued up to the batch size, but never wait for a full batch
+            batch = [await inbox.get()]
+            while batch[-1] is not _DONE and sum(len(item[2]) for item in batch) < self.embed_batch_size:
+                try:
+                    batch.append(inbox.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            if batch[-1] is _DONE:
+                batch.pop()
+                await inbox.put(_DONE)
+                finished = True
+            if not batch:
+                continue
+            started = time.perf_counter()
+            texts = [text for item in batch for text in item[2]]
+            vectors = await embeddings.aembed_documents(texts)
+            stats.busy += time.perf_counter() - started
+            stats.items += len(batch)
+            await out.put((
+                [item[0] for item in batch], [item[1] for item in batch], texts, vectors,
+                [metadata for item in batch for metadata in item[3]],
+                [vector_id for item in batch for vector_id in item[4]],
+            ))
+
+    def _upsert_batch(self, texts, vectors, metadatas, ids):
+        for i in range(0, len(texts), UPSERT_BATCH_SIZE):
+            upsert_embeddings(texts[i:i + UPSERT_BATCH_SIZE], vectors[i:i + UPSERT_BATCH_SIZE],
+                              metadatas[i:i + UPSERT_BATCH_SIZE], ids=ids[i:i + UPSERT_BATCH_SIZE])
+        # New offers enter the stored CVs' rankings without rescoring the corpus
+        get_matcher().add_offer_vectors(texts, vectors, metadatas)
+
+    async def _upsert(self, batch):
+        offers, offer_keys, texts, vectors, metadatas, ids = batch
+        await run_blocking(self._upsert_batch, texts, vectors, metadatas, ids)
+        async with self._dedup_lock:
+            await run_blocking(self.dedup_index.mark_ingested, offer_keys)
+        await run_blocking(self.catalog.mark_embedded, offers)
+        return []
+
+    async def _stage_worker(self, name, func, inbox, out, size=lambda item: 1):
+        stats = self.stats[name]
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # Let the stage's other workers see the end of the stream too
+                await inbox.put(_DONE)
+                return
+            started = time.perf_counter()
+            results = await func(item)
+            stats.busy += time.perf_counter() - started
+            stats.items += size(item)
+            for result in results:
+                await out.put(result)
+
+    async def _stage(self, workers, out):
+        await asyncio.gather(*workers)
+        if out is not None:
+            await out.put(_DONE)
+
+    async def _report(self, started):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            elapsed = time.perf_counter() - started
+            print(' | '.join(stats.summary(elapsed) for stats in self.stats.values()))
+
+    async def run(self, offers=None, cursors=None):
+        '''
+        Ingest an async iterable of offers (by default a fresh incremental scrape of every source).
+        Scrape `cursors` staged by the stream are committed only once every offer went through.
+        '''
+        if offers is None:
+            cursors = CursorStore()
+            offers = stream_offers(cursors=cursors, save_cursors=False)
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(5)]
+        fetched, normalized, deduplicated, chunked, embedded = queues
+        started = time.perf_counter()
+
+        async def fetch_stage():
+            await self._fetch(offers, fetched)
+            await fetched.put(_DONE)
+
+        stages = [
+            fetch_stage(),
+            self._stage([self._stage_worker('normalize', self._normalize, fetched, normalized)], normalized),
+            self._stage([self._stage_worker('dedup', self._dedup, normalized, deduplicated)], deduplicated),
+            self._stage([self._stage_worker('chunk', self._chunk, deduplicated, chunked)], chunked),
+            self._stage([self._embed_worker(chunked, embedded) for _ in range(self.embed_workers)], embedded),
+            # Upsert throughput is counted in offers, not batches
+            self._stage([self._stage_worker('upsert', self._upsert, embedded, None, size=lambda batch: len(batch[0]))
+                         for _ in range(self.upsert_workers)], None),
+        ]
+        reporter = asyncio.create_task(self._report(started))
+        tasks = [asyncio.create_task(stage) for stage in stages]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            reporter.cancel()
+            for task in tasks:
+                task.cancel()
+        if cursors is not None:
+            cursors.commit()
+        elapsed = time.perf_counter() - started
+        for stats in self.stats.values():
+            print(stats.summary(elapsed))
+        return {name: stats.items for name, stats in self.stats.items()}
+
+
+async def iter_pending(catalog, batch_size=500):
+    '''Async stream of the catalog offers still waiting to be embedded, read a page at a time.'''
+    pages = catalog.pending(batch_size)
+    while True:
+        page = await run_blocking(lambda: [offer for _, offer in zip(range(batch_size), pages)])
+        for offer in page:
+            yield offer
+        if len(page) < batch_size:
+            return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scrape every offer source and stream new offers into the knowledge base')
+    parser.add_argument('--full', action='store_true', help='Ignore the scrape cursors and re-read every source')
+    parser.add_argument('--pending', action='store_true',
+                        help='Embed the pending catalog offers instead of scraping')
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE, help='Chunks per embedding request')
+    parser.add_argument('--embed-workers', type=int, default=2)
+    parser.add_argument('--upsert-workers', type=int, default=2)
+    args = parser.parse_args()
+    pipeline = OfferPipeline(store_offers=not args.pending, embed_batch_size=args.embed_batch_size,
+                             embed_workers=args.embed_workers, upsert_workers=args.upsert_workers)
+    cursors = None if args.pending or args.full else CursorStore()
+    offers = iter_pending(pipeline.catalog) if args.pending else \
+        stream_offers(cursors=cursors, incremental=not args.full, save_cursors=False)
+    asyncio.run(pipeline.run(offers, cursors))
@@ -0,0 +1,453 @@
+import abc
+import asyncio
+import json
+import os
+import random
+import time
+
+import aiohttp
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from src.managers.metrics import metrics, timed
+from src.offer_search.catalog import get_catalog
+from src.offer_search.dedup import canonical_offer_key, content_hash
+
+load_dotenv()
+APIFY_TOKEN = os.environ.get('APIFY_TOKEN')
+APIFY_API = 'https://api.apify.com/v2'
+
+base_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+SCRAPE_CURSORS_PATH = os.path.join(base_dir, 'data', 'scrape_cursors.json')
+# Fingerprints of offers not seen for this long are dropped from the cursors
+CURSOR_RETENTION_DAYS = 30
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def backoff_delays(initial=1.0, maximum=30.0, timeout=300.0, factor=2.0):
+    '''Exponentially growing delays with jitter whose sum stays within `timeout` seconds.'''
+    delay, waited = initial, 0.0
+    while waited < timeout:
+        current = min(delay, maximum, timeout - waited) * random.uniform(0.8, 1.0)
+        yield current
+        waited += current
+        delay *= factor
+
+
+# Pooled keep-alive session for the synchronous API classes
+http = requests.Session()
+http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+def wait_for_apify_run(run_id, api_token, timeout=300.0):
+    '''
+    Poll an Apify actor run until it finishes, backing off exponentially between polls.
+    Returns the dataset items, or a status string ('FAILED', 'TIMED-OUT', ...) when no items came.
+    '''
+    for delay in backoff_delays(timeout=timeout):
+        response = http.get(f'{APIFY_API}/actor-runs/{run_id}', params={'token': api_token}, timeout=30)
+        if response.status_code == 200:
+            data = response.json()['data']
+            if data['status'] == 'SUCCEEDED':
+                items = http.get(f"{APIFY_API}/datasets/{data['defaultDatasetId']}/items",
+                                 params={'token': api_token, 'clean': 'true'}, timeout=60)
+                items.raise_for_status()
+                return items.json()
+            if data['status'] in ('FAILED', 'ABORTED', 'TIMED-OUT'):
+                return data['status']
+        time.sleep(delay)
+    return 'TIMED-OUT'
+
+
+def normalize_nofluff_job(job):
+    requirements_section = ''
+    if job.get('requirements', False):
+        musts = [item['value'] for item in job['requirements'].get('musts', [])]
+        nices = [item['value'] for item in job['requirements'].get('nices', [])]
+        # Build the requirements section as plain text
+        if musts:
+            requirements_section += 'Must have: ' + ', '.join(musts) + '\n'
+        if nices:
+            requirements_section += 'Nice to have: ' + ', '.join(nices) + '\n'
+    return {
+        'url': f'https://nofluffjobs.com/pl/job/{job["id"]}',
+        'description': (
+                job['details']['description'] + '\n\nRequirements:\n' +
+                requirements_section
+        ),
+        'company': job['company']['url'],
+        'title': job['title'],
+    }
+
+
+class CursorStore:
+    '''
+    Per-source scrape cursors (ETags, publish-time high-water marks, fingerprints of the offers
+    seen so far) in one JSON file. A source's cursor is only saved after it finished a run, or
+    staged until its offers are stored too and then committed by the consumer.
+    '''
+
+    def __init__(self, path=SCRAPE_CURSORS_PATH):
+        self.path = path
+        self._cursors = {}
+        self._staged = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._cursors = json.load(f)
+
+    def get(self, key):
+        return dict(self._cursors.get(key, {}))
+
+    def stage(self, key, cursor):
+        self._staged[key] = cursor
+
+    def commit(self):
+        '''Save the staged cursors, once every offer read before them has been ingested.'''
+        if self._staged:
+            self._cursors.update(self._staged)
+            self._staged = {}
+            self._write()
+
+    def save(self, key, cursor):
+        self._cursors[key] = cursor
+        self._write()
+
+    def _write(self):
+        # Write to a temp file first so a crash never leaves half-written cursors
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._cursors, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class RateLimiter:
+    '''Token bucket: at most `rate` requests per second with bursts of up to `burst`.'''
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SourceError(Exception):
+    pass
+
+
+class OfferSource(abc.ABC):
+    '''
+    Base class of an async offer source. Subclasses implement `fetch` (an async generator of raw
+    items) and `normalize` (raw item -> offer dict with url, title, company, description, location).
+    Requests go through `request`, which applies the source's rate limit and retries transient
+    failures with exponential backoff.
+
+    Runs are incremental: `fetch` may read and update `self.state` (the source's cursor, e.g. an
+    ETag or the newest publish time) to stop early, and `offers` only yields offers that are new
+    or changed since the previous run, judged by the content fingerprints kept in the cursor.
+    '''
+
+    name = 'source'
+    rate = 2.0
+    max_retries = 4
+
+    def __init__(self):
+        self.limiter = RateLimiter(self.rate)
+        self.cursor_key = self.name
+        self.state = {}
+        self.next_cursor = None
+
+    async def _send(self, session, method, url, **kwargs):
+        last_error = None
+        delays = backoff_delays(initial=1.0, maximum=30.0, timeout=120.0)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                async with timed('scrape_request', source=self.name), session.request(method, url, **kwargs) as response:
+                    if response.status == 304:
+                        return response.status, response.headers, None
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return response.status, response.headers, await response.json(content_type=None)
+                    last_error = SourceError(f'{self.name}: HTTP {response.status} for {url}')
+                    retry_after = response.headers.get('Retry-After')
+                    metrics.inc('scrape_retries_total', source=self.name, status=response.status)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_error, retry_after = e, None
+            if attempt == self.max_retries:
+                break
+            delay = next(delays, 30.0)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            await asyncio.sleep(delay)
+        raise last_error
+
+    async def request(self, session, method, url, **kwargs):
+        return (await self._send(session, method, url, **kwargs))[2]
+
+    async def get_if_changed(self, session, url, etag=None, **kwargs):
+        '''Conditional GET: (None, etag) when the resource still matches `etag`, else (data, new etag).'''
+        headers = dict(kwargs.pop('headers', None) or {})
+        if etag:
+            headers['If-None-Match'] = etag
+        status, response_headers, data = await self._send(session, 'GET', url, headers=headers, **kwargs)
+        return data, response_headers.get('ETag') or etag
+
+    @abc.abstractmethod
+    async def fetch(self, session):
+        yield
+
+    @abc.abstractmethod
+    def normalize(self, item):
+        pass
+
+    async def offers(self, session, cursor=None):
+        cursor = cursor or {}
+        seen = dict(cursor.get('seen', {}))
+        self.state = {key: value for key, value in cursor.items() if key != 'seen'}
+        self.next_cursor = None
+        now = int(time.time())
+        async for item in self.fetch(session):
+            offer = self.normalize(item)
+            if not (offer and offer.get('url') and offer.get('title')):
+                continue
+            key, fingerprint = canonical_offer_key(offer), content_hash(offer)[:16]
+            previous = seen.get(key)
+            seen[key] = [fingerprint, now]
+            if previous and previous[0] == fingerprint:
+                continue
+            yield dict(offer, source=self.name)
+        cutoff = now - CURSOR_RETENTION_DAYS * 86400
+        self.next_cursor = {**self.state, 'seen': {key: value for key, value in seen.items() if value[1] >= cutoff}}
+
+
+class ArbeitNowSource(OfferSource):
+    name = 'arbeitnow'
+    rate = 1.0
+    base_url = 'https://www.arbeitnow.com/api/job-board-api'
+    # Offers published this long before the high-water mark are still re-checked for edits
+    HIGH_WATER_OVERLAP = 86400
+
+    def __init__(self, query=None, max_pages=100):
+        super().__init__()
+        self.query = query
+        self.max_pages = max_pages
+        if query:
+            self.cursor_key = f'{self.name}:{query}'
+
+    async def fetch(self, session):
+        # The board lists the newest offers first: an unchanged first page (ETag) means nothing
+        # new, and paging stops at the first page older than the previous run's newest offer
+        high_water = self.state.get('high_water', 0)
+        url, params = self.base_url, {'search': self.query} if self.query else {}
+        data, self.state['etag'] = await self.get_if_changed(session, url, self.state.get('etag'), params=params)
+        for _ in range(self.max_pages):
+            if data is None:
+                return
+            items = data.get('data', [])
+            for item in items:
+                self.state['high_water'] = max(self.state.get('high_water', 0), item.get('created_at') or 0)
+                yield item
+            if high_water and all((item.get('created_at') or 0) < high_water - self.HIGH_WATER_OVERLAP
+                                  for item in items):
+                return
+            url = (data.get('links') or {}).get('next')
+            if not url:
+                return
+            data = await self.request(session, 'GET', url)
+
+    def normalize(self, item):
+        return {
+            'url': item.get('url', ''),
+            'title': item.get('title', ''),
+            'company': item.get('company_name', ''),
+            'location': item.get('location', ''),
+            'description': item.get('description', ''),
+        }
+
+
+class ApifySource(OfferSource):
+    '''
+    Runs an Apify actor and streams its dataset page by page once the run succeeds. The actors
+    always scrape the full listing, so the delta is cut on our side by the offer fingerprints.
+    '''
+
+    actor = None
+    poll_timeout = 300.0
+
+    def __init__(self, api_token=APIFY_TOKEN, limit=100):
+        super().__init__()
+        self.api_token = api_token
+        self.limit = limit
+
+    def run_input(self):
+        return {'maxItems': self.limit}
+
+    async def wait_for_run(self, session, run_id):
+        for delay in backoff_delays(timeout=self.poll_timeout):
+            data = (await self.request(session, 'GET', f'{APIFY_API}/actor-runs/{run_id}',
+                                       params={'token': self.api_token}))['data']
+            if data['status'] == 'SUCCEEDED':
+                return data['defaultDatasetId']
+            if data['status'] in ('FAILED', 'ABORTED', 'TIMED-OUT'):
+                raise SourceError(f"{self.name}: Apify run {run_id} {data['status']}")
+            await asyncio.sleep(delay)
+        raise SourceError(f'{self.name}: Apify run {run_id} did not finish in {self.poll_timeout:.0f}s')
+
+    async def fetch(self, session, page_size=500):
+        run = await self.request(session, 'POST', f'{APIFY_API}/acts/{self.actor}/runs',
+                                 params={'token': self.api_token}, json=self.run_input())
+        dataset_id = await self.wait_for_run(session, run['data']['id'])
+        offset = 0
+        while True:
+            items = await self.request(session, 'GET', f'{APIFY_API}/datasets/{dataset_id}/items',
+                                       params={'token': self.api_token, 'clean': 'true',
+                                               'offset': offset, 'limit': page_size})
+            for item in items:
+                yield item
+            if len(items) < page_size:
+                break
+            offset += page_size
+
+
+class JustJoinSource(ApifySource):
+    name = 'justjoin'
+    actor = 'piotrv1001~just-join-it-scraper'
+
+    def __init__(self, filters=None, **kwargs):
+        super().__init__(**kwargs)
+        self.filters = filters or {}
+        if self.filters:
+            self.cursor_key = f'{self.name}:{json.dumps(self.filters, sort_keys=True)}'
+
+    def run_input(self):
+        return {**super().run_input(), **self.filters}
+
+    def normalize(self, item):
+        return {
+            'url': item.get('jobUrl', ''),
+            'title': item.get('title', ''),
+            'company': item.get('companyName', ''),
+            'location': item.get('city', ''),
+            'description': item.get('description') or item.get('body') or '',
+        }
+
+
+class NoFluffSource(ApifySource):
+    name = 'nofluff'
+    actor = 'memo23~apify-nofluffjobs-cheerio-scraper'
+
+    def __init__(self, search_url=None, **kwargs):
+        super().__init__(**kwargs)
+        self.search_url = search_url
+        if search_url:
+            self.cursor_key = f'{self.name}:{search_url}'
+
+    def run_input(self):
+        return {**super().run_input(), 'startUrls': [{'url': self.search_url or 'https://nofluffjobs.com/pl'}]}
+
+    def normalize(self, item):
+        return normalize_nofluff_job(item)
+
+
+def default_sources():
+    sources = [ArbeitNowSource()]
+    if APIFY_TOKEN:
+        sources += [JustJoinSource(), NoFluffSource()]
+    return sources
+
+
+def create_session(limit=32, limit_per_host=8, timeout=60):
+    '''Shared aiohttp session: one keep-alive connection pool for every source.'''
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    )
+
+
+async def stream_offers(sources=None, session=None, queue_size=1000, cursors=None, incremental=True,
+                        save_cursors=True):
+    '''
+    Run every source concurrently and yield normalized offers as they arrive, so scraping all
+    sources takes as long as the slowest one. A failing source is reported and skipped.
+
+    With `incremental` only offers new or changed since the source's last completed run are
+    yielded, and each source's cursor is saved to `cursors` once it finishes. Without
+    `save_cursors` they are only staged: the consumer calls `cursors.commit()` after it has
+    stored every offer, so offers lost downstream are read again by the next run.
+    '''
+    sources = sources if sources is not None else default_sources()
+    if incremental:
+        cursors = cursors or CursorStore()
+    own_session = session is None
+    session = session or create_session()
+    queue = asyncio.Queue(maxsize=queue_size)
+    done = object()
+
+    async def pump(source):
+        started, count = time.perf_counter(), 0
+        try:
+            cursor = cursors.get(source.cursor_key) if incremental else None
+            async for offer in source.offers(session, cursor):
+                await queue.put(offer)
+                count += 1
+        except Exception as e:
+            metrics.inc('scrape_failures_total', source=source.name)
+            print(f'❌ {source.name} failed after {count} offers: {e}')
+        else:
+            if incremental and save_cursors:
+                cursors.save(source.cursor_key, source.next_cursor)
+            elif incremental:
+                cursors.stage(source.cursor_key, source.next_cursor)
+            print(f'{source.name}: {count} new or changed offers in {time.perf_counter() - started:.1f}s')
+        finally:
+            metrics.inc('scraped_offers_total', count, source=source.name)
+            await queue.put(done)
+
+    tasks = [asyncio.create_task(pump(source)) for source in sources]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            offer = await queue.get()
+            if offer is done:
+                remaining -= 1
+            else:
+                yield offer
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if own_session:
+            await session.close()
+
+
+async def scrape_all(sources=None, incremental=True):
+    '''
+    Every offer of one scrape and the `CursorStore` holding the sources' staged cursors: call
+    `cursors.commit()` once the offers are stored, or the next run yields them again.
+    '''
+    cursors = CursorStore()
+    offers = [offer async for offer in stream_offers(sources, cursors=cursors, incremental=incremental,
+                                                     save_cursors=False)]
+    return offers, cursors
+
+
+if __name__ == '__main__':
+    offers, cursors = asyncio.run(scrape_all())
+    changed = get_catalog().upsert_many(offers)
+    cursors.commit()
+    print(f'Scraped {len(offers)} offers, {changed} new or changed in the catalog')
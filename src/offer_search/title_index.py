@@ -0,0 +1,269 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from src.offer_search.catalog import get_catalog
+
+TOKEN_RE = re.compile(r'[a-ząćęłńóśźż0-9+#.]+')
+
+# Spelling variants folded into one token before tokenizing, for offers and queries alike
+PHRASES = [
+    (re.compile(r'back[\s-]?end'), 'backend'),
+    (re.compile(r'front[\s-]?end'), 'frontend'),
+    (re.compile(r'full[\s-]?stack'), 'fullstack'),
+    (re.compile(r'dev[\s-]?ops'), 'devops'),
+    (re.compile(r'machine[\s-]learning'), 'ml'),
+    (re.compile(r'data[\s-]science'), 'datascience'),
+    (re.compile(r'node[\s.]?js'), 'nodejs'),
+    (re.compile(r'react[\s.]?js'), 'react'),
+    (re.compile(r'\.net\b'), 'dotnet'),
+]
+
+# Groups of interchangeable terms; a query term also matches the other members of its group
+SYNONYM_GROUPS = [
+    {'developer', 'engineer', 'programmer', 'programista', 'dev', 'inżynier'},
+    {'backend', 'server'},
+    {'frontend', 'ui'},
+    {'javascript', 'js'},
+    {'typescript', 'ts'},
+    {'python', 'py', 'django', 'flask', 'fastapi'},
+    {'golang', 'go'},
+    {'ml', 'ai'},
+    {'analyst', 'analityk', 'analytics'},
+    {'devops', 'sre', 'platform'},
+    {'qa', 'tester', 'testing'},
+    {'senior', 'lead', 'principal'},
+    {'junior', 'intern', 'trainee', 'stażysta'},
+    {'manager', 'kierownik'},
+]
+SYNONYM_WEIGHT = 0.6
+FUZZY_WEIGHT = 0.5
+FUZZY_MIN_SHARED_TRIGRAMS = 2
+
+_synonyms = defaultdict(set)
+for _group in SYNONYM_GROUPS:
+    for _term in _group:
+        _synonyms[_term] |= _group - {_term}
+
+
+def tokenize(text):
+    text = (text or '').lower()
+    for pattern, replacement in PHRASES:
+        text = pattern.sub(replacement, text)
+    return [token.strip('.') for token in TOKEN_RE.findall(text) if token.strip('.')]
+
+
+def _trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b):
+    # Optimal string alignment: Levenshtein plus adjacent transpositions ("pyhton" -> "python")
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class TitleIndex:
+    '''
+    In-memory BM25 index over offer titles (and company names), with synonym expansion and
+    trigram-filtered fuzzy matching for misspelled query terms. Answers in milliseconds for
+    catalogs of tens of thousands of offers.
+    '''
+
+    def __init__(self, k1=1.2, b=0.75, company_weight=0.3):
+        self.k1 = k1
+        self.b = b
+        self.company_weight = company_weight
+        self.offers = []
+        self._by_url = {}
+        self._postings = defaultdict(dict)
+        self._lengths = []
+        # Terms of every document, so removing one only touches its own postings
+        self._terms = []
+        self._total_length = 0.0
+        self._live = 0
+        self._trigram_index = defaultdict(set)
+
+    def __len__(self):
+        return self._live
+
+    def add(self, job):
+        url = job.get('url')
+        if url and url in self._by_url:
+            self._remove(self._by_url[url])
+        doc_id = len(self.offers)
+        self.offers.append(job)
+        if url:
+            self._by_url[url] = doc_id
+
+        weights = Counter()
+        for token in tokenize(job.get('title')):
+            weights[token] += 1.0
+        for token in tokenize(job.get('company')):
+            weights[token] += self.company_weight
+        for term, weight in weights.items():
+            if term not in self._postings:
+                for trigram in _trigrams(term):
+                    self._trigram_index[trigram].add(term)
+            self._postings[term][doc_id] = weight
+        self._lengths.append(sum(weights.values()))
+        self._terms.append(tuple(weights))
+        self._total_length += self._lengths[doc_id]
+        self._live += 1
+        return doc_id
+
+    def _remove(self, doc_id):
+        for term in self._terms[doc_id]:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._terms[doc_id] = ()
+        self.offers[doc_id] = None
+        self._total_length -= self._lengths[doc_id]
+        self._lengths[doc_id] = 0.0
+        self._live -= 1
+
+    def add_many(self, jobs):
+        for job in jobs:
+            self.add(job)
+        return self
+
+    def _fuzzy_terms(self, term):
+        # Trigrams narrow the vocabulary down to a few candidates, edit distance decides
+        candidates = Counter()
+        for gram in _trigrams(term):
+            for candidate in self._trigram_index.get(gram, ()):
+                candidates[candidate] += 1
+        max_distance = 1 if len(term) <= 5 else 2
+        return [
+            candidate for candidate, shared in candidates.items()
+            if shared >= FUZZY_MIN_SHARED_TRIGRAMS and abs(len(candidate) - len(term)) <= max_distance
+            and _edit_distance(term, candidate) <= max_distance
+        ]
+
+    def expand_query(self, query):
+        '''Query terms with their weights: exact terms 1.0, synonyms and fuzzy matches less.'''
+        weights = {}
+        for term in tokenize(query):
+            weights[term] = 1.0
+            for synonym in _synonyms.get(term, ()):
+                weights.setdefault(synonym, SYNONYM_WEIGHT)
+            if term not in self._postings:
+                for fuzzy in self._fuzzy_terms(term):
+                    weights.setdefault(fuzzy, FUZZY_WEIGHT)
+                    for synonym in _synonyms.get(fuzzy, ()):
+                        weights.setdefault(synonym, FUZZY_WEIGHT * SYNONYM_WEIGHT)
+        return weights
+
+    def scores(self, query):
+        live = self._live
+        if not live:
+            return {}
+        avg_length = self._total_length / live or 1.0
+        scores = defaultdict(float)
+        for term, query_weight in self.expand_query(query).items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (live - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] += query_weight * idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k=5, vector_scores=None, rrf_k=60):
+        '''
+        Top-k offers for `query`. When `vector_scores` (offer url -> similarity) is given the
+        keyword and vector rankings are merged with reciprocal rank fusion.
+        '''
+        keyword_scores = self.scores(query)
+        if not vector_scores:
+            ranked = heapq.nlargest(k, keyword_scores.items(), key=lambda item: item[1])
+            return [dict(self.offers[doc_id], score=round(score, 4)) for doc_id, score in ranked]
+
+        fused = defaultdict(float)
+        keyword_ranking = sorted(keyword_scores, key=keyword_scores.get, reverse=True)
+        for rank, doc_id in enumerate(keyword_ranking):
+            fused[doc_id] += 1 / (rrf_k + rank + 1)
+        vector_ranking = sorted(vector_scores, key=vector_scores.get, reverse=True)
+        for rank, url in enumerate(vector_ranking):
+            doc_id = self._by_url.get(url)
+            if doc_id is not None and self.offers[doc_id] is not None:
+                fused[doc_id] += 1 / (rrf_k + rank + 1)
+        ranked = heapq.nlargest(k, fused.items(), key=lambda item: item[1])
+        return [dict(self.offers[doc_id], score=round(score, 4)) for doc_id, score in ranked]
+
+
+def load_jobs():
+    return get_catalog().iter_offers()
+
+
+_index = None
+_synced_at = 0.0
+_index_lock = threading.Lock()
+
+
+def _sync():
+    global _index, _synced_at
+    catalog = get_catalog()
+    last_change = catalog.last_change()
+    if _index is None:
+        _index = TitleIndex().add_many(load_jobs())
+    elif last_change > _synced_at:
+        # Replaces offers by URL, so re-reading one written while the index was built is harmless
+        _index.add_many(catalog.changed_since(_synced_at))
+    _synced_at = max(_synced_at, last_change)
+    return _index
+
+
+def get_title_index():
+    '''
+    Process-wide index over the scraped offer catalog, built on first use. Every call adds the
+    offers scraped or changed since (by this process or a separate pipeline run), which costs one
+    indexed query when nothing changed. Blocking: async code goes through `run_blocking`.
+    '''
+    with _index_lock:
+        return _sync()
+
+
+def search_offers(query, k=5, vector_scores=None):
+    '''`TitleIndex.search` over the up-to-date catalog index; refreshes never race a search.'''
+    with _index_lock:
+        return _sync().search(query, k=k, vector_scores=vector_scores)
+
+
+def _short_description(description, limit=160):
+    description = ' '.join((description or '').split())
+    sentence = re.split(r'(?<=[.!?])\s', description, maxsplit=1)[0]
+    if len(sentence) > limit:
+        sentence = sentence[:limit].rsplit(' ', 1)[0] + '…'
+    return sentence
+
+
+def format_offers(offers):
+    lines = []
+    for i, offer in enumerate(offers, 1):
+        lines.append(f"{i}. {offer.get('title', 'Unknown Position')}")
+        if offer.get('company'):
+            lines.append(f"   🏢 {offer['company']}")
+        if offer.get('location'):
+            lines.append(f"   📍 {offer['location']}")
+        summary = _short_description(offer.get('description'))
+        if summary:
+            lines.append(f"   {summary}")
+        if offer.get('url'):
+            lines.append(f"   🔗 {offer['url']}")
+        lines.append('')
+    return '\n'.join(lines).strip()
@@ -1,11 +1,47 @@
+import os
+
 from langchain.prompts import PromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+PROMPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 def load_prompt(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
+    with open(os.path.join(PROMPTS_DIR, file_path), "r", encoding="utf-8") as f:
         return f.read()
 
-prompt_text = load_prompt("generate_cv_prompt.txt")
+
+def load_hub_prompt(name, fallback):
+    # The local copy is the default so startup never depends on the hub being reachable;
+    # set PULL_HUB_PROMPTS=1 to refresh from the hub (still falling back on failure)
+    if os.environ.get("PULL_HUB_PROMPTS") != "1":
+        return fallback
+    try:
+        from langchain import hub
+        return hub.pull(name)
+    except Exception as e:
+        print(f"Could not pull {name} from the hub, using the local copy: {e}")
+        return fallback
+
+
+prompt_text = load_prompt("generate_cv.txt")
 generate_cv_prompt = PromptTemplate(
     input_variables=["context", "input", "additional_comments"],
     template=prompt_text,
-)
\ No newline at end of file
+)
+
+# Local copy of hub prompt "langchain-ai/retrieval-qa-chat"
+retrieval_qa_chat_prompt = load_hub_prompt(
+    "langchain-ai/retrieval-qa-chat",
+    ChatPromptTemplate.from_messages([
+        ("system", load_prompt("retrieval_qa_chat.txt")),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}"),
+    ])
+)
+
+offer_summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are a career advisor. Be brief and concrete."),
+    ("human", "A candidate is looking for: {job_title}\n\nThese offers matched:\n{offers}\n\n"
+              "In two or three sentences, tell the candidate which offers fit best and why."),
+])
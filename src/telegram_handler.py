@@ -1,25 +1,21 @@
-import json
 import os
 
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 
-from src.advisor import get_job_offers_cv
-from src.cv_evaluator import evaluate_cv_quality
-from src.managers.knowledge import ingest_to_knowledge_base, delete_user_embeddings
-from src.writing_cv import generate_cv, create_pdf_from_text
+from src.advisor import astream_job_offers_cv, amatched_job_offers
+from src.managers.executor import serialized_per_user
+from src.managers.knowledge import aingest_to_knowledge_base, adelete_user_embeddings
+from src.managers.metrics import timed, track_command
+from src.managers.scheduler import reject_while_running
+from src.managers.state_store import UserStateStore
+from src.offer_search.matcher import get_matcher, schedule_user_match
+from src.offer_search.title_index import format_offers
+from src.telegram_stream import TelegramMessageStream
+from src.writing_cv import agenerate_cv, agenerate_best_cv, acreate_pdf_from_text
 
-# Simple per-user state machine
-USER_STATES_PATH = 'data/user_states.json'
-if os.path.exists(USER_STATES_PATH):
-    user_states = json.load(open(USER_STATES_PATH))
-else:
-    user_states = {}
-
-
-def save_user_states():
-    with open(USER_STATES_PATH, 'w') as f:
-        json.dump(user_states, f)
+# Simple per-user state machine, persisted per user (see UserStateStore)
+user_states = UserStateStore()
 
 
 base_dir = os.path.dirname(os.path.dirname(__file__))
@@ -33,29 +29,34 @@ start_keyboard = ReplyKeyboardMarkup([['/start']], resize_keyboard=True)
 generate_keyboard = ReplyKeyboardMarkup([['/generate_cv']], resize_keyboard=True)
 
 
+@track_command
+@serialized_per_user
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "👋 Hello! I'm your Career Advisor Bot.\n\n"
         "Send me your CV (as plain text), and then the job offer you'd like to evaluate."
     )
-    user_states[update.effective_user.id] = {"state": "expecting_cv"}
+    await user_states.areset(update.effective_user.id, state="expecting_cv")
 
 
+@track_command
+@serialized_per_user
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text.strip()
 
-    if user_id not in user_states:
+    if not user_states.exists(user_id):
         # update.message.reply_text(reply_markup=start_keyboard)
-        user_states[user_id] = {"state": "expecting_cv"}
+        await user_states.aupdate(user_id, state="expecting_cv")
 
-    state = user_states[user_id].get("state", "expecting_cv")
+    state = user_states.get(user_id).get("state", "expecting_cv")
 
     if state == "expecting_cv":
         await update.message.reply_text("📄 CV received. Embedding and storing...")
-        ingest_to_knowledge_base(text, user_id)
-        user_states[user_id]["state"] = "expecting_job_mode"
-        save_user_states()
+        await aingest_to_knowledge_base(text, user_id)
+        # Offers are ranked against the CV in the background, /find_job shows them right away
+        schedule_user_match(user_id, text)
+        await user_states.aupdate(user_id, state="expecting_job_mode")
         await update.message.reply_text(
             "✅ CV stored.\n\nWould you like to insert a job offer or find a job?",
             reply_markup=ReplyKeyboardMarkup([['/insert_job', '/find_job']], resize_keyboard=True)
@@ -63,10 +64,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif state == "expecting_job_offer":
         await update.message.reply_text("🤖 Analyzing job offer and storing as active job...")
         # Insert offer
-        ingest_to_knowledge_base(text, 'offers')
-        user_states[user_id]["active_job"] = text
-        user_states[user_id]["state"] = "ready"
-        save_user_states()
+        await aingest_to_knowledge_base(text, 'offers')
+        await user_states.aupdate(user_id, active_job=text, state="ready")
         await update.message.reply_text(
             "✅ Job offer stored. You can now generate a tailored CV.",
             reply_markup=main_keyboard
@@ -77,15 +76,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=main_keyboard
         )
     elif state == "expecting_job_title":
-        await update.message.reply_text("🔍 Looking for job offers...")
         job_title = text
-        jobs = get_job_offers_cv(job_title)
-        if len(jobs) < 50:
-            await update.message.reply_text("No jobs found for that title. Try another one.")
+        # Offers appear token by token instead of after the whole answer is generated
+        async with TelegramMessageStream(update.message, placeholder="🔍 Looking for job offers...") as stream:
+            async for token in astream_job_offers_cv(job_title):
+                await stream.push(token)
+            jobs = stream.text
+            if not jobs.strip():
+                await stream.replace("No jobs found for that title. Try another one.")
+        if not jobs.strip():
             return
-        await update.message.reply_text(jobs, reply_markup=main_keyboard)
-        user_states[user_id]["state"] = "ready"
-        save_user_states()
+        await update.message.reply_text("👆 Pick an offer and insert it with /insert_job.", reply_markup=main_keyboard)
+        await user_states.aupdate(user_id, state="ready")
     else:
         await update.message.reply_text(
             "❓ Unexpected input. Please send /start to begin again.",
@@ -93,63 +95,65 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+@track_command
+@reject_while_running("⏳ Your CV is still being written, I'll send it as soon as it's ready.")
+@serialized_per_user
 async def write_cv_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    state = user_states.get(user_id, {}).get("state", "")
-    active_job = user_states.get(user_id, {}).get("active_job")
+    active_job = await user_states.aget_field(user_id, "active_job")
     if not active_job:
         await update.message.reply_text("No job offer selected. Please insert or find a job first.")
         return
-    cv_text = generate_cv(active_job, user_id)
-
-    scoring = 0
-    retries = 3
-    evaluation_string = ""
-    while scoring < 8 or retries < 0:
-        await update.message.reply_text("📝 Generating CV for your selected job...")
-        cv_text = generate_cv(active_job, user_id, additional_comments=evaluation_string)
-
-        await update.message.reply_text("🔍 Evaluating CV quality...")
-        result = evaluate_cv_quality(cv_text)
-        if not result.get('score', False):
-            break
-        evaluation_string += result['details']
-        scoring = result['score']
-        await update.message.reply_text(f"✅ CV Quality Evaluation:\n{result['score']}")
-        retries -= 1
-
-    await update.message.reply_text(f"📄 Generated CV:\n\n{cv_text}",
+
+    async def progress(message):
+        await update.message.reply_text(message)
+
+    # The first candidate is streamed as a live draft, the message ends up holding the best CV
+    async with TelegramMessageStream(update.message, placeholder="📝 Drafting your CV...") as preview:
+        result = await agenerate_best_cv(active_job, user_id, on_progress=progress, on_token=preview.push)
+        cv_text = result['cv']
+        await preview.replace(f"📄 Generated CV:\n\n{cv_text}")
+
+    evaluation = result['score'] if result['evaluated'] else "⚠️ The CV could not be evaluated"
+    await update.message.reply_text(f"✅ CV Quality Evaluation:\n{evaluation}",
                                     reply_markup=main_keyboard)
-    user_states[user_id]["cv"] = cv_text
-    user_states[user_id]["state"] = "ready"
+    await user_states.aupdate(user_id, cv=cv_text, state="ready")
 
 
+@track_command
+@serialized_per_user
 async def clear_embeddings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    delete_user_embeddings(user_id)
-    user_states[user_id] = {"state": "expecting_cv"}
-    save_user_states()
+    await adelete_user_embeddings(user_id)
+    await get_matcher().aforget_user(user_id)
+    await user_states.areset(user_id, state="expecting_cv")
     await update.message.reply_text(
         "🧹 Your data has been cleared. Please send your CV to start again.",
         reply_markup=ReplyKeyboardRemove()
     )
 
 
+@track_command
+@serialized_per_user
 async def insert_job_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_states[user_id]["state"] = "expecting_job_offer"
-    save_user_states()
+    await user_states.aupdate(user_id, state="expecting_job_offer")
     await update.message.reply_text(
         "Please paste the job offer you'd like to use.",
         reply_markup=ReplyKeyboardRemove()
     )
 
 
+@track_command
+@serialized_per_user
 async def find_job_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_states[user_id]["state"] = "expecting_job_title"
-    save_user_states()
+    await user_states.aupdate(user_id, state="expecting_job_title")
+    matches = await amatched_job_offers(user_id)
+    if matches:
+        await update.message.reply_text(f"🎯 Offers matching your CV:\n\n{format_offers(matches)}")
     await update.message.reply_text(
+        "Or insert the job title you are looking for:" if matches else
         "Please insert the job title you are looking for:",
         reply_markup=ReplyKeyboardRemove()
     )
@@ -162,25 +166,28 @@ async def find_job_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #         await update.message.reply_text(text)
 
 
+@track_command
+@reject_while_running("⏳ Your PDF is still being prepared, I'll send it as soon as it's ready.")
+@serialized_per_user
 async def generate_cv_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    if user_states[user_id].get('cv', False):
-        cv_text = generate_cv(user_states[user_id]['active_job'], user_id)
-    cv_text = user_states[user_id]['cv']  # Replace with actual CV text retrieval logic
+    cv_text = await user_states.aget_field(user_id, 'cv')
+    if not cv_text:
+        active_job = await user_states.aget_field(user_id, 'active_job')
+        if not active_job:
+            await update.message.reply_text("No job offer selected. Please insert or find a job first.")
+            return
+        cv_text = await agenerate_cv(active_job, user_id)
 
-    base_dir = os.path.dirname(os.path.dirname(__file__))
     wkhtmltopdf_path = os.path.join(base_dir, "wkhtmltopdf", "bin", "wkhtmltopdf.exe")
-    md_path = f"data/cv_{user_id}.md"
-    pdf_path = f"data/cv_{user_id}.pdf"
 
-    # Generate the PDF
-    pdf_file = create_pdf_from_text(
+    # Generate the PDF (content-addressed, so concurrent requests never overwrite each other)
+    pdf_file = await acreate_pdf_from_text(
         text=cv_text,
-        md_path=md_path,
-        pdf_path=pdf_path,
         wkhtmltopdf_path=wkhtmltopdf_path
     )
 
     # Send the PDF to the user
     with open(pdf_file, "rb") as pdf:
-        await update.message.reply_document(document=pdf, filename="CV.pdf")
+        async with timed("telegram_upload"):
+            await update.message.reply_document(document=pdf, filename="CV.pdf")
@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import os
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from src.managers.metrics import timed
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram tolerates roughly one edit per second per chat before answering with 429
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.0))
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Split text into Telegram-sized parts, preferring line breaks over cutting mid-line."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+class TelegramMessageStream:
+    """
+    Streams growing text into Telegram through throttled `edit_text` calls.
+
+    Tokens are buffered by `push`, a background task applies at most one round of edits per
+    `interval` and honours RetryAfter. Text longer than 4096 characters continues in a new
+    message. Use it as an async context manager; leaving the block flushes the final text.
+    """
+
+    def __init__(self, reply_to: Message, placeholder: str = "⏳ ...", interval: float = STREAM_EDIT_INTERVAL):
+        self._reply_to = reply_to
+        self._placeholder = placeholder
+        self._interval = interval
+        self._text = ""
+        # [message, text currently shown] for every message of the stream
+        self._sent = []
+        self._dirty = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task = None
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def __aenter__(self):
+        message = await self._reply_to.reply_text(self._placeholder)
+        self._sent.append([message, self._placeholder])
+        self._task = asyncio.create_task(self._flush_loop())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Let the flusher finish its current round instead of cancelling it mid-request
+        self._closing.set()
+        self._dirty.set()
+        await self._task
+        await self._sync()
+
+    async def push(self, token: str):
+        self._text += token
+        self._dirty.set()
+
+    async def replace(self, text: str):
+        self._text = text
+        self._dirty.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            await self._sync()
+            if self._closing.is_set():
+                return
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._closing.wait(), self._interval)
+
+    async def _sync(self):
+        if not self._text:
+            return
+        parts = split_message(self._text)
+        for i, part in enumerate(parts):
+            if i < len(self._sent):
+                message, shown = self._sent[i]
+                if shown != part:
+                    await self._call(message.edit_text, part)
+                    self._sent[i][1] = part
+            else:
+                message = await self._call(self._reply_to.reply_text, part)
+                self._sent.append([message, part])
+        # The text got shorter (e.g. replaced by the final answer), drop the extra messages
+        while len(self._sent) > len(parts):
+            message, _ = self._sent.pop()
+            with contextlib.suppress(BadRequest):
+                await message.delete()
+
+    @staticmethod
+    async def _call(method, text):
+        while True:
+            try:
+                async with timed("telegram_api"):
+                    return await method(text)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                await asyncio.sleep(retry_after.total_seconds() if hasattr(retry_after, "total_seconds")
+                                    else retry_after)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return None
+                raise
@@ -1,14 +1,20 @@
+import asyncio
 import markdown
 import os
-import pdfkit
+import shutil
 from dotenv import load_dotenv
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
+from langchain_core.runnables import RunnablePassthrough
+from langchain_openai import ChatOpenAI
 from langsmith import traceable
 
-from src.cv_evaluator import evaluate_cv_quality
+from src.cv_evaluator import evaluate_cv_quality, aevaluate_cv_quality, pre_score_cv
+from src.managers.chains import register_chain, get_chain
+from src.managers.knowledge import user_retriever, astream_answer
+from src.managers.metrics import timed
+from src.managers.pdf_renderer import pdf_renderer
+from src.managers.retrieval_cache import retrieval_session
+from src.managers.scheduler import llm_scheduler
 from src.prompts.prompts import generate_cv_prompt
 
 # Load env & API key
@@ -17,33 +23,154 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise RuntimeError("Brakuje zmiennej środowiskowej OPENAI_API_KEY w .env")
 
-# Init embeddings, vectorstore, chat
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-index_name = os.environ["INDEX_NAME"]
-vectorstore = PineconeVectorStore(index_name=index_name, embedding=embeddings)
+# Share the knowledge base vectorstore (and its cached embeddings), init chat
 chat = ChatOpenAI(temperature=0.7, verbose=True)
 
+# /write_cv: candidates generated in parallel, minimal accepted score, rewrite passes if none passes
+CV_CANDIDATES = int(os.environ.get("CV_CANDIDATES", 3))
+CV_SCORE_THRESHOLD = int(os.environ.get("CV_SCORE_THRESHOLD", 8))
+CV_MAX_REWRITES = int(os.environ.get("CV_MAX_REWRITES", 3))
+# Profile chunks considered for the prompt, and the token budget they are packed into
+CV_CONTEXT_CANDIDATES = int(os.environ.get("CV_CONTEXT_CANDIDATES", 10))
+CV_CONTEXT_TOKENS = int(os.environ.get("CV_CONTEXT_TOKENS", 1500))
 
-@traceable(name="Generate CV")
-def generate_cv(job_description: str, user_id: str = "user_1", additional_comments: str = ""):
-    # Build retrieval → generation chain
-    retriever = vectorstore.as_retriever(search_kwargs={"filter": {"user_id": user_id}, "k": 5})
-    prompt_template = generate_cv_prompt
 
-    stuff_chain = create_stuff_documents_chain(chat, prompt_template)
-    qa_chain = create_retrieval_chain(
-        retriever=retriever,
-        combine_docs_chain=stuff_chain
+def _build_cv_chain():
+    # Build retrieval → generation chain
+    stuff_chain = create_stuff_documents_chain(chat, generate_cv_prompt)
+    return (
+        RunnablePassthrough.assign(context=user_retriever(k=CV_CONTEXT_CANDIDATES, token_budget=CV_CONTEXT_TOKENS))
+        .assign(answer=stuff_chain)
     )
-    result = qa_chain.invoke({
+
+
+register_chain("generate_cv", _build_cv_chain)
+
+
+def _generation_key(inputs: dict, candidate: int) -> tuple:
+    # Identical requests in flight at the same time are generated once
+    return "generate_cv", str(inputs["user_id"]), inputs["input"], inputs["additional_comments"], candidate
+
+
+@traceable(name="Generate CV")
+@timed("generate_cv")
+def generate_cv(job_description: str, user_id: str = "user_1", additional_comments: str = "", candidate: int = 0):
+    inputs = {
         "input": job_description,
+        "user_id": user_id,
         "additional_comments": additional_comments
-    })
+    }
+    result = llm_scheduler.run_sync(get_chain("generate_cv").invoke, inputs,
+                                    key=_generation_key(inputs, candidate), user_id=user_id)
     return result["answer"]
 
 
-def create_pdf_from_text(text: str, md_path: str = "cv.md", pdf_path: str = "data/cv.pdf",
-                         wkhtmltopdf_path: str = None) -> str:
+@traceable(name="Generate CV")
+@timed("generate_cv")
+async def agenerate_cv(job_description: str, user_id: str = "user_1", additional_comments: str = "",
+                       candidate: int = 0):
+    inputs = {
+        "input": job_description,
+        "user_id": user_id,
+        "additional_comments": additional_comments
+    }
+    result = await llm_scheduler.run(get_chain("generate_cv").ainvoke, inputs,
+                                     key=_generation_key(inputs, candidate), user_id=user_id)
+    return result["answer"]
+
+
+@traceable(name="Generate CV")
+async def astream_cv(job_description: str, user_id: str = "user_1", additional_comments: str = ""):
+    inputs = {
+        "input": job_description,
+        "user_id": user_id,
+        "additional_comments": additional_comments
+    }
+    async for token in llm_scheduler.stream(astream_answer(get_chain("generate_cv"), inputs), user_id):
+        yield token
+
+
+@timed("generate_cv")
+async def _agenerate_streamed_cv(job_description: str, user_id: str, on_token) -> str:
+    parts = []
+    async for token in astream_cv(job_description, user_id):
+        parts.append(token)
+        await on_token(token)
+    return "".join(parts)
+
+
+def _score(evaluation: dict) -> int:
+    score = evaluation.get("score")
+    return -1 if score is None else score
+
+
+@traceable(name="Generate Best CV")
+async def agenerate_best_cv(job_description: str, user_id: str = "user_1", candidates: int = CV_CANDIDATES,
+                            threshold: int = CV_SCORE_THRESHOLD, max_rewrites: int = CV_MAX_REWRITES,
+                            on_progress=None, on_token=None) -> dict:
+    """
+    Generate `candidates` CVs and evaluate them concurrently, keep the best-scoring one and only
+    fall back to feedback-driven rewrites when none reaches `threshold`.
+
+    `on_progress` is an optional coroutine function receiving short status messages, `on_token`
+    one receiving the tokens of the first candidate as they are generated (a live preview).
+    """
+    async def progress(message):
+        if on_progress:
+            await on_progress(message)
+
+    # All candidates share one retrieval of the user's CV context
+    with retrieval_session():
+        await progress(f"📝 Generating {candidates} CV candidate(s) for your selected job...")
+        # Distinct candidate numbers, or the scheduler would merge the identical requests into one
+        generations = [agenerate_cv(job_description, user_id, candidate=i)
+                       for i in range(bool(on_token), candidates)]
+        if on_token:
+            generations.insert(0, _agenerate_streamed_cv(job_description, user_id, on_token))
+        drafts = await asyncio.gather(*generations, return_exceptions=True)
+        drafts = [draft for draft in drafts if not isinstance(draft, BaseException)]
+        if not drafts:
+            raise RuntimeError("All CV candidates failed to generate")
+
+        await progress("🔍 Evaluating CV quality...")
+        evaluations = await asyncio.gather(*[aevaluate_cv_quality(draft, job_description) for draft in drafts],
+                                           return_exceptions=True)
+        evaluated = [(draft, evaluation) for draft, evaluation in zip(drafts, evaluations)
+                     if not isinstance(evaluation, BaseException)]
+        if evaluated:
+            # Drafts whose judge call failed have no score comparable with the others
+            best_cv, best_evaluation = max(evaluated, key=lambda pair: _score(pair[1]))
+        else:
+            # Every judge call failed: keep the draft the local pre-check likes best, unscored,
+            # so it can neither pass the threshold nor be rewritten blindly
+            best_cv = max(drafts, key=lambda draft: pre_score_cv(draft, job_description)["score"])
+            best_evaluation = {"score": None, "details": "The CV could not be evaluated.", "source": "unevaluated"}
+
+        rewrites = 0
+        feedback = ""
+        evaluation = best_evaluation
+        # A missing score means the judge answer could not be parsed, rewriting would be blind
+        while _score(best_evaluation) < threshold and evaluation.get("score") is not None \
+                and rewrites < max_rewrites:
+            await progress(f"✅ Best score so far: {best_evaluation['score']}. Rewriting with feedback...")
+            feedback += evaluation["details"]
+            cv_text = await agenerate_cv(job_description, user_id, additional_comments=feedback)
+            evaluation = await aevaluate_cv_quality(cv_text, job_description)
+            if _score(evaluation) >= _score(best_evaluation):
+                best_cv, best_evaluation = cv_text, evaluation
+            rewrites += 1
+
+    return {
+        "cv": best_cv,
+        "score": best_evaluation.get("score"),
+        "details": best_evaluation.get("details"),
+        "evaluated": best_evaluation.get("source") != "unevaluated",
+        "candidates": len(drafts),
+        "rewrites": rewrites,
+    }
+
+
+def render_cv_html(text: str) -> str:
     # 1) Konwersja na Markdown
     md_lines = []
     lines = text.splitlines()
@@ -99,17 +226,27 @@ def create_pdf_from_text(text: str, md_path: str = "cv.md", pdf_path: str = "dat
       </body>
     </html>
     """
-    # Generowanie PDF z HTML
-    # Jeśli wkhtmltopdf nie jest w PATH, podaj ścieżkę:
-    config = None
-    if wkhtmltopdf_path:
-        config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
-    options = {"encoding": "UTF-8"}
-    pdfkit.from_string(html, pdf_path, configuration=config, options=options)
+    return html
 
+
+@timed("render_pdf")
+def create_pdf_from_text(text: str, md_path: str = "cv.md", pdf_path: str = None,
+                         wkhtmltopdf_path: str = None) -> str:
+    # Generowanie PDF z HTML przez wspólny renderer (pula + cache po hashu HTML)
+    # Jeśli wkhtmltopdf nie jest w PATH, podaj ścieżkę:
+    cached_pdf = pdf_renderer.render(render_cv_html(text), wkhtmltopdf_path)
+    if not pdf_path:
+        return cached_pdf
+    shutil.copyfile(cached_pdf, pdf_path)
     return os.path.abspath(pdf_path)
 
 
+@timed("render_pdf")
+async def acreate_pdf_from_text(text: str, wkhtmltopdf_path: str = None) -> str:
+    # Returns the cached, content-addressed PDF; unchanged CVs are not rendered again
+    return await pdf_renderer.arender(render_cv_html(text), wkhtmltopdf_path)
+
+
 # PRZYKŁAD UŻYCIA:
 if __name__ == "__main__":
     job_desc = (